@@ -1,26 +1,64 @@
+import asyncio
 import base64
 import io
 import os
+import random
 import tempfile
+import threading
 import time
-import wave
-from typing import Optional
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
 
+import numpy as np
 import uvicorn
-from fastapi import Depends, FastAPI, File, HTTPException, Header, Request, UploadFile
-from fastapi.responses import JSONResponse
-from starlette.background import BackgroundTask
+from fastapi import Depends, FastAPI, File, HTTPException, Header, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.formparsers import MultiPartParser
 from starlette.middleware.cors import CORSMiddleware
 
+from audio import iter_wav_chunks, pcm16_to_float32, read_wav_bytes, resample
+from batching import OfflineBatcher
+from inference_pool import InferencePool, PoolFull
+from jobs import PRIORITIES, JobRunner, JobStore
+from longform import iter_speech_segments, join_segments, transcribe_segments
+import metrics
+import profiling
+import tracing
+from prefork import available_cpus, plan_workers
+from preload import Preloader, load_manifest, parse_preload_models
+from streaming import BacklogFull, OnlineSchedulerPool, StreamingSession
+from transcript_cache import TranscriptCache, audio_digest
+from url_fetch import ByteFeed, FetchCancelled, FetchError, FetchTooLarge, UrlFetcher
+import model
 from model import (
-    decode,
+    accept_waveform_chunk,
+    create_vad,
+    decode_offline_streams_sherpa_onnx,
+    decode_samples,
+    finish_stream,
     get_pretrained_model,
+    is_online_recognizer,
+    registry,
     sample_rate,
+    supports_batch_decode,
+    supports_incremental_input,
+    warm_up,
 )
 
 import subprocess
 import shutil
-import urllib.request
+
+if __name__ == "__main__":
+    # Run the module body below only once, as "api_server". Otherwise
+    # `python api_server.py` would build a second copy of the pools and
+    # register the registry callbacks twice when uvicorn or the pre-fork
+    # server imports the app.
+    import api_server
+
+    api_server.main()
+    raise SystemExit(0)
 
 
 APP_NAME = "vi-asr"
@@ -38,6 +76,13 @@ def _env_int(name: str, default: int) -> int:
         return default
 
 
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
 def _env_bool(name: str, default: bool) -> bool:
     v = os.getenv(name)
     if v is None:
@@ -53,72 +98,506 @@ DEFAULT_NUM_ACTIVE_PATHS = _env_int("NUM_ACTIVE_PATHS", 15)
 MAX_DURATION_SEC = _env_int("MAX_DURATION_SEC", 60)
 REQUIRE_API_KEY = _env_bool("REQUIRE_API_KEY", False)
 API_KEY = os.getenv("API_KEY", "")
+# Concurrent requests for the same model are decoded together
+BATCH_MAX_SIZE = _env_int("BATCH_MAX_SIZE", 8)
+BATCH_MAX_WAIT_MS = _env_float("BATCH_MAX_WAIT_MS", 10.0)
+# Maximum number of inputs in one /v1/transcribe/batch request
+BATCH_MAX_ITEMS = _env_int("BATCH_MAX_ITEMS", 32)
+# Server processes (see prefork.py) and ONNX Runtime threads per session.
+# THREADING_POLICY=throughput runs many single-threaded decodes side by side,
+# latency gives one decode all cores; empty keeps NUM_THREADS and
+# INFERENCE_WORKERS as configured. MODEL_NUM_THREADS overrides NUM_THREADS
+# per model, e.g. "repo_a=4,repo_b=1".
+WORKERS = _env_int("WORKERS", 1)
+THREADING_POLICY = _env_str("THREADING_POLICY", "").lower()
+NUM_THREADS = _env_int("NUM_THREADS", 2)
+MODEL_NUM_THREADS = _env_str("MODEL_NUM_THREADS", "")
+PLAN = plan_workers(
+    available_cpus(),
+    NUM_THREADS,
+    workers=WORKERS,
+    prefork=WORKERS != 1,
+    policy=THREADING_POLICY,
+)
+# Blocking work (ffmpeg, model loading, decoding) runs on this many threads;
+# at most INFERENCE_QUEUE_SIZE more requests may wait before we answer 503.
+INFERENCE_WORKERS = _env_int(
+    "INFERENCE_WORKERS",
+    PLAN.inference_workers if THREADING_POLICY or WORKERS != 1 else 4,
+)
+INFERENCE_QUEUE_SIZE = _env_int("INFERENCE_QUEUE_SIZE", 16)
+RETRY_AFTER_SEC = _env_int("RETRY_AFTER_SEC", 1)
+MAX_UPLOAD_MB = _env_int("MAX_UPLOAD_MB", 64)
+# Feed compressed uploads into the recognizer while ffmpeg is still decoding
+FFMPEG_STREAMING = _env_bool("FFMPEG_STREAMING", True)
+FFMPEG_CHUNK_BYTES = int(0.2 * sample_rate) * 2  # 200 ms of s16le
+# ffmpeg is killed after this long, e.g. when it stalls on corrupt input
+FFMPEG_TIMEOUT_SEC = _env_int("FFMPEG_TIMEOUT_SEC", 300)
+# /v1/stream needs a streaming (online) model; there is no Vietnamese one yet
+STREAM_REPO_ID = _env_str(
+    "STREAM_MODEL_REPO_ID",
+    "csukuangfj/sherpa-onnx-streaming-zipformer-bilingual-zh-en-2023-02-20",
+)
+STREAM_DECODING_METHOD = _env_str("STREAM_DECODING_METHOD", "greedy_search")
+MAX_STREAMS = _env_int("MAX_STREAMS", 64)
+# All live streams of a model are decoded together on one scheduler thread
+STREAM_MAX_BATCH_SIZE = _env_int("STREAM_MAX_BATCH_SIZE", 32)
+STREAM_TICK_BUDGET_MS = _env_float("STREAM_TICK_BUDGET_MS", 50.0)
+# Audio a connection may send ahead of decoding before it is closed
+STREAM_MAX_PENDING_SEC = _env_float("STREAM_MAX_PENDING_SEC", 30.0)
+# ?long_form=true cuts recordings at silences with a VAD and decodes the
+# segments, so they may be much longer than MAX_DURATION_SEC.
+LONG_FORM_MAX_DURATION_SEC = _env_int("LONG_FORM_MAX_DURATION_SEC", 4 * 3600)
+VAD_MODEL = _env_str("VAD_MODEL", "")
+VAD_MIN_SILENCE_SEC = _env_float("VAD_MIN_SILENCE_SEC", 0.5)
+VAD_MAX_SEGMENT_SEC = _env_float("VAD_MAX_SEGMENT_SEC", 20.0)
+# Least recently used models are unloaded beyond these limits (0 = no limit)
+MAX_LOADED_MODELS = _env_int("MAX_LOADED_MODELS", 8)
+MODEL_MEMORY_BUDGET_MB = _env_int("MODEL_MEMORY_BUDGET_MB", 0)
+# Serve all decoding methods of a model from one loaded copy of its weights.
+# The response reports the decoding method that was actually used.
+SHARE_SEARCH_VARIANTS = _env_bool("SHARE_SEARCH_VARIANTS", False)
+# Models loaded and warmed up at startup; /readyz waits for all of them.
+# PRELOAD_MODELS: comma separated repo_id[:decoding_method[:num_active_paths]];
+# set it to an empty value, "none" or "off" to preload nothing.
+PRELOAD_MODELS = os.getenv(
+    "PRELOAD_MODELS",
+    f"{DEFAULT_REPO_ID}:{DEFAULT_DECODING_METHOD}:{DEFAULT_NUM_ACTIVE_PATHS}",
+)
+PRELOAD_MANIFEST = _env_str("PRELOAD_MANIFEST", "")
+PRELOAD_WORKERS = _env_int("PRELOAD_WORKERS", 4)
+
+# Results of repeated uploads; TRANSCRIPT_CACHE_SIZE=0 disables the cache
+TRANSCRIPT_CACHE_SIZE = _env_int("TRANSCRIPT_CACHE_SIZE", 1024)
+TRANSCRIPT_CACHE_MB = _env_float("TRANSCRIPT_CACHE_MB", 64)
+TRANSCRIPT_CACHE_TTL_SEC = _env_int("TRANSCRIPT_CACHE_TTL_SEC", 24 * 3600)
+TRANSCRIPT_CACHE_DIR = _env_str("TRANSCRIPT_CACHE_DIR", "")
+TRANSCRIPT_CACHE_DISK_MB = _env_float("TRANSCRIPT_CACHE_DISK_MB", 1024)
+
+# audio_url downloads; idle connections are kept open for reuse
+FETCH_TIMEOUT_SEC = _env_float("FETCH_TIMEOUT_SEC", 60.0)
+FETCH_CONNECT_TIMEOUT_SEC = _env_float("FETCH_CONNECT_TIMEOUT_SEC", 5.0)
+FETCH_MAX_CONNECTIONS = _env_int("FETCH_MAX_CONNECTIONS", 100)
+FETCH_MAX_KEEPALIVE = _env_int("FETCH_MAX_KEEPALIVE", 20)
+
+# Asynchronous jobs (/v1/jobs). Each process runs up to JOB_CONCURRENCY jobs,
+# and only starts one while requests and running jobs together leave more
+# than JOB_RESERVED_WORKERS inference workers idle. Keep JOB_CONCURRENCY
+# below INFERENCE_WORKERS so that a long job never holds all of them;
+# JOB_CONCURRENCY=0 only accepts jobs.
+JOBS_DIR = _env_str("JOBS_DIR", "data/jobs")
+JOB_CONCURRENCY = _env_int("JOB_CONCURRENCY", max(1, INFERENCE_WORKERS // 2))
+JOB_RESERVED_WORKERS = _env_int("JOB_RESERVED_WORKERS", min(1, INFERENCE_WORKERS - 1))
+JOB_LEASE_SEC = _env_float("JOB_LEASE_SEC", 60.0)
+JOB_MAX_ATTEMPTS = _env_int("JOB_MAX_ATTEMPTS", 3)
+JOB_RETENTION_SEC = _env_int("JOB_RETENTION_SEC", 7 * 24 * 3600)
+
+# Request profiling. Clients may ask for a breakdown with ?profile=1 or an
+# "X-Profile: 1" header if PROFILE_REQUESTS is on; PROFILE_SAMPLE_RATE of
+# all requests are profiled in the background and written to PROFILE_DIR
+# if they took at least PROFILE_MIN_MS. PROFILE_CPROFILE adds cProfile
+# statistics to both.
+PROFILE_REQUESTS = _env_bool("PROFILE_REQUESTS", False)
+PROFILE_SAMPLE_RATE = _env_float("PROFILE_SAMPLE_RATE", 0.0)
+PROFILE_MIN_MS = _env_float("PROFILE_MIN_MS", 0.0)
+PROFILE_DIR = _env_str("PROFILE_DIR", "data/profiles")
+PROFILE_CPROFILE = _env_bool("PROFILE_CPROFILE", False)
+
+# Tracing: TRACE_EXPORTER=file appends OTLP/JSON to TRACE_FILE, =otlp posts
+# it to TRACE_OTLP_ENDPOINT; empty disables tracing. Requests with a
+# traceparent header follow the caller's sampling decision.
+TRACE_EXPORTER = _env_str("TRACE_EXPORTER", "")
+TRACE_FILE = _env_str("TRACE_FILE", "data/traces/spans.jsonl")
+TRACE_OTLP_ENDPOINT = _env_str("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SAMPLE_RATE = _env_float("TRACE_SAMPLE_RATE", 1.0)
+
 
+def _observe_stage(stage: str, seconds: float, trace: bool = True) -> None:
+    """
+    Record a stage that ends now in the metrics, the request profile and,
+    if trace is true, as a span of the current trace.
+    """
+    metrics.observe_stage(stage, seconds)
+    profiling.record(stage, seconds)
+    if trace:
+        tracing.record(stage, seconds)
 
-def _ffmpeg_convert_to_wav(in_path: str) -> str:
-    out_path = f"{in_path}.wav"
+
+@contextmanager
+def _stage(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    # A live span, so that spans opened inside nest under it
+    with tracing.span(stage):
+        try:
+            yield
+        finally:
+            _observe_stage(stage, time.perf_counter() - start, trace=False)
+
+
+def _ffmpeg_args(input_arg: str) -> list:
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        input_arg,
+        "-f",
+        "s16le",
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        str(sample_rate),
+        "-ac",
+        "1",
+        "pipe:1",
+    ]
+
+
+def _ffmpeg_decode(data: bytes) -> np.ndarray:
+    """
+    Decode any format ffmpeg understands to 16 kHz mono float32 samples.
+    The input is piped through stdin; a temp file is only used for
+    containers that ffmpeg cannot read without seeking, e.g. mp4/m4a with
+    the moov atom at the end.
+    """
+    start = time.perf_counter()
     try:
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-hide_banner",
-                "-loglevel",
-                "error",
-                "-i",
-                in_path,
-                "-ar",
-                str(sample_rate),
-                "-ac",
-                "1",
-                out_path,
-                "-y",
-            ],
-            check=True,
+        proc = subprocess.run(
+            _ffmpeg_args("pipe:0"),
+            input=data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=FFMPEG_TIMEOUT_SEC,
         )
+        if proc.returncode != 0 or not proc.stdout:
+            with tempfile.NamedTemporaryFile(prefix="audio_") as f:
+                f.write(data)
+                f.flush()
+                proc = subprocess.run(
+                    _ffmpeg_args(f.name),
+                    check=True,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    timeout=max(1.0, FFMPEG_TIMEOUT_SEC - (time.perf_counter() - start)),
+                )
     except FileNotFoundError:
         raise HTTPException(status_code=500, detail="ffmpeg not found in PATH")
+    except subprocess.TimeoutExpired:
+        raise HTTPException(status_code=504, detail=f"ffmpeg timed out after {FFMPEG_TIMEOUT_SEC}s")
     except subprocess.CalledProcessError as e:
         raise HTTPException(status_code=400, detail=f"ffmpeg failed: {e}")
-    return out_path
+    finally:
+        _observe_stage("ffmpeg", time.perf_counter() - start)
+    return pcm16_to_float32(np.frombuffer(proc.stdout, dtype="<i2"))
+
+
+def _as_bytes(data) -> bytes:
+    """Wait for a ByteFeed to finish downloading and return all of it."""
+    return data.read_all() if isinstance(data, ByteFeed) else data
+
+
+def _buffer_wav(data):
+    """
+    Return a downloading WAV file as bytes once it is complete, since it is
+    parsed in-process from the whole file. Other formats stay a ByteFeed,
+    which is piped into ffmpeg as it arrives.
+    """
+    if isinstance(data, ByteFeed):
+        header = data.peek(12)
+        if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+            return data.read_all()
+    return data
+
+
+def _load_audio(data) -> np.ndarray:
+    """
+    Return 16 kHz mono float32 samples. PCM and float WAV are decoded and
+    resampled in-process; everything else goes through ffmpeg.
+    """
+    data = _as_bytes(data)
+    start = time.perf_counter()
+    wav = read_wav_bytes(data)
+    if wav is None:
+        return _ffmpeg_decode(data)
+
+    samples, wav_sample_rate = wav
+    samples = resample(samples, wav_sample_rate, sample_rate)
+    _observe_stage("wav_read", time.perf_counter() - start)
+    return samples
+
+
+class _FfmpegPipeUnreadable(Exception):
+    """ffmpeg failed before producing any output when reading from a pipe."""
+
+
+def _read_tail(pipe, tail: bytearray, limit: int = 16384) -> None:
+    """Read pipe to EOF, keeping only its last limit bytes in tail."""
+    for block in iter(lambda: pipe.read(4096), b""):
+        tail += block
+        del tail[:-limit]
+
+
+def _iter_ffmpeg_chunks(
+    data,
+    max_samples: int,
+    input_path: Optional[str] = None,
+    timeout_sec: Optional[float] = None,
+) -> Iterator[np.ndarray]:
+    """
+    Run ffmpeg over data (or over the file input_path) and yield the decoded
+    16 kHz mono float32 samples in 200 ms chunks while it is still running.
+    data may be a ByteFeed, which is written to ffmpeg as it arrives.
+    ffmpeg is killed if the caller stops iterating early, or once
+    timeout_sec (FFMPEG_TIMEOUT_SEC by default) have passed.
 
+    Raises:
+      _FfmpegPipeUnreadable if ffmpeg could not read data from a pipe at
+      all; the caller should retry with a temp file.
+    """
+    # Time spent waiting for ffmpeg, not for the consumer of the chunks
+    ffmpeg_sec = 0.0
+    start = time.perf_counter()
+    try:
+        proc = subprocess.Popen(
+            _ffmpeg_args(input_path or "pipe:0"),
+            stdin=subprocess.DEVNULL if input_path else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=500, detail="ffmpeg not found in PATH")
+
+    def _write_stdin():
+        try:
+            if isinstance(data, ByteFeed):
+                for chunk in data:
+                    proc.stdin.write(chunk)
+            else:
+                proc.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg exited early; its exit code tells us what happened
+            pass
+        except FetchError:
+            # The download failed or was cancelled; the request handler
+            # reports that
+            proc.kill()
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    writer = None
+    if not input_path:
+        writer = threading.Thread(target=_write_stdin, daemon=True)
+        writer.start()
+
+    # Read stderr as it comes; ffmpeg blocks once the pipe buffer is full,
+    # e.g. with one decode error per frame of a corrupt file
+    stderr = bytearray()
+    stderr_reader = threading.Thread(
+        target=_read_tail, args=(proc.stderr, stderr), daemon=True
+    )
+    stderr_reader.start()
+
+    timed_out = threading.Event()
 
-def _read_wav_duration(path: str) -> float:
-    with wave.open(path, "rb") as f:
-        frames = f.getnframes()
-        rate = f.getframerate()
-        return frames / float(rate)
+    def _kill():
+        timed_out.set()
+        proc.kill()
 
+    watchdog = threading.Timer(timeout_sec or FFMPEG_TIMEOUT_SEC, _kill)
+    watchdog.daemon = True
+    watchdog.start()
 
-async def _save_upload_to_temp(upload: UploadFile) -> str:
-    suffix = os.path.splitext(upload.filename or "audio")[1]
-    fd, tmp_path = tempfile.mkstemp(prefix="upload_", suffix=suffix)
-    os.close(fd)
-    with open(tmp_path, "wb") as f:
+    num_samples = 0
+    finished = False
+    try:
         while True:
-            chunk = await upload.read(1024 * 1024)
+            chunk = proc.stdout.read(FFMPEG_CHUNK_BYTES)
+            ffmpeg_sec += time.perf_counter() - start
             if not chunk:
                 break
-            f.write(chunk)
-    await upload.close()
-    return tmp_path
+            if isinstance(data, ByteFeed) and data.cancelled:
+                raise FetchCancelled("cancelled")
+            pcm = np.frombuffer(chunk, dtype="<i2", count=len(chunk) // 2)
+            num_samples += len(pcm)
+            if num_samples > max_samples:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Audio too long: > {max_samples // sample_rate}s",
+                )
+            yield pcm16_to_float32(pcm)
+            start = time.perf_counter()
+        finished = True
+    finally:
+        watchdog.cancel()
+        if not finished:
+            proc.kill()
+        start = time.perf_counter()
+        proc.wait()
+        stderr_reader.join()
+        if writer is not None and finished and not timed_out.is_set():
+            # Otherwise it may still wait for a download; it is a daemon
+            # and exits once the request cancels the feed
+            writer.join()
+        _observe_stage("ffmpeg", ffmpeg_sec + time.perf_counter() - start)
 
+    if timed_out.is_set():
+        raise HTTPException(
+            status_code=504,
+            detail=f"ffmpeg timed out after {timeout_sec or FFMPEG_TIMEOUT_SEC}s",
+        )
+    if num_samples == 0 and not input_path:
+        # Some mp4/m4a files even make ffmpeg exit with 0 and no output
+        raise _FfmpegPipeUnreadable()
+    if proc.returncode != 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"ffmpeg failed: {stderr.decode(errors='replace').strip()}",
+        )
 
-def _save_bytes_to_temp(data: bytes, suffix: str = "") -> str:
-    fd, tmp_path = tempfile.mkstemp(prefix="audio_", suffix=suffix)
-    os.close(fd)
-    with open(tmp_path, "wb") as f:
-        f.write(data)
-    return tmp_path
 
+def _ffmpeg_decode_into_stream(data, recognizer, stream, max_samples: int) -> int:
+    """
+    Pipe data through ffmpeg and feed the decoded PCM into stream chunk by
+    chunk while ffmpeg is still running, so feature extraction (and, for
+    online recognizers, decoding) overlaps with transcoding.
 
-def _fetch_url_to_temp(url: str) -> str:
-    fd, tmp_path = tempfile.mkstemp(prefix="url_", suffix="")
-    os.close(fd)
+    Returns:
+      Return the number of samples fed, or -1 if ffmpeg could not read data
+      from a pipe at all (the caller should then use _ffmpeg_decode()).
+    """
+    num_samples = 0
     try:
-        urllib.request.urlretrieve(url, tmp_path)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to fetch URL: {e}")
-    return tmp_path
+        for samples in _iter_ffmpeg_chunks(data, max_samples):
+            num_samples += len(samples)
+            with profiling.span("accept_waveform"):
+                accept_waveform_chunk(recognizer, stream, samples, sample_rate)
+    except _FfmpegPipeUnreadable:
+        return -1
+    return num_samples
+
+
+def _build_stream(recognizer, data):
+    """
+    Create a stream for recognizer and feed it all of the audio in data,
+    which is bytes or a ByteFeed.
+
+    Returns:
+      Return a tuple (stream, num_samples) with 16 kHz sample count.
+    """
+    max_samples = MAX_DURATION_SEC * sample_rate
+    with profiling.span("create_stream"):
+        stream = recognizer.create_stream()
+
+    data = _buffer_wav(data)
+    start = time.perf_counter()
+    wav = read_wav_bytes(data) if isinstance(data, bytes) else None
+    if wav is not None:
+        samples, wav_sample_rate = wav
+        samples = resample(samples, wav_sample_rate, sample_rate)
+        _observe_stage("wav_read", time.perf_counter() - start)
+    else:
+        if FFMPEG_STREAMING:
+            num_samples = _ffmpeg_decode_into_stream(
+                data, recognizer, stream, max_samples
+            )
+            if num_samples >= 0:
+                return stream, num_samples
+        samples = _ffmpeg_decode(_as_bytes(data))
+
+    if len(samples) > max_samples:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Audio too long: {len(samples) / sample_rate:.2f}s > {MAX_DURATION_SEC}s",
+        )
+    with profiling.span("accept_waveform"):
+        accept_waveform_chunk(recognizer, stream, samples, sample_rate)
+    return stream, len(samples)
+
+
+def _iter_audio_chunks(data, max_samples: int) -> Iterator[np.ndarray]:
+    """Yield data as 16 kHz mono float32 chunks without decoding it all at once."""
+    data = _buffer_wav(data)
+    chunks = iter_wav_chunks(data, sample_rate) if isinstance(data, bytes) else None
+    if chunks is not None:
+        num_samples = 0
+        for samples in chunks:
+            num_samples += len(samples)
+            if num_samples > max_samples:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Audio too long: > {max_samples // sample_rate}s",
+                )
+            yield samples
+        return
+
+    # Long-form audio is consumed as fast as it is decoded, so ffmpeg may
+    # run for as long as decoding the whole recording takes
+    timeout_sec = max(FFMPEG_TIMEOUT_SEC, max_samples / sample_rate)
+    try:
+        yield from _iter_ffmpeg_chunks(data, max_samples, timeout_sec=timeout_sec)
+    except _FfmpegPipeUnreadable:
+        with tempfile.NamedTemporaryFile(prefix="audio_") as f:
+            f.write(_as_bytes(data))
+            f.flush()
+            yield from _iter_ffmpeg_chunks(
+                data, max_samples, input_path=f.name, timeout_sec=timeout_sec
+            )
+
+
+def _transcribe_long_form(recognizer, data, batch_key):
+    """
+    Cut data into speech segments with a VAD and decode them. Segments of
+    offline sherpa-onnx models go through the batcher, where they are
+    decoded together with each other and with concurrent requests while
+    this thread keeps reading audio.
+
+    Returns:
+      Return a tuple (segments, num_samples).
+    """
+    vad = create_vad(
+        min_silence_duration=VAD_MIN_SILENCE_SEC,
+        max_speech_duration=VAD_MAX_SEGMENT_SEC,
+        model=VAD_MODEL,
+    )
+    num_samples = 0
+
+    def _counted(chunks):
+        nonlocal num_samples
+        for samples in chunks:
+            num_samples += len(samples)
+            yield samples
+
+    batched = BATCH_MAX_SIZE > 1 and supports_batch_decode(recognizer)
+
+    def _submit(samples: np.ndarray) -> Future:
+        if batched:
+            stream = recognizer.create_stream()
+            stream.accept_waveform(sample_rate, samples)
+            return _batcher.submit(batch_key, recognizer, stream)
+
+        fut = Future()
+        fut.set_result(decode_samples(recognizer, samples, sample_rate))
+        return fut
+
+    chunks = _iter_audio_chunks(data, LONG_FORM_MAX_DURATION_SEC * sample_rate)
+    segments = transcribe_segments(
+        iter_speech_segments(_counted(chunks), vad, sample_rate),
+        _submit,
+        max_pending=2 * BATCH_MAX_SIZE,
+    )
+    return segments, num_samples
+
+
+def _is_authorized(authorization: Optional[str], token: Optional[str] = None) -> bool:
+    if not REQUIRE_API_KEY:
+        return True
+    if authorization and authorization.startswith("Bearer "):
+        token = authorization.split(" ", 1)[1]
+    return bool(token) and token == API_KEY
 
 
 def _require_auth(authorization: Optional[str]) -> None:
@@ -131,8 +610,107 @@ def _require_auth(authorization: Optional[str]) -> None:
         raise HTTPException(status_code=403, detail="Invalid API key")
 
 
+# Keep multipart uploads in memory instead of spooling them to a temp file,
+# so the request path never touches the filesystem.
+MultiPartParser.spool_max_size = MAX_UPLOAD_MB * 1024 * 1024
+
 app = FastAPI(title=APP_NAME)
 
+_batcher = OfflineBatcher(
+    decode_offline_streams_sherpa_onnx,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+)
+
+_pool = InferencePool(
+    num_workers=INFERENCE_WORKERS,
+    max_queue=INFERENCE_QUEUE_SIZE,
+    on_change=metrics.pool_changed,
+    on_wait=lambda sec: _observe_stage("queue_wait", sec),
+)
+
+_stream_schedulers = OnlineSchedulerPool(
+    max_batch_size=STREAM_MAX_BATCH_SIZE,
+    tick_budget_ms=STREAM_TICK_BUDGET_MS,
+)
+
+_fetcher = UrlFetcher(
+    max_bytes=MAX_UPLOAD_MB * 1024 * 1024,
+    timeout_sec=FETCH_TIMEOUT_SEC,
+    connect_timeout_sec=FETCH_CONNECT_TIMEOUT_SEC,
+    max_connections=FETCH_MAX_CONNECTIONS,
+    max_keepalive=FETCH_MAX_KEEPALIVE,
+)
+
+_job_store = JobStore(JOBS_DIR, max_attempts=JOB_MAX_ATTEMPTS)
+
+_cache = TranscriptCache(
+    max_entries=TRANSCRIPT_CACHE_SIZE,
+    max_mb=TRANSCRIPT_CACHE_MB,
+    ttl_sec=TRANSCRIPT_CACHE_TTL_SEC,
+    disk_dir=TRANSCRIPT_CACHE_DIR,
+    disk_max_mb=TRANSCRIPT_CACHE_DISK_MB,
+)
+
+if TRACE_EXPORTER == "file":
+    tracing.configure(tracing.Exporter(tracing.file_writer(TRACE_FILE), APP_NAME), TRACE_SAMPLE_RATE)
+elif TRACE_EXPORTER == "otlp":
+    tracing.configure(tracing.Exporter(tracing.otlp_http_writer(TRACE_OTLP_ENDPOINT), APP_NAME), TRACE_SAMPLE_RATE)
+elif TRACE_EXPORTER:
+    raise ValueError(f"Unknown TRACE_EXPORTER: {TRACE_EXPORTER}. Use 'file' or 'otlp'")
+
+
+def _parse_model_threads(spec: str) -> dict:
+    threads = {}
+    for item in spec.split(","):
+        if item.strip():
+            repo_id, _, n = item.partition("=")
+            threads[repo_id.strip()] = int(n)
+    return threads
+
+
+model.num_threads = PLAN.threads_per_session
+if not THREADING_POLICY and WORKERS == 1:
+    # Per-model overrides only apply without a policy or pre-forking
+    model.model_num_threads.update(_parse_model_threads(MODEL_NUM_THREADS))
+
+registry.configure(
+    max_models=MAX_LOADED_MODELS,
+    memory_budget_mb=MODEL_MEMORY_BUDGET_MB,
+    share_variants=SHARE_SEARCH_VARIANTS,
+)
+registry.on_evict.append(_stream_schedulers.release)
+registry.on_evict.append(lambda _: metrics.MODEL_EVICTIONS.inc())
+registry.on_lookup.append(
+    lambda key, hit: metrics.MODEL_LOOKUPS.labels("hit" if hit else "miss").inc()
+)
+registry.on_load.append(
+    lambda key, load_sec: metrics.MODEL_LOADS.labels(key[0]).observe(load_sec)
+)
+
+
+def _preload_model(repo_id: str, decoding_method: str, num_active_paths: int):
+    recognizer, key = registry.get_with_key(repo_id, decoding_method, num_active_paths)
+    # Preloaded models are never evicted
+    registry.pin(key)
+    return recognizer
+
+
+_preload_entries = parse_preload_models(
+    PRELOAD_MODELS, DEFAULT_DECODING_METHOD, DEFAULT_NUM_ACTIVE_PATHS
+)
+if PRELOAD_MANIFEST:
+    _preload_entries += load_manifest(
+        PRELOAD_MANIFEST, DEFAULT_DECODING_METHOD, DEFAULT_NUM_ACTIVE_PATHS
+    )
+
+_preloader = Preloader(
+    _preload_entries,
+    load=_preload_model,
+    warm_up=warm_up,
+    num_workers=PRELOAD_WORKERS,
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -142,17 +720,80 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def _trace_requests(request: Request, call_next):
+    if not tracing.enabled():
+        return await call_next(request)
+
+    with tracing.server_span(
+        f"{request.method} {request.url.path}",
+        request.headers.get("traceparent"),
+        **{"http.request.method": request.method, "url.path": request.url.path},
+    ) as span:
+        response = await call_next(request)
+        if span is not None:
+            route = request.scope.get("route")
+            if route is not None:
+                span.name = f"{request.method} {route.path}"
+                span.set_attributes(**{"http.route": route.path})
+            span.set_attributes(**{"http.response.status_code": response.status_code})
+            if response.status_code >= 500:
+                span.set_error(f"HTTP {response.status_code}")
+            response.headers["traceresponse"] = span.traceparent
+        return response
+
+
+@app.middleware("http")
+async def _http_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template, e.g. /v1/jobs/{job_id}, keeps the label set small
+        route = request.scope.get("route")
+        method, path = (request.method, route.path) if route is not None else ("other", "unmatched")
+        metrics.HTTP_REQUESTS.labels(method, path, str(status)).inc()
+        metrics.HTTP_REQUEST_SECONDS.labels(method, path).observe(time.perf_counter() - start)
+
+
 @app.on_event("startup")
 def _warm_model() -> None:
-    try:
-        _ = get_pretrained_model(
-            DEFAULT_REPO_ID,
-            decoding_method=DEFAULT_DECODING_METHOD,
-            num_active_paths=DEFAULT_NUM_ACTIVE_PATHS,
-        )
-    except Exception as e:
-        # Defer crash to readiness unless strictly required
-        print(f"[startup] Failed to warm model: {e}")
+    # Load in the background so /healthz answers right away; failures are
+    # reported by /readyz.
+    _preloader.start()
+
+
+@app.on_event("startup")
+def _start_jobs() -> None:
+    if JOB_CONCURRENCY > 0:
+        _job_runner.start()
+
+
+@app.on_event("shutdown")
+async def _stop_jobs() -> None:
+    # Before the pool goes away; unfinished jobs are picked up again
+    # once their lease expires
+    await _job_runner.stop()
+
+
+@app.on_event("shutdown")
+def _stop_batcher() -> None:
+    _batcher.shutdown()
+    _stream_schedulers.stop()
+    _pool.shutdown()
+
+
+@app.on_event("shutdown")
+async def _close_fetcher() -> None:
+    await _fetcher.aclose()
+
+
+@app.on_event("shutdown")
+def _stop_tracing() -> None:
+    tracing.shutdown()
 
 
 @app.get("/healthz")
@@ -162,15 +803,37 @@ def healthz():
 
 @app.get("/readyz")
 def readyz():
-    try:
-        _ = get_pretrained_model(
-            DEFAULT_REPO_ID,
-            decoding_method=DEFAULT_DECODING_METHOD,
-            num_active_paths=DEFAULT_NUM_ACTIVE_PATHS,
+    models = _preloader.status()
+    if _preloader.ready:
+        return {"status": "ready", "models": models}
+    if _preloader.failed:
+        raise HTTPException(
+            status_code=500,
+            detail={"status": "Model not ready: preload failed", "models": models},
         )
-        return {"status": "ready"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Model not ready: {e}")
+    raise HTTPException(
+        status_code=503,
+        detail={"status": "warming up", "models": models},
+    )
+
+
+@app.get("/v1/models")
+def models(authorization: Optional[str] = Header(None)):
+    _require_auth(authorization)
+    return {
+        "models": registry.entries(),
+        "total_rss_mb": round(registry.total_rss_bytes() / (1 << 20), 1),
+        "max_models": registry.max_models,
+        "memory_budget_mb": registry.memory_budget_mb,
+        "transcript_cache": _cache.stats(),
+    }
+
+
+@app.get("/metrics")
+def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    _require_auth(authorization)
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 
 @app.post("/v1/transcribe")
@@ -180,102 +843,770 @@ async def transcribe(
 ):
     _require_auth(authorization)
 
-    content_type = request.headers.get("content-type", "")
-    src = "unknown"
-    cleanup_paths = []
+    profile, in_response, save = _new_profile(request)
+    try:
+        with _pool.admit():
+            if profile is None:
+                return await _transcribe(request)
+            with profiling.activate(profile):
+                return await _transcribe(request, profile if in_response else None)
+    except PoolFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, please retry later",
+            headers={"Retry-After": str(RETRY_AFTER_SEC)},
+        )
+    finally:
+        if save:
+            await _save_profile(profile)
 
-    decoding_method = request.query_params.get("decoding_method", DEFAULT_DECODING_METHOD)
+
+def _new_profile(request: Request) -> Tuple[Optional[profiling.RequestProfile], bool, bool]:
+    """
+    Returns:
+      Return a tuple (profile, in_response, save). profile is None unless
+      the request is profiled; in_response is true if the client asked for
+      the breakdown, and save if the profile goes to PROFILE_DIR.
+    """
+    truthy = ("1", "true", "yes")
+    in_response = PROFILE_REQUESTS and (
+        request.query_params.get("profile", "").lower() in truthy
+        or request.headers.get("x-profile", "").lower() in truthy
+    )
+    sampled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    if not (in_response or sampled):
+        return None, False, False
+    profile = profiling.RequestProfile(cprofile=PROFILE_CPROFILE)
+    # cProfile statistics are too big for the response
+    return profile, in_response, bool(PROFILE_DIR) and (sampled or PROFILE_CPROFILE)
+
+
+async def _save_profile(profile: profiling.RequestProfile) -> None:
+    if 1000 * profile.total_sec < PROFILE_MIN_MS:
+        return
     try:
-        num_active_paths = int(request.query_params.get("num_active_paths", DEFAULT_NUM_ACTIVE_PATHS))
-    except ValueError:
-        num_active_paths = DEFAULT_NUM_ACTIVE_PATHS
-    repo_id = request.query_params.get("repo_id", DEFAULT_REPO_ID)
+        filename = await asyncio.get_running_loop().run_in_executor(
+            None, profile.dump, PROFILE_DIR
+        )
+    except OSError as e:
+        print(f"[profile] Failed to write to {PROFILE_DIR}: {e}")
+        return
+    print(f"[profile] {1000 * profile.total_sec:.0f} ms: {filename}")
+
+
+def _response(result: dict, inference_sec: float, repo_id: str, src: str, cached: bool = False) -> dict:
+    rtf = inference_sec / max(result["duration_sec"], 1e-6)
+    resp = {
+        "text": result["text"],
+        "duration_sec": result["duration_sec"],
+        "inference_sec": round(inference_sec, 3),
+        "rtf": round(rtf, 3),
+        "model_repo": repo_id,
+        "decoding_method": result["decoding_method"],
+        "num_active_paths": result["num_active_paths"],
+        "source": src,
+        "language": "vi",
+        "cached": cached,
+    }
+    if "segments" in result:
+        resp["segments"] = result["segments"]
+    return resp
 
-    in_path = None
+
+async def _decode(recognizer, model_key, audio, long_form: bool):
+    """
+    Args:
+      audio:
+        The encoded audio as bytes, or a ByteFeed that is still receiving it.
+
+    Returns:
+      Return a tuple (text, duration_sec, segments); segments is None
+      unless long_form is true.
+    """
+    if long_form:
+        with _stage("long_form"):
+            segments, num_samples = await _pool.run(
+                profiling.call,
+                _transcribe_long_form,
+                recognizer,
+                audio,
+                model_key,
+            )
+        del audio
+        return join_segments(segments), num_samples / sample_rate, segments
+
+    if supports_incremental_input(recognizer):
+        # Audio decoding overlaps with feature extraction here, so it is
+        # part of inference_sec.
+        stream, num_samples = await _pool.run(profiling.call, _build_stream, recognizer, audio)
+        del audio
+        duration = num_samples / sample_rate
+
+        with _stage("decode"):
+            if BATCH_MAX_SIZE > 1 and supports_batch_decode(recognizer):
+                fut = _batcher.submit(
+                    model_key,
+                    recognizer,
+                    stream,
+                )
+                text = await asyncio.wrap_future(fut)
+            else:
+                text = await _pool.run(profiling.call, finish_stream, recognizer, stream)
+        return text, duration, None
+
+    samples = await _pool.run(profiling.call, _load_audio, audio)
+    del audio
+    duration = len(samples) / sample_rate
+    if duration > MAX_DURATION_SEC:
+        raise HTTPException(status_code=413, detail=f"Audio too long: {duration:.2f}s > {MAX_DURATION_SEC}s")
+
+    with _stage("decode"):
+        text = await _pool.run(
+            profiling.call, decode_samples, recognizer, samples, sample_rate
+        )
+    return text, duration, None
+
+
+def _get_model(repo_id: str, decoding_method: str, num_active_paths: int):
+    with _stage("model_lookup"):
+        return registry.get_with_key(repo_id, decoding_method, num_active_paths)
+
+
+async def _cache_get(cache_key: str) -> Optional[dict]:
+    # A memory miss reads the disk tier, which must not block the event loop
+    if _cache.disk_dir:
+        cached = await _pool.run(_cache.get, cache_key)
+    else:
+        cached = _cache.get(cache_key)
+    metrics.TRANSCRIPT_CACHE_LOOKUPS.labels("miss" if cached is None else "hit").inc()
+    return cached
+
+
+async def _cache_put(cache_key: str, result: dict) -> None:
+    if _cache.disk_dir:
+        await _pool.run(_cache.put, cache_key, result)
+    else:
+        _cache.put(cache_key, result)
+
+
+def _counted(resp: dict) -> dict:
+    """
+    Count a successful transcription in the metrics and the current span,
+    and return resp.
+    """
+    tracing.set_attributes(**{
+        "asr.duration_sec": resp["duration_sec"],
+        "asr.cached": resp["cached"],
+    })
+    labels = (resp["model_repo"], resp["decoding_method"])
+    metrics.TRANSCRIPTIONS.labels(*labels, resp["source"], str(resp["cached"]).lower()).inc()
+    if not resp["cached"]:
+        metrics.AUDIO_SECONDS.labels(*labels).inc(resp["duration_sec"])
+    return resp
+
+
+async def _await_download(download: "asyncio.Future") -> None:
+    try:
+        await download
+    except FetchTooLarge:
+        raise HTTPException(status_code=413, detail=f"Upload too large: > {MAX_UPLOAD_MB} MB")
+    except FetchError as e:
+        raise HTTPException(status_code=400, detail=f"Failed to fetch URL: {e}")
+
+
+def _discard(fut: "asyncio.Future") -> None:
+    """Stop waiting for fut and drop its result or error."""
+    fut.cancel()
+    fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+def _int_option(name: str, value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid option: {name} must be an integer, got {value!r}")
+
+
+def _request_options(request: Request) -> dict:
+    return {
+        "repo_id": request.query_params.get("repo_id", DEFAULT_REPO_ID),
+        "decoding_method": request.query_params.get("decoding_method", DEFAULT_DECODING_METHOD),
+        "num_active_paths": _int_option(
+            "num_active_paths",
+            request.query_params.get("num_active_paths", DEFAULT_NUM_ACTIVE_PATHS),
+        ),
+        "long_form": request.query_params.get("long_form", "").lower() in ("1", "true", "yes"),
+    }
+
+
+def _json_options(data: dict, options: dict) -> dict:
+    """Override options with those given in a JSON object."""
+    return {
+        "repo_id": data.get("repo_id", options["repo_id"]),
+        "decoding_method": data.get("decoding_method", options["decoding_method"]),
+        "num_active_paths": _int_option(
+            "num_active_paths", data.get("num_active_paths", options["num_active_paths"])
+        ),
+        "long_form": bool(data.get("long_form", options["long_form"])),
+    }
+
+
+def _audio_from_json(data: dict):
+    """
+    Returns:
+      Return a tuple (audio, src, download). For an audio_url, audio is a
+      ByteFeed that the task download is filling; otherwise download is
+      None.
+    """
+    if "audio_url" in data:
+        feed = ByteFeed()
+        download = asyncio.ensure_future(
+            _fetcher.fetch_into(str(data["audio_url"]), feed, headers=tracing.inject({}))
+        )
+        start = time.perf_counter()
+        download.add_done_callback(
+            lambda _: _observe_stage("download", time.perf_counter() - start)
+        )
+        return feed, "url", download
+    if "audio_base64" in data:
+        try:
+            audio = base64.b64decode(data["audio_base64"], validate=True)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid base64: unable to decode")
+        return audio, "base64", None
+    raise HTTPException(status_code=400, detail="Provide 'audio_url' or 'audio_base64' in JSON body, or send multipart with 'file'")
+
+
+async def _transcribe(
+    request: Request, profile: Optional[profiling.RequestProfile] = None
+) -> JSONResponse:
+    """
+    Args:
+      profile:
+        If given, its breakdown is added to the response as "profile".
+    """
+    content_type = request.headers.get("content-type", "")
+    options = _request_options(request)
+    download = None
+    start = time.perf_counter()
 
     try:
         if "multipart/form-data" in content_type:
             form = await request.form()
-            file: UploadFile = form.get("file")
-            if not isinstance(file, UploadFile):
+            file = form.get("file")
+            if not isinstance(file, StarletteUploadFile):
                 raise HTTPException(status_code=400, detail="Missing file in form-data under key 'file'")
-            in_path = await _save_upload_to_temp(file)
+            audio_bytes = await file.read()
+            await file.close()
             src = "upload"
         elif "application/json" in content_type:
             data = await request.json()
             if not isinstance(data, dict):
                 raise HTTPException(status_code=400, detail="Invalid JSON body")
-            if "audio_url" in data:
-                in_path = _fetch_url_to_temp(str(data["audio_url"]))
-                src = "url"
-            elif "audio_base64" in data:
-                try:
-                    audio_bytes = base64.b64decode(data["audio_base64"], validate=True)
-                except Exception:
-                    raise HTTPException(status_code=400, detail="Invalid base64: unable to decode")
-                in_path = _save_bytes_to_temp(audio_bytes)
-                src = "base64"
-            else:
-                raise HTTPException(status_code=400, detail="Provide 'audio_url' or 'audio_base64' in JSON body, or send multipart with 'file'")
             # Override options if provided in JSON
-            decoding_method = data.get("decoding_method", decoding_method)
-            num_active_paths = int(data.get("num_active_paths", num_active_paths))
-            repo_id = data.get("repo_id", repo_id)
+            options = _json_options(data, options)
+            audio_bytes, src, download = _audio_from_json(data)
+        elif content_type.startswith("audio/") or "application/octet-stream" in content_type:
+            audio_bytes = await request.body()
+            src = "body"
         else:
-            raise HTTPException(status_code=415, detail="Unsupported Content-Type. Use multipart/form-data or application/json")
+            raise HTTPException(status_code=415, detail="Unsupported Content-Type. Use multipart/form-data, application/json or a raw audio body")
+        _observe_stage("receive", time.perf_counter() - start)
+
+        result = _transcribe_audio(audio_bytes, src, download=download, **options)
+        # Only the coroutine holds on to the audio from here on
+        del audio_bytes
+        result = await result
+        if profile is not None:
+            result["profile"] = profile.to_dict()
+        with _stage("response"):
+            return JSONResponse(result)
+    except HTTPException:
+        # pass through
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        cleanup_paths.append(in_path)
-        wav_path = _ffmpeg_convert_to_wav(in_path)
-        cleanup_paths.append(wav_path)
 
-        duration = _read_wav_duration(wav_path)
-        if duration > MAX_DURATION_SEC:
-            raise HTTPException(status_code=413, detail=f"Audio too long: {duration:.2f}s > {MAX_DURATION_SEC}s")
+@tracing.traced("transcribe")
+async def _transcribe_audio(
+    audio,
+    src: str,
+    repo_id: str,
+    decoding_method: str,
+    num_active_paths: int,
+    long_form: bool,
+    download: Optional["asyncio.Future"] = None,
+) -> dict:
+    """
+    Transcribe one input and return the response body.
+
+    Args:
+      audio:
+        The encoded audio as bytes, or a ByteFeed that download is filling.
+    """
+    try:
+        feed = audio if download is not None else None
+        if isinstance(audio, bytes) and len(audio) > MAX_UPLOAD_MB * 1024 * 1024:
+            raise HTTPException(status_code=413, detail=f"Upload too large: > {MAX_UPLOAD_MB} MB")
 
         start = time.time()
-        recognizer = get_pretrained_model(
-            repo_id,
-            decoding_method=decoding_method,
-            num_active_paths=num_active_paths,
+        try:
+            requested_key = registry.key(repo_id, decoding_method, num_active_paths)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        tracing.set_attributes(**{
+            "asr.repo_id": repo_id,
+            "asr.decoding_method": decoding_method,
+            "asr.num_active_paths": int(num_active_paths),
+            "asr.long_form": long_form,
+            "asr.source": src,
+        })
+
+        cache_key = None
+        if _cache.enabled and download is None:
+            digest = await _pool.run(audio_digest, audio)
+            cache_key = _cache.key(digest, requested_key, long_form)
+            cached = await _cache_get(cache_key)
+            if cached is not None:
+                return _counted(_response(cached, time.time() - start, repo_id, src, cached=True))
+
+        recognizer, model_key = await _pool.run(
+            profiling.call, _get_model, repo_id, decoding_method, num_active_paths
         )
-        text = decode(recognizer, wav_path)
-        end = time.time()
+        if model_key != requested_key:
+            # Served by another search variant of the same weights
+            decoding_method = model_key[1]
+            num_active_paths = model_key[2] or num_active_paths
 
-        inference_sec = end - start
-        rtf = inference_sec / max(duration, 1e-6)
+        decoding = asyncio.ensure_future(
+            _decode(recognizer, model_key, audio, long_form)
+        )
+        del audio
+
+        if download is not None:
+            # The audio is decoded while it is still being downloaded
+            try:
+                await _await_download(download)
+            except BaseException:
+                feed.cancel()
+                _discard(decoding)
+                raise
+
+            if _cache.enabled:
+                digest = await _pool.run(audio_digest, feed.read_all())
+                cache_key = _cache.key(digest, requested_key, long_form)
+                cached = await _cache_get(cache_key)
+                if cached is not None:
+                    feed.cancel()
+                    _discard(decoding)
+                    return _counted(_response(cached, time.time() - start, repo_id, src, cached=True))
+
+        text, duration, segments = await decoding
+        end = time.time()
 
-        resp = {
+        result = {
             "text": text,
             "duration_sec": round(duration, 3),
-            "inference_sec": round(inference_sec, 3),
-            "rtf": round(rtf, 3),
-            "model_repo": repo_id,
             "decoding_method": decoding_method,
             "num_active_paths": int(num_active_paths),
-            "source": src,
-            "language": "vi",
         }
+        if segments is not None:
+            result["segments"] = segments
+        if cache_key is not None:
+            await _cache_put(cache_key, result)
 
-        def _cleanup(paths):
-            for p in paths:
-                try:
-                    if p and os.path.exists(p):
-                        os.remove(p)
-                except Exception:
-                    pass
+        return _counted(_response(result, end - start, repo_id, src))
+    finally:
+        if download is not None and not download.done():
+            download.cancel()
+            _discard(download)
 
-        return JSONResponse(resp, background=BackgroundTask(_cleanup, cleanup_paths))
-    except HTTPException:
-        # pass through
-        raise
+
+@app.post("/v1/transcribe/batch")
+async def transcribe_batch(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Transcribe several inputs in one request: multipart/form-data with any
+    number of 'file' parts, or JSON {"items": [{"audio_url": ...} or
+    {"audio_base64": ...}, ...]}. Query (and top-level JSON) options apply
+    to every item; JSON items may override them.
+
+    Items are normalized concurrently, so those for the same model meet in
+    the batcher and are decoded together. Results are returned in order,
+    each with either the usual response fields or "error" and
+    "status_code".
+    """
+    _require_auth(authorization)
+
+    content_type = request.headers.get("content-type", "")
+    options = _request_options(request)
+
+    if "multipart/form-data" in content_type:
+        form = await request.form()
+        files = [f for f in form.getlist("file") if isinstance(f, StarletteUploadFile)]
+        if not files:
+            raise HTTPException(status_code=400, detail="Missing files in form-data under key 'file'")
+        items = [_upload_item(f, options) for f in files]
+    elif "application/json" in content_type:
+        data = await request.json()
+        if not isinstance(data, dict) or not isinstance(data.get("items"), list) or not data["items"]:
+            raise HTTPException(status_code=400, detail="Provide a non-empty list 'items' in JSON body")
+        options = _json_options(data, options)
+        items = [_json_item(item, options) for item in data["items"]]
+    else:
+        raise HTTPException(status_code=415, detail="Unsupported Content-Type. Use multipart/form-data or application/json")
+
+    if len(items) > BATCH_MAX_ITEMS:
+        for item in items:
+            item.close()
+        raise HTTPException(status_code=413, detail=f"Too many items: {len(items)} > {BATCH_MAX_ITEMS}")
+
+    start = time.time()
+    try:
+        # One slot per item, as long as the batch fits into the pool at all
+        with _pool.admit(min(len(items), _pool.capacity)):
+            results = await asyncio.gather(
+                *(_batch_result(i, item) for i, item in enumerate(items))
+            )
+    except PoolFull:
+        for item in items:
+            item.close()
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, please retry later",
+            headers={"Retry-After": str(RETRY_AFTER_SEC)},
+        )
+
+    return {
+        "results": results,
+        "num_items": len(results),
+        "num_failed": sum(1 for r in results if "error" in r),
+        "inference_sec": round(time.time() - start, 3),
+    }
+
+
+async def _upload_item(file: StarletteUploadFile, options: dict) -> dict:
+    audio = await file.read()
+    await file.close()
+    return await _transcribe_audio(audio, "upload", **options)
+
+
+async def _json_item(item, options: dict) -> dict:
+    if not isinstance(item, dict) or not ("audio_url" in item or "audio_base64" in item):
+        raise HTTPException(status_code=400, detail="Each item must be an object with 'audio_url' or 'audio_base64'")
+    options = _json_options(item, options)
+    audio, src, download = _audio_from_json(item)
+    return await _transcribe_audio(audio, src, download=download, **options)
+
+
+async def _batch_result(index: int, item) -> dict:
+    try:
+        return {"index": index, **await item}
+    except HTTPException as e:
+        return {"index": index, "status_code": e.status_code, "error": e.detail}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        return {"index": index, "status_code": 500, "error": str(e)}
 
 
-if __name__ == "__main__":
+@app.post("/v1/jobs", status_code=202)
+async def submit_job(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Queue a transcription. Takes the same inputs and options as
+    /v1/transcribe, plus ?priority=high|normal|low (or "priority" in JSON).
+    URLs are fetched when the job runs.
+    """
+    _require_auth(authorization)
+
+    content_type = request.headers.get("content-type", "")
+    options = _request_options(request)
+    priority = request.query_params.get("priority", "normal")
+    audio = None
+    job = {}
+
+    if "multipart/form-data" in content_type:
+        form = await request.form()
+        file = form.get("file")
+        if not isinstance(file, StarletteUploadFile):
+            raise HTTPException(status_code=400, detail="Missing file in form-data under key 'file'")
+        audio = await file.read()
+        await file.close()
+        job["src"] = "upload"
+    elif "application/json" in content_type:
+        data = await request.json()
+        if not isinstance(data, dict):
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        options = _json_options(data, options)
+        priority = data.get("priority", priority)
+        if "audio_url" in data:
+            job["src"] = "url"
+            job["audio_url"] = str(data["audio_url"])
+        else:
+            # Validates audio_base64
+            audio, job["src"], _ = _audio_from_json(data)
+    elif content_type.startswith("audio/") or "application/octet-stream" in content_type:
+        audio = await request.body()
+        job["src"] = "body"
+    else:
+        raise HTTPException(status_code=415, detail="Unsupported Content-Type. Use multipart/form-data, application/json or a raw audio body")
+
+    if audio is not None and len(audio) > MAX_UPLOAD_MB * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"Upload too large: > {MAX_UPLOAD_MB} MB")
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid priority: {priority}. Use one of {', '.join(PRIORITIES)}")
+    try:
+        registry.key(options["repo_id"], options["decoding_method"], options["num_active_paths"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job["options"] = options
+    if tracing.current() is not None:
+        # The job continues the trace of the request that submitted it
+        job["traceparent"] = tracing.current().traceparent
+    job_id = await asyncio.to_thread(_job_store.submit, job, audio, priority)
+    _job_runner.notify()
+    return {"job_id": job_id, "state": "queued", "priority": priority}
+
+
+@app.get("/v1/jobs/{job_id}")
+async def job_status(job_id: str, authorization: Optional[str] = Header(None)):
+    _require_auth(authorization)
+    job = await asyncio.to_thread(_job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    job.pop("result", None)
+    return job
+
+
+@app.get("/v1/jobs/{job_id}/result")
+async def job_result(job_id: str, authorization: Optional[str] = Header(None)):
+    """The transcription of a finished job, or the error it failed with."""
+    _require_auth(authorization)
+    job = await asyncio.to_thread(_job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job["state"] == "failed":
+        raise HTTPException(status_code=job["status_code"] or 500, detail=job["error"])
+    if job["state"] != "done":
+        raise HTTPException(
+            status_code=409,
+            detail={"status": f"Job is {job['state']}", "state": job["state"]},
+            headers={"Retry-After": str(RETRY_AFTER_SEC)},
+        )
+    return {"job_id": job_id, **job["result"]}
+
+
+async def _run_job(job: dict) -> dict:
+    """
+    A job takes an admission slot like a request, so that running jobs
+    count in the can_start check of _job_runner. Once started, its calls
+    share the pool's first-come queue with those of requests: requests only
+    take priority in that no job is started unless more than
+    JOB_RESERVED_WORKERS workers are idle.
+    """
+    request = job["request"]
+    try:
+        with _pool.admit():
+            return await _run_admitted_job(job, request)
+    except PoolFull:
+        # Requests took the slots since can_start was checked
+        raise HTTPException(status_code=503, detail="Server busy, please resubmit the job")
+
+
+async def _run_admitted_job(job: dict, request: dict) -> dict:
+    with tracing.server_span("job", request.get("traceparent"), **{"asr.job_id": job["job_id"]}):
+        download = None
+        if job["audio_path"]:
+            audio = await asyncio.to_thread(_read_file, job["audio_path"])
+        else:
+            audio, _, download = _audio_from_json(request)
+
+        result = _transcribe_audio(audio, request["src"], download=download, **request["options"])
+        del audio
+        return await result
+
+
+def _read_file(filename: str) -> bytes:
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+_job_runner = JobRunner(
+    _job_store,
+    run=_run_job,
+    # Synchronous requests come first: start jobs only on idle workers
+    can_start=lambda: _pool.in_flight + JOB_RESERVED_WORKERS < _pool.num_workers,
+    concurrency=JOB_CONCURRENCY,
+    lease_sec=JOB_LEASE_SEC,
+    retention_sec=JOB_RETENTION_SEC,
+)
+
+
+async def _close_stream(websocket: WebSocket, code: int, detail: str) -> None:
+    """Send an error event to an accepted websocket and close it."""
+    await websocket.send_json({"type": "error", "detail": detail})
+    await websocket.close(code=code)
+
+
+@app.websocket("/v1/stream")
+async def stream(websocket: WebSocket):
+    """
+    Live recognition. The client sends binary frames of mono PCM (s16le by
+    default, or f32le with ?encoding=f32le) at ?sample_rate= (default 16000),
+    and a text frame "Done" after the last chunk. The server answers with
+    JSON messages {"type": "partial"|"final", "segment", "text", "audio_sec"}.
+
+    Browsers cannot set headers on WebSocket requests, so the API key may
+    also be passed as ?api_key=.
+    """
+    params = websocket.query_params
+    if not _is_authorized(
+        websocket.headers.get("authorization"), params.get("api_key")
+    ):
+        await websocket.close(code=1008, reason="Invalid API key")
+        return
+    if _stream_schedulers.num_sessions() >= MAX_STREAMS:
+        await websocket.close(code=1013, reason="Too many streams, retry later")
+        return
+
+    repo_id = params.get("repo_id", STREAM_REPO_ID)
+    decoding_method = params.get("decoding_method", STREAM_DECODING_METHOD)
+    encoding = params.get("encoding", "s16le")
+    try:
+        num_active_paths = int(params.get("num_active_paths", 4))
+        client_sample_rate = int(params.get("sample_rate", sample_rate))
+    except ValueError:
+        await websocket.close(code=1003, reason="Invalid query parameter")
+        return
+    if client_sample_rate <= 0:
+        await websocket.close(code=1003, reason="sample_rate must be positive")
+        return
+    if encoding not in ("s16le", "f32le"):
+        await websocket.close(code=1003, reason="encoding must be s16le or f32le")
+        return
+
+    loop = asyncio.get_running_loop()
+    events_queue: asyncio.Queue = asyncio.Queue()
+
+    def _on_events(events, done):
+        loop.call_soon_threadsafe(events_queue.put_nowait, (events, done))
+
+    await websocket.accept()
+    try:
+        with _pool.admit():
+            recognizer = await _pool.run(
+                get_pretrained_model,
+                repo_id,
+                decoding_method=decoding_method,
+                num_active_paths=num_active_paths,
+            )
+            if not is_online_recognizer(recognizer):
+                raise ValueError(f"{repo_id} is not a streaming model")
+            session = await _pool.run(
+                StreamingSession, recognizer, _on_events, STREAM_MAX_PENDING_SEC
+            )
+    except PoolFull:
+        await _close_stream(websocket, 1013, "Server busy, please retry later")
+        return
+    except ValueError as e:
+        await _close_stream(websocket, 1003, str(e))
+        return
+    except Exception as e:
+        await _close_stream(websocket, 1011, f"Failed to load {repo_id}: {e}")
+        return
+
+    async def _send_events() -> bool:
+        """Return True if the session ended with an error event."""
+        failed = False
+        while True:
+            events, done = await events_queue.get()
+            for event in events:
+                failed = failed or event["type"] == "error"
+                await websocket.send_json(event)
+            if done:
+                return failed
+
+    scheduler = _stream_schedulers.get(recognizer)
+    scheduler.add(session)
+    sender = asyncio.create_task(_send_events())
+
+    sample_width = 2 if encoding == "s16le" else 4
+    pending = b""
+    receiver = None
+    try:
+        while True:
+            receiver = asyncio.ensure_future(websocket.receive())
+            await asyncio.wait({receiver, sender}, return_when=asyncio.FIRST_COMPLETED)
+            if sender.done():
+                # The scheduler ended the session before "Done", i.e. the
+                # stream failed and is no longer decoded
+                await websocket.close(code=1011 if sender.result() else 1000)
+                return
+            message = receiver.result()
+            if message["type"] == "websocket.disconnect":
+                return
+
+            if message.get("bytes"):
+                data = pending + message["bytes"]
+                usable = len(data) - len(data) % sample_width
+                pending = data[usable:]
+                if encoding == "s16le":
+                    samples = pcm16_to_float32(np.frombuffer(data, dtype="<i2", count=usable // 2))
+                else:
+                    samples = np.frombuffer(data, dtype="<f4", count=usable // 4)
+                try:
+                    session.push(samples, client_sample_rate)
+                except BacklogFull as e:
+                    scheduler.remove(session)
+                    sender.cancel()
+                    await _close_stream(websocket, 1013, str(e))
+                    return
+            elif message.get("text") == "Done":
+                session.finish()
+                await sender
+                await websocket.close()
+                return
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+        scheduler.remove(session)
+        sender.cancel()
+
+
+def preload_models() -> None:
+    """Load and warm up the preloaded models in the calling thread."""
+    _preloader.run()
+
+
+def main() -> None:
+    from prefork import serve
+
     port = _env_int("UVICORN_PORT", 8000)
     # Limit torch/blas threads for predictable CPU use
     os.environ.setdefault("OMP_NUM_THREADS", "1")
     os.environ.setdefault("MKL_NUM_THREADS", "1")
     os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
-    uvicorn.run("api_server:app", host="0.0.0.0", port=port, workers=1)
\ No newline at end of file
+    print(f"[main] {PLAN}")
+
+    if WORKERS == 1:
+        uvicorn.run(app, host="0.0.0.0", port=port, workers=1)
+    else:
+        # Models are loaded once in this process and shared copy-on-write
+        # by the forked workers.
+        if not metrics.MULTIPROC_DIR:
+            print("[main] PROMETHEUS_MULTIPROC_DIR is not set; /metrics only shows the worker that answers")
+        serve(
+            app,
+            host="0.0.0.0",
+            port=port,
+            workers=PLAN.workers,
+            preload=preload_models,
+            on_worker_exit=metrics.mark_process_dead,
+        )
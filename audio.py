@@ -0,0 +1,417 @@
+"""In-process audio ingestion.
+
+PCM and float WAV bytes are parsed directly with NumPy; only compressed
+formats need to go through ffmpeg.
+"""
+
+import mmap
+import os
+import struct
+from typing import Callable, Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+try:
+    import soxr
+except ImportError:  # pragma: no cover - optional dependency
+    soxr = None
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class WavInfo(NamedTuple):
+    format_tag: int
+    num_channels: int
+    sample_rate: int
+    bits_per_sample: int
+    # Byte offset and length of the "data" chunk payload
+    data_offset: int
+    data_size: int
+
+
+def parse_wav_header(data: bytes) -> Optional[WavInfo]:
+    """
+    Args:
+      data:
+        The content of a file. Only the RIFF header and chunk headers are
+        inspected; the samples are not touched.
+    Returns:
+      Return a WavInfo if data looks like a RIFF/WAVE file with a "fmt " chunk
+      followed by a "data" chunk. Return None otherwise.
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos : pos + 4]
+        (chunk_size,) = struct.unpack_from("<I", data, pos + 4)
+        body = pos + 8
+
+        if chunk_id == b"fmt ":
+            if chunk_size < 16 or body + 16 > len(data):
+                return None
+            format_tag, num_channels, rate, _, _, bits = struct.unpack_from(
+                "<HHIIHH", data, body
+            )
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                # The first two bytes of the sub-format GUID are the real tag
+                (format_tag,) = struct.unpack_from("<H", data, body + 24)
+            fmt = (format_tag, num_channels, rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            # Writers that stream to stdout leave the size as 0 or 0xFFFFFFFF
+            if chunk_size == 0 or body + chunk_size > len(data):
+                chunk_size = len(data) - body
+            return WavInfo(*fmt, data_offset=body, data_size=chunk_size)
+
+        pos = body + chunk_size + (chunk_size & 1)
+
+    return None
+
+
+def pcm16_to_float32(pcm: np.ndarray, num_channels: int = 1) -> np.ndarray:
+    """Convert interleaved int16 samples to mono float32 in [-1, 1)."""
+    if num_channels > 1:
+        pcm = pcm[: len(pcm) - len(pcm) % num_channels].reshape(-1, num_channels)
+        return frames_to_float32(pcm, 16)
+
+    samples = np.empty(pcm.shape, dtype=np.float32)
+    np.multiply(pcm, np.float32(1.0 / 32768), out=samples)
+    return samples
+
+
+# (format_tag, bits_per_sample) -> dtype of a sample. 24-bit samples have
+# no NumPy dtype; they are viewed as 3 bytes each
+_SAMPLE_DTYPES = {
+    (WAVE_FORMAT_PCM, 8): "u1",
+    (WAVE_FORMAT_PCM, 16): "<i2",
+    (WAVE_FORMAT_PCM, 24): "u1",
+    (WAVE_FORMAT_PCM, 32): "<i4",
+    (WAVE_FORMAT_IEEE_FLOAT, 32): "<f4",
+    (WAVE_FORMAT_IEEE_FLOAT, 64): "<f8",
+}
+
+# Bounds the temporaries of 24-bit unpacking and of downmixing
+_BLOCK_FRAMES = 1 << 16
+
+
+def is_supported(info: WavInfo) -> bool:
+    """Whether the samples of info can be read without ffmpeg."""
+    return (
+        info.num_channels >= 1
+        and (info.format_tag, info.bits_per_sample) in _SAMPLE_DTYPES
+    )
+
+
+def wav_frames(data, info: WavInfo) -> np.ndarray:
+    """
+    Return a zero-copy view of the samples in data, which may be bytes or
+    any other buffer such as an mmap, with one row per frame. 24-bit frames
+    have a trailing axis with the 3 bytes of each sample.
+    """
+    dtype = np.dtype(_SAMPLE_DTYPES[(info.format_tag, info.bits_per_sample)])
+    width = 3 if info.bits_per_sample == 24 else dtype.itemsize
+    frame_size = width * info.num_channels
+    num_frames = min(info.data_size, len(data) - info.data_offset) // frame_size
+    frames = np.frombuffer(
+        data,
+        dtype=dtype,
+        count=num_frames * frame_size // dtype.itemsize,
+        offset=info.data_offset,
+    )
+    if info.bits_per_sample == 24:
+        return frames.reshape(num_frames, info.num_channels, 3)
+    return frames.reshape(num_frames, info.num_channels)
+
+
+def _int24_to_int32(frames: np.ndarray) -> np.ndarray:
+    num_frames, num_channels, _ = frames.shape
+    wide = np.empty((num_frames, num_channels, 4), dtype=np.uint8)
+    wide[..., 0] = 0
+    wide[..., 1:] = frames
+    # The arithmetic shift extends the sign of the top byte
+    pcm = wide.view("<i4").reshape(num_frames, num_channels)
+    pcm >>= 8
+    return pcm
+
+
+def frames_to_float32(
+    frames: np.ndarray, bits_per_sample: int, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Convert frames as returned by wav_frames() to mono float32 in [-1, 1).
+    The channels are averaged and scaled in one pass over each block,
+    directly into out, without float copies of the whole input.
+
+    Args:
+      frames:
+        A view of 8-bit unsigned, 16/24/32-bit signed or 32/64-bit float
+        samples.
+      bits_per_sample:
+        Sample width of frames; it tells 8 and 24-bit data apart.
+      out:
+        A float32 array of len(frames) to write to; allocated if None.
+    """
+    num_frames, num_channels = frames.shape[:2]
+    if out is None:
+        out = np.empty(num_frames, dtype=np.float32)
+
+    float_data = frames.dtype.kind == "f"
+    full_scale = 1.0 if float_data else 2.0 ** (bits_per_sample - 1)
+    offset = 128.0 if bits_per_sample == 8 else 0.0
+    scale = np.float32(1.0 / (full_scale * num_channels))
+
+    for i in range(0, num_frames, _BLOCK_FRAMES):
+        block = frames[i : i + _BLOCK_FRAMES]
+        dst = out[i : i + len(block)]
+        if bits_per_sample == 24 and not float_data:
+            block = _int24_to_int32(block)
+
+        if num_channels == 1 and not offset:
+            np.multiply(block[:, 0], scale, out=dst, casting="unsafe")
+            continue
+
+        np.copyto(dst, block[:, 0], casting="unsafe")
+        for c in range(1, num_channels):
+            np.add(dst, block[:, c], out=dst, casting="unsafe")
+        if offset:
+            dst -= np.float32(offset * num_channels)
+        dst *= scale
+    return out
+
+
+def _wav_view(data) -> Optional[Tuple[np.ndarray, WavInfo]]:
+    info = parse_wav_header(data)
+    if info is None or not is_supported(info):
+        return None
+    return wav_frames(data, info), info
+
+
+def read_wav_bytes(data: bytes) -> Optional[Tuple[np.ndarray, int]]:
+    """
+    Args:
+      data:
+        The content of a wave file.
+    Returns:
+      Return a tuple (samples, sample_rate) where samples is a 1-D float32
+      array, downmixed to mono. Return None if data is not an 8/16/24/32-bit
+      PCM or 32/64-bit float wave file, in which case the caller should fall
+      back to ffmpeg.
+    """
+    view = _wav_view(data)
+    if view is None:
+        return None
+
+    frames, info = view
+    return frames_to_float32(frames, info.bits_per_sample), info.sample_rate
+
+
+class WavFile:
+    """
+    A memory-mapped wave file. :attr:`frames` is a zero-copy NumPy view of
+    its samples (see wav_frames()), so opening even a multi-hour file costs
+    no memory until the samples are read.
+
+    Usage::
+
+        with WavFile("long.wav") as f:
+            for samples in f.iter_chunks(16000, chunk_sec=10):
+                ...
+
+    Raises:
+      ValueError if filename is not a wave file in one of the formats
+      supported by read_wav_bytes().
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size < 12:
+                raise ValueError(f"{filename} is not a wave file")
+            # The mapping stays valid after the file is closed
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        info = parse_wav_header(self._mmap)
+        if info is None or not is_supported(info):
+            self._mmap.close()
+            if info is None:
+                raise ValueError(f"{filename} is not a wave file")
+            raise ValueError(
+                f"{filename}: unsupported wave format (format tag "
+                f"0x{info.format_tag:04x}, {info.bits_per_sample}-bit, "
+                f"{info.num_channels} channels)"
+            )
+        self.info = info
+        self.frames: Optional[np.ndarray] = wav_frames(self._mmap, info)
+        self._madvise(getattr(mmap, "MADV_SEQUENTIAL", None))
+
+    @property
+    def sample_rate(self) -> int:
+        return self.info.sample_rate
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.frames)
+
+    @property
+    def duration_sec(self) -> float:
+        return self.num_frames / self.sample_rate
+
+    def read(self) -> np.ndarray:
+        """Return all samples as one mono float32 array."""
+        return frames_to_float32(self.frames, self.info.bits_per_sample)
+
+    def iter_chunks(
+        self, target_rate: int, chunk_sec: float = 1.0
+    ) -> Iterator[np.ndarray]:
+        """
+        Yield mono float32 chunks at target_rate, like iter_wav_chunks().
+        The pages of the file that have been converted are dropped from
+        the mapping as we go, so the resident memory stays at about one
+        chunk however long the file is.
+        """
+        frame_size = self.frames.strides[0]
+        page_size = mmap.PAGESIZE
+        released = 0
+
+        def _consumed(num_frames: int) -> None:
+            nonlocal released
+            end = self.info.data_offset + num_frames * frame_size
+            end -= end % page_size
+            if end > released:
+                dontneed = getattr(mmap, "MADV_DONTNEED", None)
+                self._madvise(dontneed, released, end - released)
+                released = end
+
+        return _iter_chunks(
+            self.frames, self.info, target_rate, chunk_sec, _consumed
+        )
+
+    def _madvise(self, option: Optional[int], start: int = 0, length: int = 0) -> None:
+        # mmap.madvise() needs Python 3.8 and a platform that has it
+        if option is not None and hasattr(self._mmap, "madvise"):
+            self._mmap.madvise(option, start, length)
+
+    def close(self) -> None:
+        """
+        Unmap the file. Views of :attr:`frames` that are still referenced
+        elsewhere make this raise BufferError.
+        """
+        self.frames = None
+        self._mmap.close()
+
+    def __enter__(self) -> "WavFile":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def read_wav_file(filename: str) -> Tuple[np.ndarray, int]:
+    """
+    Like read_wav_bytes(), but the file is memory-mapped instead of read
+    into a bytes object, so the float32 output is the only full-size
+    allocation.
+
+    Raises:
+      ValueError if filename is not a wave file in one of the formats
+      supported by read_wav_bytes().
+    """
+    with WavFile(filename) as f:
+        return f.read(), f.sample_rate
+
+
+def iter_wav_chunks(
+    data: bytes, target_rate: int, chunk_sec: float = 1.0
+) -> Optional[Iterator[np.ndarray]]:
+    """
+    Like read_wav_bytes(), but yields mono float32 chunks at target_rate so
+    that only one chunk is converted at a time.
+
+    Returns:
+      Return an iterator over the chunks, or None if data is not a wave file
+      that read_wav_bytes() supports.
+    """
+    view = _wav_view(data)
+    if view is None:
+        return None
+
+    frames, info = view
+    return _iter_chunks(frames, info, target_rate, chunk_sec)
+
+
+def _iter_chunks(
+    frames: np.ndarray,
+    info: WavInfo,
+    target_rate: int,
+    chunk_sec: float,
+    consumed: Optional[Callable[[int], None]] = None,
+) -> Iterator[np.ndarray]:
+    """consumed(n) is called once the first n frames are no longer needed."""
+    bits = info.bits_per_sample
+    step = max(1, int(chunk_sec * info.sample_rate))
+
+    if info.sample_rate != target_rate and soxr is None:
+        # The FFT fallback has no streaming mode
+        samples = resample(
+            frames_to_float32(frames, bits), info.sample_rate, target_rate
+        )
+        if consumed is not None:
+            consumed(len(frames))
+        step_out = max(1, int(chunk_sec * target_rate))
+        for i in range(0, len(samples), step_out):
+            yield samples[i : i + step_out]
+        return
+
+    resampler = None
+    if info.sample_rate != target_rate:
+        resampler = soxr.ResampleStream(
+            info.sample_rate, target_rate, 1, dtype="float32"
+        )
+
+    for i in range(0, len(frames), step):
+        samples = frames_to_float32(frames[i : i + step], bits)
+        if consumed is not None:
+            consumed(min(i + step, len(frames)))
+        if resampler is not None:
+            samples = resampler.resample_chunk(samples)
+        if samples.size:
+            yield samples
+
+    if resampler is not None:
+        samples = resampler.resample_chunk(
+            np.zeros(0, dtype=np.float32), last=True
+        )
+        if samples.size:
+            yield samples
+
+
+def resample(samples: np.ndarray, orig_rate: int, target_rate: int) -> np.ndarray:
+    """
+    Resample a 1-D float32 array. Uses soxr if it is installed and falls back
+    to band-limited FFT resampling with NumPy otherwise.
+    """
+    if orig_rate == target_rate or samples.size == 0:
+        return samples
+
+    if soxr is not None:
+        return soxr.resample(samples, orig_rate, target_rate).astype(
+            np.float32, copy=False
+        )
+
+    num_in = samples.shape[0]
+    num_out = int(round(num_in * target_rate / orig_rate))
+    spectrum = np.fft.rfft(samples)
+    num_bins = num_out // 2 + 1
+    if num_bins <= spectrum.shape[0]:
+        spectrum = spectrum[:num_bins]
+    else:
+        spectrum = np.pad(spectrum, (0, num_bins - spectrum.shape[0]))
+    out = np.fft.irfft(spectrum, num_out)
+    out *= num_out / num_in
+    return out.astype(np.float32)
@@ -0,0 +1,98 @@
+"""Lazy imports of the optional torch backend.
+
+Only the recognizers built with ``sherpa`` (k2/torch) need ``torch``,
+``torchaudio``, ``k2`` and ``sherpa``. model.py refers to them through
+:class:`LazyModule` objects, so the import happens when such a
+recognizer is first requested. ONNX-only deployments never pay for the
+torch stack.
+
+Some k2/sherpa wheel combinations cannot find k2's shared libraries from
+inside sherpa. Set ``SHERPA_COPY_K2_LIBS=1`` to copy them into sherpa's
+``lib`` directory before sherpa is imported.
+"""
+
+import glob
+import importlib
+import importlib.util
+import os
+import shutil
+import threading
+from types import ModuleType
+from typing import Callable, Optional
+
+_lock = threading.RLock()
+
+
+def _package_dir(name: str) -> Optional[str]:
+    """Directory of an installed package, without importing it."""
+    spec = importlib.util.find_spec(name)
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    return list(spec.submodule_search_locations)[0]
+
+
+def copy_k2_libs() -> None:
+    """Copy k2/lib/*.so into sherpa/lib/ unless they are already there."""
+    k2_dir = _package_dir("k2")
+    sherpa_dir = _package_dir("sherpa")
+    if k2_dir is None or sherpa_dir is None:
+        return
+
+    dst_dir = os.path.join(sherpa_dir, "lib")
+    os.makedirs(dst_dir, exist_ok=True)
+    for src in glob.glob(os.path.join(k2_dir, "lib", "*.so")):
+        dst = os.path.join(dst_dir, os.path.basename(src))
+        if os.path.exists(dst) and os.path.getsize(dst) == os.path.getsize(src):
+            continue
+        shutil.copy2(src, dst)
+        print(f"[backends] {src} -> {dst}")
+
+
+def _prepare_sherpa() -> None:
+    if os.getenv("SHERPA_COPY_K2_LIBS", "").lower() in ("1", "true", "yes"):
+        copy_k2_libs()
+    # sherpa needs k2's libraries to be loaded first
+    importlib.import_module("k2")
+
+
+class LazyModule:
+    """
+    A stand-in for a module that is imported on first attribute access.
+
+    Args:
+      name:
+        Name of the module.
+      prepare:
+        Called once right before the import.
+    """
+
+    def __init__(self, name: str, prepare: Optional[Callable[[], None]] = None):
+        self._name = name
+        self._prepare = prepare
+        self._module: Optional[ModuleType] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self) -> ModuleType:
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    if self._prepare is not None:
+                        self._prepare()
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+torch = LazyModule("torch")
+torchaudio = LazyModule("torchaudio")
+sherpa = LazyModule("sherpa", prepare=_prepare_sherpa)
+
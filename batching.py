@@ -0,0 +1,171 @@
+"""Dynamic micro-batching for offline recognizers.
+
+Concurrent requests that share a key, e.g.
+``(repo_id, decoding_method, num_active_paths)``, are collected for at most
+``max_wait_ms`` milliseconds or until ``max_batch_size`` requests are queued,
+and are then decoded together with a single ``decode_streams`` call.
+
+Callers create the streams and feed them audio themselves, so feature
+extraction happens on the callers' threads and only the neural network
+runs in the batch.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class _Request:
+    __slots__ = ("recognizer", "stream", "future")
+
+    def __init__(self, recognizer: Any, stream: Any):
+        self.recognizer = recognizer
+        self.stream = stream
+        self.future: Future = Future()
+
+
+class OfflineBatcher:
+    """
+    Args:
+      decode_batch:
+        A callable ``decode_batch(recognizer, streams) -> List[str]``. It must
+        return one text per stream, in order.
+      max_batch_size:
+        Maximum number of streams decoded in one call.
+      max_wait_ms:
+        How long the first request of a batch waits for more requests to
+        arrive before the batch is decoded.
+      idle_sec:
+        The thread of a key exits after no request came for this long, so
+        keys that clients stop using, or models the registry evicted, do
+        not keep a thread and a recognizer alive.
+    """
+
+    def __init__(
+        self,
+        decode_batch: Callable[[Any, List[Any]], List[str]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        idle_sec: float = 60.0,
+    ):
+        self._decode_batch = decode_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.idle_sec = max(0.001, idle_sec)
+
+        self._lock = threading.Lock()
+        self._queues: Dict[Hashable, "queue.Queue[_Request]"] = {}
+        self._threads: Dict[Hashable, threading.Thread] = {}
+        self._num_started = 0
+
+    def submit(self, key: Hashable, recognizer: Any, stream: Any) -> Future:
+        """
+        Queue one stream that was created by recognizer and has already
+        accepted all of its audio. The returned future resolves to its text.
+        """
+        req = _Request(recognizer, stream)
+        with self._lock:
+            # Under the lock, so that an idle thread never retires with a
+            # request in its queue
+            self._get_queue_locked(key).put(req)
+        return req.future
+
+    @property
+    def num_threads(self) -> int:
+        with self._lock:
+            return len(self._threads)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for q in self._queues.values():
+                q.put(None)
+            threads = list(self._threads.values())
+            self._queues = {}
+            self._threads = {}
+
+        for t in threads:
+            t.join()
+
+    def _get_queue_locked(self, key: Hashable) -> "queue.Queue[_Request]":
+        q = self._queues.get(key)
+        if q is None:
+            q = queue.Queue()
+            t = threading.Thread(
+                target=self._run,
+                args=(key, q),
+                name=f"batcher-{self._num_started}",
+                daemon=True,
+            )
+            self._num_started += 1
+            self._queues[key] = q
+            self._threads[key] = t
+            t.start()
+        return q
+
+    def _retire(self, key: Hashable, q: "queue.Queue[_Request]") -> bool:
+        """Drop the queue of key if it is still empty; see submit()."""
+        with self._lock:
+            if not q.empty():
+                return False
+            if self._queues.get(key) is q:
+                del self._queues[key]
+                del self._threads[key]
+            return True
+
+    def _run(self, key: Hashable, q: "queue.Queue[_Request]") -> None:
+        stop = False
+        while not stop:
+            try:
+                req = q.get(timeout=self.idle_sec)
+            except queue.Empty:
+                if self._retire(key, q):
+                    break
+                continue
+            if req is None:
+                break
+
+            batch = [req]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        req = q.get(timeout=timeout)
+                    else:
+                        # Still drain whatever is already queued
+                        req = q.get_nowait()
+                except queue.Empty:
+                    break
+                if req is None:
+                    stop = True
+                    break
+                batch.append(req)
+
+            self._process(batch)
+            # Do not keep the recognizer alive while waiting
+            del batch, req
+
+    def _process(self, batch: List[_Request]) -> None:
+        batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+
+        # A registry reload may hand out a new recognizer for the same key;
+        # streams can only be decoded together by the recognizer that
+        # created them.
+        groups: Dict[int, List[_Request]] = {}
+        for r in batch:
+            groups.setdefault(id(r.recognizer), []).append(r)
+
+        for reqs in groups.values():
+            try:
+                texts = self._decode_batch(
+                    reqs[0].recognizer, [r.stream for r in reqs]
+                )
+            except Exception as e:
+                for r in reqs:
+                    r.future.set_exception(e)
+                continue
+
+            for r, text in zip(reqs, texts):
+                r.future.set_result(text)
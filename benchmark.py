@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Throughput and latency benchmark.
+
+Replays a corpus, by default ``test_wavs/vietnamese``, against recognizers
+loaded in this process (``direct``) or against a running server
+(``http``), at one or more concurrency levels:
+
+    python benchmark.py direct --models hynt/sherpa-onnx-zipformer-vi-int8-2025-10-16:greedy_search \\
+        --concurrency 1,4,8 --output bench.json
+    python benchmark.py http --url http://localhost:8080 --api-key changeme \\
+        --concurrency 1,8,32 --synthetic 2,5,15 --output bench.json
+
+For every model and concurrency level it reports the latency percentiles,
+the real-time factor (RTF), the throughput in seconds of audio per second
+and, where a ``trans.txt`` reference exists, the character error rate.
+Direct runs also report the load time, the memory the model took and the
+peak RSS of the process. ``--synthetic`` adds clips of faint noise with the
+given durations, e.g. to measure a mix of short and long requests.
+
+The corpus is sent repeatedly, so start the server under test with
+``TRANSCRIPT_CACHE_SIZE=0``; responses served from the cache are counted
+in ``num_cached``.
+
+The output is JSON. With ``--baseline`` the results are compared with an
+earlier run, and the exit code is 1 if throughput dropped or p95 latency
+rose by more than ``--max-regression``.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from audio import parse_wav_header, read_wav_bytes, resample
+from preload import PreloadEntry, parse_preload_models
+
+SAMPLE_RATE = 16000
+
+
+class Clip(NamedTuple):
+    name: str
+    # The encoded file, as sent to the server
+    data: bytes
+    # Seconds; 0 if unknown before decoding
+    duration: float
+    reference: Optional[str]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("target", choices=["direct", "http"])
+    parser.add_argument(
+        "--models",
+        default=os.getenv(
+            "PRELOAD_MODELS",
+            "hynt/sherpa-onnx-zipformer-vi-int8-2025-10-16:modified_beam_search:15",
+        ),
+        help="Comma separated repo_id[:decoding_method[:num_active_paths]]",
+    )
+    parser.add_argument(
+        "--corpus",
+        default="test_wavs/vietnamese",
+        help="Comma separated directories or files; empty for synthetic clips only",
+    )
+    parser.add_argument(
+        "--synthetic",
+        default="",
+        help="Comma separated durations in seconds of generated clips to add",
+    )
+    parser.add_argument("--concurrency", default="1,4", help="Comma separated levels")
+    parser.add_argument(
+        "--min-requests",
+        type=int,
+        default=20,
+        help="The corpus is repeated until each level sends at least this many",
+    )
+    parser.add_argument("--url", default="http://localhost:8080", help="Server for http")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY", ""))
+    parser.add_argument(
+        "--num-threads", type=int, default=0, help="ONNX Runtime threads for direct; 0 keeps the default"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=8, help="Largest decode batch for direct"
+    )
+    parser.add_argument("--output", default="", help="JSON file; default stdout")
+    parser.add_argument("--baseline", default="", help="Earlier JSON output to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    return parser.parse_args()
+
+
+def _csv(s: str, type_=str) -> list:
+    return [type_(x) for x in s.split(",") if x.strip()]
+
+
+def _read_references(directory: str) -> Dict[str, str]:
+    """Map file names (with and without extension) to reference texts."""
+    refs = {}
+    for name in ("trans.txt", "transcript.txt"):
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.strip().split(maxsplit=1)
+                if len(parts) == 2:
+                    refs[parts[0]] = parts[1]
+    return refs
+
+
+def load_corpus(paths: List[str]) -> List[Clip]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [
+                os.path.join(path, f)
+                for f in sorted(os.listdir(path))
+                if f.lower().endswith((".wav", ".mp3", ".m4a", ".opus", ".ogg", ".flac"))
+            ]
+        else:
+            files.append(path)
+
+    clips = []
+    refs_cache: Dict[str, Dict[str, str]] = {}
+    for filename in files:
+        with open(filename, "rb") as f:
+            data = f.read()
+        directory, name = os.path.split(filename)
+        if directory not in refs_cache:
+            refs_cache[directory] = _read_references(directory)
+        refs = refs_cache[directory]
+        reference = refs.get(name, refs.get(os.path.splitext(name)[0]))
+
+        info = parse_wav_header(data)
+        duration = 0.0
+        if info is not None and info.sample_rate and info.num_channels and info.bits_per_sample:
+            frame_bytes = info.num_channels * info.bits_per_sample // 8
+            duration = info.data_size / frame_bytes / info.sample_rate
+        clips.append(Clip(filename, data, duration, reference))
+    return clips
+
+
+def synthetic_clips(durations: List[float]) -> List[Clip]:
+    rng = np.random.default_rng(0)
+    clips = []
+    for d in durations:
+        samples = rng.normal(0, 1e-3, int(d * SAMPLE_RATE))
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes((samples * 32767).astype("<i2").tobytes())
+        clips.append(Clip(f"synthetic-{d:g}s", buf.getvalue(), d, None))
+    return clips
+
+
+def _requests(clips: List[Clip], min_requests: int) -> List[Clip]:
+    n = max(len(clips), min_requests)
+    return [clips[i % len(clips)] for i in range(n)]
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def edit_distance(a: str, b: str) -> int:
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def char_error_rate(pairs: List[tuple]) -> Optional[float]:
+    """CER over (hypothesis, reference) pairs, ignoring case and spaces."""
+    errors = total = 0
+    for hyp, ref in pairs:
+        hyp = "".join(hyp.lower().split())
+        ref = "".join(ref.lower().split())
+        errors += edit_distance(hyp, ref)
+        total += len(ref)
+    return round(errors / total, 4) if total else None
+
+
+def summarize(
+    samples: List[tuple], wall_sec: float, num_errors: int
+) -> Dict:
+    """
+    Args:
+      samples:
+        (latency_sec, duration_sec, text, reference) of each successful
+        request.
+    """
+    latencies = [s[0] for s in samples]
+    audio_sec = sum(s[1] for s in samples)
+    rtfs = [s[0] / s[1] for s in samples if s[1] > 0]
+    return {
+        "num_requests": len(samples) + num_errors,
+        "num_errors": num_errors,
+        "audio_sec": round(audio_sec, 3),
+        "wall_sec": round(wall_sec, 3),
+        "throughput_audio_sec_per_sec": round(audio_sec / max(wall_sec, 1e-9), 3),
+        "requests_per_sec": round(len(samples) / max(wall_sec, 1e-9), 3),
+        "latency_ms": {
+            "mean": round(1000 * float(np.mean(latencies)), 2) if latencies else 0.0,
+            "p50": round(1000 * percentile(latencies, 50), 2),
+            "p95": round(1000 * percentile(latencies, 95), 2),
+            "p99": round(1000 * percentile(latencies, 99), 2),
+            "max": round(1000 * max(latencies), 2) if latencies else 0.0,
+        },
+        "rtf": {
+            "mean": round(float(np.mean(rtfs)), 4) if rtfs else None,
+            "p95": round(percentile(rtfs, 95), 4) if rtfs else None,
+        },
+        "cer": char_error_rate([(s[2], s[3]) for s in samples if s[3]]),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1 << 20) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def run_direct(entries: List[PreloadEntry], clips: List[Clip], args) -> List[Dict]:
+    import model
+    from batching import OfflineBatcher
+    from bulk_transcribe import load_audio
+    from model import (
+        decode_offline_streams_sherpa_onnx,
+        decode_samples,
+        registry,
+        supports_batch_decode,
+        warm_up,
+    )
+
+    if args.num_threads > 0:
+        model.num_threads = args.num_threads
+
+    # Decode every clip up front, so only recognition is timed
+    decoded = []
+    for clip in clips:
+        wav = read_wav_bytes(clip.data)
+        if wav is not None:
+            samples = resample(wav[0], wav[1], SAMPLE_RATE)
+        else:
+            samples = load_audio(clip.name)
+        decoded.append((clip, samples))
+
+    results = []
+    for entry in entries:
+        recognizer, key = registry.get_with_key(*entry)
+        loaded = next(e for e in registry.entries() if tuple(e["key"]) == tuple(key))
+        start = time.perf_counter()
+        warm_up(recognizer)
+        warm_up_sec = time.perf_counter() - start
+
+        batched = supports_batch_decode(recognizer)
+        for concurrency in _csv(args.concurrency, int):
+            batcher = None
+            if batched and concurrency > 1:
+                batcher = OfflineBatcher(
+                    decode_offline_streams_sherpa_onnx,
+                    max_batch_size=args.batch_size,
+                    max_wait_ms=10.0,
+                )
+
+            def _one(item):
+                clip, samples = item
+                t = time.perf_counter()
+                if batcher is not None:
+                    stream = recognizer.create_stream()
+                    stream.accept_waveform(SAMPLE_RATE, samples)
+                    text = batcher.submit(key, recognizer, stream).result()
+                else:
+                    text = decode_samples(recognizer, samples, SAMPLE_RATE)
+                return time.perf_counter() - t, len(samples) / SAMPLE_RATE, text, clip.reference
+
+            requests = _requests(decoded, args.min_requests)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as ex:
+                samples = list(ex.map(_one, requests))
+            wall_sec = time.perf_counter() - start
+            if batcher is not None:
+                batcher.shutdown()
+
+            result = {
+                "target": "direct",
+                "repo_id": entry.repo_id,
+                "decoding_method": entry.decoding_method,
+                "num_active_paths": entry.num_active_paths,
+                "concurrency": concurrency,
+                "batched": batcher is not None,
+                "load_sec": loaded["load_sec"],
+                "load_rss_mb": loaded["rss_mb"],
+                "warm_up_sec": round(warm_up_sec, 3),
+                **summarize(samples, wall_sec, 0),
+                "peak_rss_mb": peak_rss_mb(),
+            }
+            results.append(result)
+            _progress(result)
+    return results
+
+
+async def _run_http_level(
+    url: str, entry: PreloadEntry, clips: List[Clip], concurrency: int, args
+) -> Dict:
+    import httpx
+
+    headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+    params = {
+        "repo_id": entry.repo_id,
+        "decoding_method": entry.decoding_method,
+        "num_active_paths": entry.num_active_paths,
+    }
+
+    async with httpx.AsyncClient(
+        timeout=600.0,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    ) as client:
+
+        async def _post(clip: Clip):
+            content_type = "audio/wav" if clip.data[:4] == b"RIFF" else "application/octet-stream"
+            t = time.perf_counter()
+            r = await client.post(
+                f"{url}/v1/transcribe",
+                params=params,
+                content=clip.data,
+                headers={**headers, "Content-Type": content_type},
+            )
+            return time.perf_counter() - t, r, clip
+
+        # Not timed; loads the model if the server has not preloaded it
+        start = time.perf_counter()
+        _, first, _ = await _post(clips[0])
+        first_request_sec = time.perf_counter() - start
+        if first.status_code != 200:
+            raise RuntimeError(f"{url}: HTTP {first.status_code}: {first.text}")
+
+        queue: "asyncio.Queue[Clip]" = asyncio.Queue()
+        for clip in _requests(clips, args.min_requests):
+            queue.put_nowait(clip)
+
+        samples = []
+        server_rtfs = []
+        num_cached = 0
+        errors: Dict[str, int] = {}
+
+        async def _client():
+            nonlocal num_cached
+            while not queue.empty():
+                clip = queue.get_nowait()
+                try:
+                    latency, r, clip = await _post(clip)
+                except httpx.HTTPError as e:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                    continue
+                if r.status_code != 200:
+                    errors[str(r.status_code)] = errors.get(str(r.status_code), 0) + 1
+                    continue
+                body = r.json()
+                num_cached += bool(body.get("cached"))
+                server_rtfs.append(body.get("rtf", 0.0))
+                samples.append((latency, body["duration_sec"], body["text"], clip.reference))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(_client() for _ in range(concurrency)))
+        wall_sec = time.perf_counter() - start
+
+    return {
+        "target": "http",
+        "url": url,
+        "repo_id": entry.repo_id,
+        "decoding_method": entry.decoding_method,
+        "num_active_paths": entry.num_active_paths,
+        "concurrency": concurrency,
+        "first_request_sec": round(first_request_sec, 3),
+        **summarize(samples, wall_sec, sum(errors.values())),
+        "errors": errors,
+        # Served from the transcript cache of the server
+        "num_cached": num_cached,
+        "server_rtf_mean": round(float(np.mean(server_rtfs)), 4) if server_rtfs else None,
+    }
+
+
+def _server_models(url: str, api_key: str) -> Optional[Dict]:
+    """Load times and memory of the models resident in the server."""
+    import httpx
+
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    try:
+        r = httpx.get(f"{url}/v1/models", headers=headers, timeout=10.0)
+    except httpx.HTTPError:
+        return None
+    return r.json() if r.status_code == 200 else None
+
+
+def run_http(entries: List[PreloadEntry], clips: List[Clip], args) -> List[Dict]:
+    url = args.url.rstrip("/")
+    results = []
+    for entry in entries:
+        for concurrency in _csv(args.concurrency, int):
+            result = asyncio.run(_run_http_level(url, entry, clips, concurrency, args))
+            results.append(result)
+            _progress(result)
+            if result["num_cached"]:
+                print(
+                    f"[bench] {result['num_cached']} responses came from the transcript "
+                    "cache; run the server with TRANSCRIPT_CACHE_SIZE=0",
+                    file=sys.stderr,
+                )
+    return results
+
+
+def _progress(result: Dict) -> None:
+    print(
+        f"[bench] {result['target']} {result['repo_id']} {result['decoding_method']} "
+        f"c={result['concurrency']}: {result['throughput_audio_sec_per_sec']}x real time, "
+        f"p50 {result['latency_ms']['p50']}ms, p95 {result['latency_ms']['p95']}ms, "
+        f"errors {result['num_errors']}",
+        file=sys.stderr,
+    )
+
+
+def _result_key(r: Dict) -> tuple:
+    return (r["target"], r["repo_id"], r["decoding_method"], r["num_active_paths"], r["concurrency"])
+
+
+def compare(results: List[Dict], baseline: List[Dict], max_regression: float) -> List[str]:
+    """Return a message for every result that is worse than its baseline."""
+    old = {_result_key(r): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = old.get(_result_key(r))
+        if b is None:
+            continue
+        name = " ".join(str(x) for x in _result_key(r))
+
+        new_tp = r["throughput_audio_sec_per_sec"]
+        old_tp = b["throughput_audio_sec_per_sec"]
+        if old_tp > 0 and new_tp < old_tp * (1 - max_regression):
+            regressions.append(f"{name}: throughput {old_tp} -> {new_tp}")
+
+        new_p95 = r["latency_ms"]["p95"]
+        old_p95 = b["latency_ms"]["p95"]
+        if old_p95 > 0 and new_p95 > old_p95 * (1 + max_regression):
+            regressions.append(f"{name}: p95 latency {old_p95}ms -> {new_p95}ms")
+    return regressions
+
+
+def main():
+    args = get_args()
+
+    clips = load_corpus(_csv(args.corpus)) + synthetic_clips(_csv(args.synthetic, float))
+    if not clips:
+        sys.exit("No clips: set --corpus and/or --synthetic")
+    entries = parse_preload_models(args.models, "greedy_search", 4)
+
+    if args.target == "direct":
+        results = run_direct(entries, clips, args)
+    else:
+        results = run_http(entries, clips, args)
+
+    report = {
+        "version": 1,
+        "timestamp": time.time(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "corpus": {
+            "paths": _csv(args.corpus),
+            "synthetic": _csv(args.synthetic, float),
+            "num_clips": len(clips),
+        },
+        "results": results,
+    }
+    if args.target == "http":
+        report["server_models"] = _server_models(args.url.rstrip("/"), args.api_key)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.max_regression)
+        report["regressions"] = regressions
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for message in regressions:
+        print(f"[bench] Regression: {message}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
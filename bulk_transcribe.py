@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Transcribe many files without the HTTP server.
+
+Usage:
+
+    python bulk_transcribe.py test_wavs/vietnamese --output out.jsonl
+    python bulk_transcribe.py manifest.jsonl --output out.jsonl --num-workers 16
+
+Inputs are directories (searched recursively for audio files), JSONL
+manifests with one {"audio": path, "id": ...} object per line, or CSV
+manifests with an "audio" (or "path") column and an optional "id" column.
+Relative paths in a manifest are relative to the manifest.
+
+The model is loaded once and the worker processes are forked from that
+process, so they share its weights copy-on-write; like the pre-forked
+server (see prefork.py), every worker then runs single-threaded ONNX
+sessions. Each worker takes a batch of files, reads and resamples them on
+a few threads (ffmpeg for anything but PCM or float WAV) and decodes the
+batch with one ``decode_streams`` call.
+
+With ``--long-form``, WAV files are instead memory-mapped and fed to the
+VAD one chunk at a time, and the speech segments of a batch are decoded
+``--batch-size`` at a time as they come, so even multi-hour recordings
+need only a few segments' worth of memory.
+
+Every result is appended to the output JSONL as soon as its batch is done.
+Running the same command again skips the ids that already have a
+transcript there and retries the ones that failed.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from audio import WavFile, pcm16_to_float32, read_wav_file, resample
+from longform import Segment, iter_speech_segments, join_segments
+from prefork import available_cpus
+import model
+from model import (
+    create_vad,
+    decode_offline_streams_sherpa_onnx,
+    decode_samples,
+    get_pretrained_model,
+    sample_rate,
+    supports_batch_decode,
+)
+
+AUDIO_EXTENSIONS = (
+    ".wav", ".mp3", ".m4a", ".opus", ".ogg", ".flac", ".aac", ".webm", ".mp4", ".amr", ".wma",
+)
+
+# Set in the parent before forking, or in each worker (see _init_worker)
+_recognizer = None
+_args = None
+_loader: Optional[ThreadPoolExecutor] = None
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="Audio files, directories or JSONL/CSV manifests",
+    )
+    parser.add_argument("--output", required=True, help="Output JSONL file")
+    parser.add_argument(
+        "--repo-id",
+        default=os.getenv("MODEL_REPO_ID", "hynt/sherpa-onnx-zipformer-vi-int8-2025-10-16"),
+    )
+    parser.add_argument("--decoding-method", default="modified_beam_search")
+    parser.add_argument("--num-active-paths", type=int, default=15)
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=0,
+        help="Worker processes; 0 uses one per available core",
+    )
+    parser.add_argument(
+        "--num-threads",
+        type=int,
+        default=1,
+        help="ONNX Runtime threads per worker. With more than 1, every worker "
+        "loads its own copy of the model",
+    )
+    parser.add_argument("--batch-size", type=int, default=16, help="Files per decode batch")
+    parser.add_argument(
+        "--loader-threads",
+        type=int,
+        default=2,
+        help="Threads per worker that read and resample audio",
+    )
+    parser.add_argument(
+        "--long-form",
+        action="store_true",
+        help="Cut recordings into speech segments with a VAD first; needed for "
+        "files longer than a few tens of seconds",
+    )
+    parser.add_argument("--vad-model", default="", help="Path to silero_vad.onnx")
+    parser.add_argument("--vad-min-silence-sec", type=float, default=0.5)
+    parser.add_argument("--vad-max-segment-sec", type=float, default=20.0)
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Start from scratch instead of resuming from --output",
+    )
+    return parser.parse_args()
+
+
+def _manifest_path(path: str, manifest: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(os.path.dirname(manifest), path)
+
+
+def _audio_field(row: Dict) -> Optional[str]:
+    for key in ("audio", "audio_filepath", "path", "file"):
+        if row.get(key):
+            return str(row[key])
+    return None
+
+
+def iter_inputs(inputs: List[str]) -> Iterable[Dict]:
+    """Yield {"id", "audio"} for every file to transcribe."""
+    for name in inputs:
+        if os.path.isdir(name):
+            for root, dirs, files in os.walk(name):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.lower().endswith(AUDIO_EXTENSIONS):
+                        path = os.path.join(root, f)
+                        yield {"id": os.path.relpath(path, name), "audio": path}
+        elif name.endswith(".jsonl"):
+            with open(name, encoding="utf-8") as f:
+                for i, line in enumerate(f):
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+                    audio = _audio_field(row)
+                    if audio is None:
+                        raise ValueError(f"{name}:{i + 1}: missing 'audio'")
+                    yield {
+                        "id": str(row.get("id", audio)),
+                        "audio": _manifest_path(audio, name),
+                    }
+        elif name.endswith(".csv"):
+            with open(name, encoding="utf-8", newline="") as f:
+                for i, row in enumerate(csv.DictReader(f)):
+                    audio = _audio_field(row)
+                    if audio is None:
+                        raise ValueError(f"{name}:{i + 2}: missing 'audio' column")
+                    yield {
+                        "id": str(row.get("id") or audio),
+                        "audio": _manifest_path(audio, name),
+                    }
+        else:
+            yield {"id": name, "audio": name}
+
+
+def read_done(output: str) -> set:
+    """Ids that already have a transcript in output."""
+    done = set()
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # A line cut short by an earlier crash
+                continue
+            if "error" not in row:
+                done.add(row["id"])
+    return done
+
+
+def drop_partial_line(filename: str) -> None:
+    """Cut off a last line that an earlier run did not finish writing."""
+    with open(filename, "rb+") as f:
+        pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(1 << 16, pos)
+            f.seek(pos - step)
+            i = f.read(step).rfind(b"\n")
+            if i >= 0:
+                f.truncate(pos - step + i + 1)
+                return
+            pos -= step
+        f.truncate(0)
+
+
+def load_audio(filename: str) -> np.ndarray:
+    """Return 16 kHz mono float32 samples of any file ffmpeg can read."""
+    try:
+        samples, wav_sample_rate = read_wav_file(filename)
+        return resample(samples, wav_sample_rate, sample_rate)
+    except ValueError:
+        # Not a WAV file, or e.g. ADPCM or mu-law that needs ffmpeg
+        pass
+    return _ffmpeg_load(filename)
+
+
+def iter_audio_chunks(filename: str, chunk_sec: float = 1.0) -> Iterator[np.ndarray]:
+    """
+    Like load_audio(), but yields the samples in chunks. WAV files are
+    memory-mapped and converted one chunk at a time, so memory stays flat
+    however long they are; other files are decoded by ffmpeg first.
+    """
+    try:
+        wav = WavFile(filename)
+    except ValueError:
+        samples = _ffmpeg_load(filename)
+        step = max(1, int(chunk_sec * sample_rate))
+        for i in range(0, len(samples), step):
+            yield samples[i : i + step]
+        return
+
+    with wav:
+        yield from wav.iter_chunks(sample_rate, chunk_sec)
+
+
+def _ffmpeg_load(filename: str) -> np.ndarray:
+    proc = subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", filename,
+            "-f", "s16le", "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-ac", "1",
+            "pipe:1",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {proc.stderr.decode(errors='replace').strip()}")
+    return pcm16_to_float32(np.frombuffer(proc.stdout, dtype="<i2"))
+
+
+def _load_recognizer(args):
+    model.num_threads = args.num_threads
+    return get_pretrained_model(args.repo_id, args.decoding_method, args.num_active_paths)
+
+
+def _init_worker(args) -> None:
+    global _recognizer, _args, _loader
+    _args = args
+    if _recognizer is None:
+        _recognizer = _load_recognizer(args)
+    _loader = ThreadPoolExecutor(max_workers=max(1, args.loader_threads))
+
+
+def _decode_many(samples: List[np.ndarray]) -> List[str]:
+    if not supports_batch_decode(_recognizer):
+        return [decode_samples(_recognizer, s, sample_rate) for s in samples]
+
+    texts = []
+    for i in range(0, len(samples), _args.batch_size):
+        streams = []
+        for s in samples[i : i + _args.batch_size]:
+            stream = _recognizer.create_stream()
+            stream.accept_waveform(sample_rate, s)
+            streams.append(stream)
+        texts += decode_offline_streams_sherpa_onnx(_recognizer, streams)
+    return texts
+
+
+def _transcribe_batch(items: List[Dict]) -> List[Dict]:
+    """Runs in a worker process."""
+    start = time.time()
+    results = [{"id": item["id"], "audio": item["audio"]} for item in items]
+
+    if _args.long_form:
+        try:
+            _transcribe_long_form(items, results)
+        except Exception as e:
+            for result in results:
+                if "error" not in result:
+                    result.pop("segments", None)
+                    result["error"] = f"decode failed: {e}"
+    else:
+        _transcribe_short_form(items, results)
+
+    # Shared by the files of the batch
+    decode_sec = round(time.time() - start, 3)
+    for result in results:
+        result["batch_sec"] = decode_sec
+    return results
+
+
+def _transcribe_short_form(items: List[Dict], results: List[Dict]) -> None:
+    def _load(item):
+        try:
+            return load_audio(item["audio"]), None
+        except Exception as e:
+            return None, str(e)
+
+    loaded = list(_loader.map(_load, items))
+
+    ok = []
+    for result, (samples, error) in zip(results, loaded):
+        if error is not None:
+            result["error"] = error
+        else:
+            result["duration_sec"] = round(len(samples) / sample_rate, 3)
+            ok.append((result, samples))
+
+    try:
+        for (result, _), text in zip(ok, _decode_many([s for _, s in ok])):
+            result["text"] = text
+    except Exception as e:
+        for result, _ in ok:
+            result["error"] = f"decode failed: {e}"
+
+
+def _iter_segments(items: List[Dict], results: List[Dict]) -> Iterator[Tuple[Dict, Segment]]:
+    """
+    Yield (result, segment) for the speech segments of all items in order.
+    The audio is read in 1 s chunks as the VAD consumes it, so only the
+    segments that are not decoded yet are in memory.
+    """
+    for item, result in zip(items, results):
+        vad = create_vad(
+            min_silence_duration=_args.vad_min_silence_sec,
+            max_speech_duration=_args.vad_max_segment_sec,
+            model=_args.vad_model,
+        )
+        num_samples = 0
+
+        def _counted(chunks: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+            nonlocal num_samples
+            for chunk in chunks:
+                num_samples += len(chunk)
+                yield chunk
+
+        try:
+            chunks = _counted(iter_audio_chunks(item["audio"]))
+            for seg in iter_speech_segments(chunks, vad, sample_rate):
+                yield result, seg
+        except Exception as e:
+            result["error"] = str(e)
+            continue
+        result["duration_sec"] = round(num_samples / sample_rate, 3)
+
+
+def _transcribe_long_form(items: List[Dict], results: List[Dict]) -> None:
+    """
+    Cut the files into speech segments and decode the segments of all of
+    them together, batch_size at a time, as the VAD emits them, so memory
+    does not grow with the length of the files.
+    """
+    segments = _iter_segments(items, results)
+    while True:
+        batch = list(itertools.islice(segments, _args.batch_size))
+        if not batch:
+            break
+        texts = _decode_many([seg.samples for _, seg in batch])
+        for (result, seg), text in zip(batch, texts):
+            result.setdefault("segments", []).append(
+                {"start": round(seg.start, 3), "end": round(seg.end, 3), "text": text}
+            )
+
+    for result in results:
+        if "error" in result:
+            # A file that could not be read to the end
+            result.pop("segments", None)
+        else:
+            result.setdefault("segments", [])
+            result["text"] = join_segments(result["segments"])
+
+
+def _batches(items: List[Dict], batch_size: int) -> Iterable[List[Dict]]:
+    for i in range(0, len(items), batch_size):
+        yield items[i : i + batch_size]
+
+
+def main():
+    args = get_args()
+    num_workers = args.num_workers or available_cpus()
+
+    if args.overwrite and os.path.exists(args.output):
+        os.remove(args.output)
+    done = set()
+    if os.path.exists(args.output):
+        drop_partial_line(args.output)
+        done = read_done(args.output)
+    items = [item for item in iter_inputs(args.inputs) if item["id"] not in done]
+    print(
+        f"[bulk] {len(items)} files to transcribe, {len(done)} already done",
+        file=sys.stderr,
+    )
+    if not items:
+        return
+
+    global _recognizer
+    start = time.time()
+    if args.num_threads == 1:
+        # Loaded once and shared with the forked workers
+        _recognizer = _load_recognizer(args)
+        print(f"[bulk] Loaded {args.repo_id} in {time.time() - start:.1f}s", file=sys.stderr)
+    if args.long_form and not args.vad_model:
+        # Download the VAD model before forking
+        create_vad()
+
+    ctx = multiprocessing.get_context("fork")
+    num_files = num_failed = 0
+    audio_sec = 0.0
+    last_report = start = time.time()
+    with open(args.output, "a", encoding="utf-8") as out, ctx.Pool(
+        num_workers, initializer=_init_worker, initargs=(args,)
+    ) as pool:
+        for results in pool.imap_unordered(
+            _transcribe_batch, _batches(items, args.batch_size)
+        ):
+            for result in results:
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                num_files += 1
+                num_failed += "error" in result
+                audio_sec += result.get("duration_sec", 0.0)
+            out.flush()
+
+            now = time.time()
+            if now - last_report > 10 or num_files == len(items):
+                last_report = now
+                elapsed = now - start
+                print(
+                    f"[bulk] {num_files}/{len(items)} files, {num_failed} failed, "
+                    f"{audio_sec:.0f}s of audio in {elapsed:.0f}s "
+                    f"({audio_sec / max(elapsed, 1e-6):.1f}x real time)",
+                    file=sys.stderr,
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""A bounded thread pool for blocking inference work.
+
+The pool admits at most ``num_workers + max_queue`` requests at a time.
+Requests beyond that fail fast with :class:`PoolFull` instead of piling up,
+so callers can answer with 429/503 and a ``Retry-After`` header.
+
+The optional ``on_change`` and ``on_wait`` callbacks report the load of the
+pool, e.g. to metrics.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+
+class PoolFull(Exception):
+    pass
+
+
+class InferencePool:
+    """
+    Args:
+      num_workers:
+        Number of threads that run blocking work (ffmpeg, model loading,
+        decoding).
+      max_queue:
+        Number of admitted requests allowed to wait for a free worker.
+      on_change:
+        Called as ``on_change(in_flight, queued)`` whenever either number
+        changes; queued counts the calls of :meth:`run` that wait for a
+        worker thread.
+      on_wait:
+        Called with the seconds each call of :meth:`run` waited for a worker
+        thread.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 4,
+        max_queue: int = 16,
+        on_change: Optional[Callable[[int, int], None]] = None,
+        on_wait: Optional[Callable[[float], None]] = None,
+    ):
+        self.num_workers = max(1, num_workers)
+        self.capacity = self.num_workers + max(0, max_queue)
+        self.on_change = on_change
+        self.on_wait = on_wait
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.num_workers,
+            thread_name_prefix="inference",
+        )
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @contextmanager
+    def admit(self, n: int = 1) -> Iterator[None]:
+        """Reserve n slots, e.g. one per input of a batch, or raise PoolFull."""
+        with self._lock:
+            if self._in_flight + n > self.capacity:
+                raise PoolFull(
+                    f"{self._in_flight} requests in flight, capacity {self.capacity}"
+                )
+            self._in_flight += n
+            self._changed_locked()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= n
+                self._changed_locked()
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run ``fn(*args, **kwargs)`` on a worker thread and await it. Like
+        :func:`asyncio.to_thread`, fn sees the caller's context variables.
+        """
+        loop = asyncio.get_running_loop()
+        queued_at = time.monotonic()
+        started = False
+
+        def _dequeue() -> bool:
+            nonlocal started
+            with self._lock:
+                if started:
+                    return False
+                started = True
+                self._queued -= 1
+                self._changed_locked()
+                return True
+
+        def _call():
+            if _dequeue() and self.on_wait is not None:
+                self.on_wait(time.monotonic() - queued_at)
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            self._queued += 1
+            self._changed_locked()
+        try:
+            return await loop.run_in_executor(
+                self._executor, contextvars.copy_context().run, _call
+            )
+        finally:
+            # The call was cancelled before a worker picked it up
+            _dequeue()
+
+    def _changed_locked(self) -> None:
+        # Called with the lock held, so updates are reported in order
+        if self.on_change is not None:
+            self.on_change(self._in_flight, self._queued)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
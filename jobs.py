@@ -0,0 +1,403 @@
+"""A durable queue of transcription jobs.
+
+Jobs are kept in a local SQLite database, so they survive restarts and
+all processes of a pre-forked server share one queue. Uploaded audio is
+stored as a file next to the database until the job has finished.
+
+Every job belongs to a priority lane (:data:`PRIORITIES`); a worker always
+takes the oldest job of the most urgent lane. A running job holds a lease
+that its worker keeps renewing; if the worker dies, the lease expires and
+another worker runs the job again, up to ``max_attempts`` times.
+
+:class:`JobRunner` drains the queue on the event loop. It only starts a
+job while ``can_start()`` allows it, e.g. while synchronous requests leave
+inference workers idle, so bulk jobs fill spare capacity instead of
+competing with interactive traffic.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Priority lanes, most urgent first
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    request TEXT NOT NULL,
+    audio_path TEXT,
+    result TEXT,
+    error TEXT,
+    status_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (state, priority, created_at);
+"""
+
+
+class JobStore:
+    """
+    Args:
+      directory:
+        Holds the database ``jobs.db`` and the uploaded audio.
+      max_attempts:
+        How often a job is started before it is given up when its workers
+        keep dying.
+    """
+
+    def __init__(self, directory: str, max_attempts: int = 3):
+        self.directory = directory
+        self.path = os.path.join(directory, "jobs.db")
+        self.max_attempts = max_attempts
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections cannot be shared with forked children
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.join(self.directory, "audio"), exist_ok=True)
+            conn = sqlite3.connect(
+                self.path, timeout=10.0, isolation_level=None, check_same_thread=False
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def submit(
+        self,
+        request: Dict[str, Any],
+        audio: Optional[bytes] = None,
+        priority: str = "normal",
+    ) -> str:
+        """
+        Args:
+          request:
+            JSON-serializable description of the work, e.g. the options and
+            an audio_url.
+          audio:
+            The uploaded audio, if any.
+        Returns:
+          Return the id of the new job.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(
+                f"Unknown priority: {priority}. Use one of {', '.join(PRIORITIES)}"
+            )
+
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            conn = self._connect()
+            audio_path = None
+            if audio is not None:
+                audio_path = os.path.join(self.directory, "audio", job_id)
+                with open(audio_path, "wb") as f:
+                    f.write(audio)
+            conn.execute(
+                "INSERT INTO jobs (id, priority, state, created_at, request, audio_path)"
+                " VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, PRIORITIES[priority], time.time(), json.dumps(request), audio_path),
+            )
+        return job_id
+
+    def claim(self, lease_sec: float) -> Optional[Dict[str, Any]]:
+        """Start the next job, or return None if there is none."""
+        if self._conn is None and not os.path.exists(self.path):
+            # Nothing was ever submitted; don't create files just to poll
+            return None
+
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "UPDATE jobs SET state = 'failed', finished_at = ?,"
+                    " error = 'Worker stopped while running the job', status_code = 500"
+                    " WHERE state = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, self.max_attempts),
+                )
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE state = 'queued'"
+                    " OR (state = 'running' AND lease_until < ?)"
+                    " ORDER BY priority, created_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET state = 'running', started_at = ?,"
+                        " lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                        (now, now + lease_sec, row["id"]),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        job = _job(row)
+        job.update(state="running", started_at=now, attempts=row["attempts"] + 1)
+        job["request"] = json.loads(row["request"])
+        job["audio_path"] = row["audio_path"]
+        return job
+
+    def renew(self, job_ids: List[str], lease_sec: float) -> None:
+        if not job_ids:
+            return
+        with self._lock:
+            self._connect().executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND state = 'running'",
+                [(time.time() + lease_sec, job_id) for job_id in job_ids],
+            )
+
+    def finish(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._close(job_id, "done", result=json.dumps(result, ensure_ascii=False))
+
+    def fail(self, job_id: str, error: str, status_code: int = 500) -> None:
+        self._close(job_id, "failed", error=error, status_code=status_code)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the job with its result or error, or None if it is unknown."""
+        if self._conn is None and not os.path.exists(self.path):
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = _job(row)
+            if row["state"] == "queued":
+                # Number of jobs that run before this one
+                job["queue_position"] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND"
+                    " (priority < ? OR (priority = ? AND created_at < ?))",
+                    (row["priority"], row["priority"], row["created_at"]),
+                ).fetchone()[0]
+
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+            job["status_code"] = row["status_code"]
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per state."""
+        if self._conn is None and not os.path.exists(self.path):
+            return {}
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return {state: n for state, n in rows}
+
+    def purge(self, older_than_sec: float) -> int:
+        """Delete finished jobs older than older_than_sec and their audio."""
+        if self._conn is None and not os.path.exists(self.path):
+            return 0
+        cutoff = time.time() - older_than_sec
+        where = "state IN ('done', 'failed') AND finished_at < ?"
+        with self._lock:
+            conn = self._connect()
+            # Jobs given up after their workers died still have their audio
+            paths = conn.execute(
+                f"SELECT audio_path FROM jobs WHERE {where} AND audio_path IS NOT NULL",
+                (cutoff,),
+            ).fetchall()
+            cur = conn.execute(f"DELETE FROM jobs WHERE {where}", (cutoff,))
+        for (path,) in paths:
+            _remove(path)
+        return cur.rowcount
+
+    def _close(self, job_id: str, state: str, **fields) -> None:
+        fields.update(state=state, finished_at=time.time(), lease_until=None)
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT audio_path FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            conn.execute(
+                f"UPDATE jobs SET {columns}, audio_path = NULL WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+        if row is not None and row["audio_path"]:
+            _remove(row["audio_path"])
+
+
+def _remove(filename: str) -> None:
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def _job(row: sqlite3.Row) -> Dict[str, Any]:
+    lanes = {v: k for k, v in PRIORITIES.items()}
+    return {
+        "job_id": row["id"],
+        "state": row["state"],
+        "priority": lanes.get(row["priority"], str(row["priority"])),
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+        "attempts": row["attempts"],
+    }
+
+
+class JobRunner:
+    """
+    Args:
+      store:
+        The queue.
+      run:
+        A coroutine function ``run(job)`` that returns the result of a job
+        claimed from store. Exceptions fail the job; their ``status_code``
+        and ``detail`` attributes are recorded if present.
+      can_start:
+        Called before a job is started; return False to hold back, e.g.
+        while synchronous requests keep all inference workers busy.
+      concurrency:
+        Maximum number of jobs this process runs at the same time.
+      poll_sec:
+        How often the queue is checked when it is empty or held back.
+      lease_sec:
+        How long a job stays claimed without a renewal.
+      retention_sec:
+        Finished jobs are deleted this long after they finished.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        run: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        can_start: Callable[[], bool] = lambda: True,
+        concurrency: int = 2,
+        poll_sec: float = 1.0,
+        lease_sec: float = 60.0,
+        retention_sec: float = 7 * 24 * 3600,
+    ):
+        self.store = store
+        self._run = run
+        self._can_start = can_start
+        self.concurrency = max(1, concurrency)
+        self.poll_sec = poll_sec
+        self.lease_sec = lease_sec
+        self.retention_sec = retention_sec
+
+        self._running: Dict[str, "asyncio.Task"] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional["asyncio.Task"] = None
+
+    @property
+    def num_running(self) -> int:
+        return len(self._running)
+
+    def start(self) -> None:
+        """Start draining the queue on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._loop())
+
+    def notify(self) -> None:
+        """Check the queue now instead of at the next poll, e.g. after a submit."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self) -> None:
+        """
+        Stop taking jobs and cancel the running ones. Their leases expire
+        and another worker runs them again.
+        """
+        tasks = list(self._running.values())
+        if self._task is not None:
+            tasks.append(self._task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _loop(self) -> None:
+        last_renew = last_purge = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now - last_renew > self.lease_sec / 3:
+                last_renew = now
+                try:
+                    await asyncio.to_thread(
+                        self.store.renew, list(self._running), self.lease_sec
+                    )
+                except Exception as e:
+                    print(f"[jobs] Failed to renew leases: {e}")
+            if now - last_purge > 600:
+                last_purge = now
+                try:
+                    await asyncio.to_thread(self.store.purge, self.retention_sec)
+                except Exception as e:
+                    print(f"[jobs] Failed to purge old jobs: {e}")
+
+            started = False
+            if len(self._running) < self.concurrency and self._can_start():
+                try:
+                    job = await asyncio.to_thread(self.store.claim, self.lease_sec)
+                except Exception as e:
+                    print(f"[jobs] Failed to claim a job: {e}")
+                    job = None
+                if job is not None:
+                    task = asyncio.ensure_future(self._execute(job))
+                    self._running[job["job_id"]] = task
+                    started = True
+
+            if started:
+                # There may be more
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_sec)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        job_id = job["job_id"]
+        try:
+            result = await self._run(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+            await self._record(
+                self.store.fail,
+                job_id,
+                detail if isinstance(detail, str) else json.dumps(detail),
+                getattr(e, "status_code", 500),
+            )
+        else:
+            await self._record(self.store.finish, job_id, result)
+        finally:
+            self._running.pop(job_id, None)
+            # A slot is free
+            self.notify()
+
+    @staticmethod
+    async def _record(fn: Callable[..., None], job_id: str, *args) -> None:
+        """Record the outcome of a job; if that fails, its lease expires and it runs again."""
+        try:
+            await asyncio.to_thread(fn, job_id, *args)
+        except Exception as e:
+            print(f"[jobs] Failed to record the result of job {job_id}: {e}")
@@ -0,0 +1,99 @@
+"""Long-form transcription.
+
+Recordings longer than ``MAX_DURATION_SEC`` are fed chunk by chunk into a
+Silero VAD, which cuts them into speech segments at silences. Every segment
+is decoded on its own as soon as the VAD emits it, so memory and latency
+grow with the segment length rather than with the length of the file, and
+decoding overlaps with transcoding. The texts are stitched back together
+in order, each with its start and end time.
+"""
+
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple
+
+import numpy as np
+
+
+class Segment(NamedTuple):
+    # Seconds from the beginning of the recording
+    start: float
+    end: float
+    samples: np.ndarray
+
+
+def iter_speech_segments(
+    chunks: Iterable[np.ndarray], vad: Any, sample_rate: int
+) -> Iterator[Segment]:
+    """
+    Args:
+      chunks:
+        Mono float32 audio at sample_rate, in order.
+      vad:
+        A fresh ``sherpa_onnx.VoiceActivityDetector``.
+      sample_rate:
+        Sample rate of chunks; it must match the one of vad.
+    Returns:
+      Yield each speech segment as soon as the VAD has closed it.
+    """
+    for chunk in chunks:
+        vad.accept_waveform(chunk)
+        yield from _pop_segments(vad, sample_rate)
+
+    vad.flush()
+    yield from _pop_segments(vad, sample_rate)
+
+
+def _pop_segments(vad: Any, sample_rate: int) -> Iterator[Segment]:
+    while not vad.empty():
+        seg = vad.front
+        samples = np.array(seg.samples, dtype=np.float32)
+        start = seg.start / sample_rate
+        vad.pop()
+        yield Segment(start, start + len(samples) / sample_rate, samples)
+
+
+def transcribe_segments(
+    segments: Iterable[Segment],
+    submit: Callable[[np.ndarray], Future],
+    max_pending: int = 16,
+) -> List[Dict]:
+    """
+    Args:
+      segments:
+        Speech segments in order, e.g. from :func:`iter_speech_segments`.
+      submit:
+        Starts decoding the samples of one segment and returns a future
+        that resolves to its text.
+      max_pending:
+        Maximum number of segments being decoded at a time. Once reached,
+        we wait for the oldest one before reading more audio, so that one
+        long recording neither holds all of its features in memory nor
+        floods the decoder ahead of other requests.
+    Returns:
+      Return a list of ``{"start", "end", "text"}``, one per segment with a
+      non-empty text.
+    """
+    results = []
+    pending = deque()
+
+    def _collect(start: float, end: float, future: Future) -> None:
+        text = future.result().strip()
+        if text:
+            results.append(
+                {"start": round(start, 3), "end": round(end, 3), "text": text}
+            )
+
+    for seg in segments:
+        pending.append((seg.start, seg.end, submit(seg.samples)))
+        while len(pending) > max(1, max_pending):
+            _collect(*pending.popleft())
+
+    while pending:
+        _collect(*pending.popleft())
+
+    return results
+
+
+def join_segments(segments: List[Dict]) -> str:
+    return " ".join(s["text"] for s in segments)
@@ -0,0 +1,137 @@
+"""Prometheus metrics of the API server, served at ``/metrics``.
+
+``asr_stage_seconds`` splits the latency of a transcription into stages, so
+tail latency can be traced to the event loop (``receive``, ``response``),
+the inference pool (``queue_wait``), ffmpeg, model loading or the
+recognizer:
+
+- ``receive``: reading the request body
+- ``download``: fetching an ``audio_url``
+- ``queue_wait``: waiting for a thread of the inference pool
+- ``model_lookup``: getting the recognizer from the registry, including
+  loading it
+- ``wav_read``: parsing and resampling PCM or float WAV in-process
+- ``ffmpeg``: waiting for ffmpeg output. When ffmpeg output is streamed
+  into the recognizer, the time spent on feature extraction in between
+  is not included
+- ``decode``: running the recognizer once all audio has been fed
+- ``long_form``: a whole VAD-segmented transcription
+- ``response``: building the JSON response
+
+With pre-forked workers (``WORKERS`` > 1) every process has its own values.
+Set ``PROMETHEUS_MULTIPROC_DIR`` to a directory used only by this server,
+and ``/metrics`` adds up the values of all workers. The directory is
+emptied when the module is imported, i.e. once in the master process.
+"""
+
+import glob
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for _f in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+        os.remove(_f)
+
+# From 5 ms up to the longest allowed offline request
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+STAGE_SECONDS = Histogram(
+    "asr_stage_seconds",
+    "Time spent in each stage of a transcription",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+HTTP_REQUESTS = Counter(
+    "asr_http_requests_total",
+    "HTTP requests by route and status code",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "asr_http_request_seconds",
+    "Latency of HTTP requests by route",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+
+TRANSCRIPTIONS = Counter(
+    "asr_transcriptions_total",
+    "Successful transcriptions",
+    ["repo_id", "decoding_method", "source", "cached"],
+)
+AUDIO_SECONDS = Counter(
+    "asr_audio_seconds_total",
+    "Seconds of audio transcribed, not counting cached results",
+    ["repo_id", "decoding_method"],
+)
+
+IN_FLIGHT = Gauge(
+    "asr_in_flight_requests",
+    "Requests admitted to the inference pool",
+    multiprocess_mode="livesum",
+)
+QUEUED = Gauge(
+    "asr_queued_calls",
+    "Blocking calls waiting for a thread of the inference pool",
+    multiprocess_mode="livesum",
+)
+
+MODEL_LOOKUPS = Counter(
+    "asr_model_cache_lookups_total",
+    "Model registry lookups; a miss loads the model or waits for its load",
+    ["result"],
+)
+MODEL_LOADS = Histogram(
+    "asr_model_load_seconds",
+    "Time to load a model",
+    ["repo_id"],
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+MODEL_EVICTIONS = Counter(
+    "asr_model_evictions_total",
+    "Models evicted from the registry",
+)
+
+TRANSCRIPT_CACHE_LOOKUPS = Counter(
+    "asr_transcript_cache_lookups_total",
+    "Transcript cache lookups",
+    ["result"],
+)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def pool_changed(in_flight: int, queued: int) -> None:
+    """For InferencePool(on_change=...)."""
+    IN_FLIGHT.set(in_flight)
+    QUEUED.set(queued)
+
+
+def mark_process_dead(pid: int) -> None:
+    """Drop the live gauges of a worker that exited."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid, MULTIPROC_DIR)
+
+
+def render():
+    """Return a tuple (body, content_type) for a scrape."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, MULTIPROC_DIR)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -14,57 +14,53 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os
+from __future__ import annotations
+
 from functools import lru_cache
 from typing import Union
 
-import torch
-import torchaudio
 from huggingface_hub import hf_hub_download
 
-os.system("find / -name libk2*.so 2>/dev/null")
-
-os.system(
-    "cp -v /usr/local/lib/python3.10/site-packages/k2/lib/*.so //usr/local/lib/python3.10/site-packages/sherpa/lib/"
-)
-
-os.system(
-    "cp -v /home/user/.local/lib/python3.10/site-packages/k2/lib/*.so /home/user/.local/lib/python3.10/site-packages/sherpa/lib/"
-)
+from audio import WavFile, read_wav_file
+# torch, torchaudio and sherpa (k2) are only imported when a recognizer that
+# needs them is loaded; the sherpa_onnx models never do.
+from backends import sherpa, torch, torchaudio
+from model_registry import ModelRegistry
+import tracing
 
-import k2  # noqa
-import sherpa
 import sherpa_onnx
 import numpy as np
-from typing import Tuple
-import wave
+from typing import Dict, List, Tuple
 
 sample_rate = 16000
 
+# Intra-op threads of each ONNX Runtime session created by the loaders
+# below; model_num_threads overrides it per repo_id.
+num_threads = 2
+model_num_threads: Dict[str, int] = {}
+
+
+def get_num_threads(repo_id: str) -> int:
+    return model_num_threads.get(repo_id, num_threads)
+
 
 def read_wave(wave_filename: str) -> Tuple[np.ndarray, int]:
     """
     Args:
       wave_filename:
-        Path to a wave file. It should be single channel and each sample should
-        be 16-bit. Its sample rate does not need to be 16kHz.
+        Path to a wave file with 8/16/24/32-bit PCM or 32/64-bit float
+        samples. Multiple channels are averaged. Its sample rate does not
+        need to be 16kHz.
     Returns:
       Return a tuple containing:
        - A 1-D array of dtype np.float32 containing the samples, which are
        normalized to the range [-1, 1].
        - sample rate of the wave file
+    Raises:
+      ValueError if the file is not a wave file in one of these formats.
     """
-
-    with wave.open(wave_filename) as f:
-        assert f.getnchannels() == 1, f.getnchannels()
-        assert f.getsampwidth() == 2, f.getsampwidth()  # it is in bytes
-        num_samples = f.getnframes()
-        samples = f.readframes(num_samples)
-        samples_int16 = np.frombuffer(samples, dtype=np.int16)
-        samples_float32 = samples_int16.astype(np.float32)
-
-        samples_float32 = samples_float32 / 32768
-        return samples_float32, f.getframerate()
+    # Memory-mapped and converted in one pass; see audio.read_wav_file()
+    return read_wav_file(wave_filename)
 
 
 def decode_offline_recognizer(
@@ -110,9 +106,16 @@ def decode_online_recognizer(
 def decode_offline_recognizer_sherpa_onnx(
     recognizer: sherpa_onnx.OfflineRecognizer,
     filename: str,
+) -> str:
+    return decode_wave_file(recognizer, filename)
+
+
+def decode_offline_samples_sherpa_onnx(
+    recognizer: sherpa_onnx.OfflineRecognizer,
+    samples: np.ndarray,
+    sample_rate: int,
 ) -> str:
     s = recognizer.create_stream()
-    samples, sample_rate = read_wave(filename)
     s.accept_waveform(sample_rate, samples)
     recognizer.decode_stream(s)
 
@@ -120,12 +123,134 @@ def decode_offline_recognizer_sherpa_onnx(
     return s.result.text
 
 
+def decode_offline_streams_sherpa_onnx(
+    recognizer: sherpa_onnx.OfflineRecognizer,
+    streams: List[sherpa_onnx.OfflineStream],
+) -> List[str]:
+    """
+    Args:
+      recognizer:
+        The recognizer that created all of the streams.
+      streams:
+        Streams that have already accepted all of their samples.
+    Returns:
+      Return the recognition result of each stream, in the same order.
+    """
+    recognizer.decode_streams(streams)
+
+    return [s.result.text for s in streams]
+
+
+def decode_offline_batch_sherpa_onnx(
+    recognizer: sherpa_onnx.OfflineRecognizer,
+    waves: List[Tuple[np.ndarray, int]],
+) -> List[str]:
+    """
+    Args:
+      recognizer:
+        The recognizer used to create and decode all of the streams.
+      waves:
+        A list of (samples, sample_rate) tuples. samples is a 1-D float32
+        array normalized to the range [-1, 1].
+    Returns:
+      Return the recognition result of each wave, in the same order.
+    """
+    streams = []
+    for samples, sample_rate in waves:
+        s = recognizer.create_stream()
+        s.accept_waveform(sample_rate, samples)
+        streams.append(s)
+
+    return decode_offline_streams_sherpa_onnx(recognizer, streams)
+
+
+def is_online_recognizer(recognizer) -> bool:
+    return isinstance(recognizer, sherpa_onnx.OnlineRecognizer)
+
+
+def supports_batch_decode(recognizer) -> bool:
+    return isinstance(recognizer, sherpa_onnx.OfflineRecognizer)
+
+
+def supports_incremental_input(recognizer) -> bool:
+    """Whether audio can be fed chunk by chunk with accept_waveform_chunk()."""
+    return isinstance(
+        recognizer, (sherpa_onnx.OfflineRecognizer, sherpa_onnx.OnlineRecognizer)
+    )
+
+
+def accept_waveform_chunk(
+    recognizer: Union[sherpa_onnx.OfflineRecognizer, sherpa_onnx.OnlineRecognizer],
+    stream: Union[sherpa_onnx.OfflineStream, sherpa_onnx.OnlineStream],
+    samples: np.ndarray,
+    sample_rate: int,
+) -> None:
+    """
+    Feed one chunk of audio to a stream. Features are computed right away;
+    online recognizers also decode every frame that becomes ready.
+    """
+    stream.accept_waveform(sample_rate, samples)
+
+    if isinstance(recognizer, sherpa_onnx.OnlineRecognizer):
+        while recognizer.is_ready(stream):
+            recognizer.decode_stream(stream)
+
+
+@tracing.traced("model.finish_stream")
+def finish_stream(
+    recognizer: Union[sherpa_onnx.OfflineRecognizer, sherpa_onnx.OnlineRecognizer],
+    stream: Union[sherpa_onnx.OfflineStream, sherpa_onnx.OnlineStream],
+) -> str:
+    """Decode whatever is left in a stream fed by accept_waveform_chunk()."""
+    if isinstance(recognizer, sherpa_onnx.OfflineRecognizer):
+        recognizer.decode_stream(stream)
+        return stream.result.text
+
+    tail_paddings = np.zeros(int(0.3 * sample_rate), dtype=np.float32)
+    stream.accept_waveform(sample_rate, tail_paddings)
+    stream.input_finished()
+
+    while recognizer.is_ready(stream):
+        recognizer.decode_stream(stream)
+
+    return recognizer.get_result(stream)
+
+
+def decode_wave_file(
+    recognizer: Union[sherpa_onnx.OfflineRecognizer, sherpa_onnx.OnlineRecognizer],
+    filename: str,
+    window_sec: float = 10.0,
+) -> str:
+    """
+    Feed a wave file to a stream window by window, straight from a memory
+    map, so the audio never has to be in memory as a whole; see
+    audio.WavFile. An offline recognizer still keeps the features of the
+    whole file until it decodes, so for recordings of more than a few
+    minutes cut the audio into segments first (see longform.py).
+
+    Raises:
+      ValueError if the file is not a wave file that audio.WavFile reads.
+    """
+    stream = recognizer.create_stream()
+    with WavFile(filename) as f:
+        for samples in f.iter_chunks(sample_rate, window_sec):
+            accept_waveform_chunk(recognizer, stream, samples, sample_rate)
+    return finish_stream(recognizer, stream)
+
+
 def decode_online_recognizer_sherpa_onnx(
     recognizer: sherpa_onnx.OnlineRecognizer,
     filename: str,
+) -> str:
+    return decode_wave_file(recognizer, filename)
+
+
+def decode_online_samples_sherpa_onnx(
+    recognizer: sherpa_onnx.OnlineRecognizer,
+    samples: np.ndarray,
+    sample_rate: int,
 ) -> str:
     s = recognizer.create_stream()
-    samples, sample_rate = read_wave(filename)
     s.accept_waveform(sample_rate, samples)
 
     tail_paddings = np.zeros(int(0.3 * sample_rate), dtype=np.float32)
@@ -148,98 +273,157 @@ def decode(
     ],
     filename: str,
 ) -> str:
-    if isinstance(recognizer, sherpa.OfflineRecognizer):
-        return decode_offline_recognizer(recognizer, filename)
-    elif isinstance(recognizer, sherpa.OnlineRecognizer):
-        return decode_online_recognizer(recognizer, filename)
-    elif isinstance(recognizer, sherpa_onnx.OfflineRecognizer):
+    # A sherpa recognizer can only exist if sherpa has been imported
+    if isinstance(recognizer, sherpa_onnx.OfflineRecognizer):
         return decode_offline_recognizer_sherpa_onnx(recognizer, filename)
     elif isinstance(recognizer, sherpa_onnx.OnlineRecognizer):
         return decode_online_recognizer_sherpa_onnx(recognizer, filename)
+    elif sherpa.loaded and isinstance(recognizer, sherpa.OfflineRecognizer):
+        return decode_offline_recognizer(recognizer, filename)
+    elif sherpa.loaded and isinstance(recognizer, sherpa.OnlineRecognizer):
+        return decode_online_recognizer(recognizer, filename)
+    else:
+        raise ValueError(f"Unknown recognizer type {type(recognizer)}")
+
+
+@tracing.traced("model.decode_samples")
+def decode_samples(
+    recognizer: Union[
+        sherpa.OfflineRecognizer,
+        sherpa.OnlineRecognizer,
+        sherpa_onnx.OfflineRecognizer,
+        sherpa_onnx.OnlineRecognizer,
+    ],
+    samples: np.ndarray,
+    sample_rate: int,
+) -> str:
+    """
+    Like decode(), but takes samples that are already in memory.
+
+    Args:
+      samples:
+        A 1-D float32 array normalized to the range [-1, 1].
+      sample_rate:
+        Sample rate of samples.
+    """
+    if isinstance(recognizer, sherpa_onnx.OfflineRecognizer):
+        return decode_offline_samples_sherpa_onnx(recognizer, samples, sample_rate)
+    elif isinstance(recognizer, sherpa_onnx.OnlineRecognizer):
+        return decode_online_samples_sherpa_onnx(recognizer, samples, sample_rate)
+    elif sherpa.loaded and isinstance(recognizer, sherpa.OfflineRecognizer):
+        # OfflineStream.accept_samples() does not resample; the caller has
+        # to pass 16 kHz audio for these models.
+        s = recognizer.create_stream()
+        s.accept_samples(torch.from_numpy(samples))
+        recognizer.decode_stream(s)
+        return s.result.text.strip()
+    elif sherpa.loaded and isinstance(recognizer, sherpa.OnlineRecognizer):
+        s = recognizer.create_stream()
+        tail_padding = torch.zeros(int(sample_rate * 0.3), dtype=torch.float32)
+        s.accept_waveform(sample_rate, torch.from_numpy(samples))
+        s.accept_waveform(sample_rate, tail_padding)
+        s.input_finished()
+        while recognizer.is_ready(s):
+            recognizer.decode_stream(s)
+        return recognizer.get_result(s).text.strip()
     else:
         raise ValueError(f"Unknown recognizer type {type(recognizer)}")
 
 
-@lru_cache(maxsize=30)
+@tracing.traced("model.warm_up")
+def warm_up(recognizer, duration: float = 1.0) -> None:
+    """
+    Decode a short stretch of faint noise so that ONNX Runtime allocates
+    its memory arenas and selects kernels before the first real request.
+    Offline sherpa-onnx recognizers also run one batched decode, since
+    batches use different tensor shapes.
+    """
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 1e-3, int(duration * sample_rate)).astype(np.float32)
+
+    decode_samples(recognizer, samples, sample_rate)
+    if supports_batch_decode(recognizer):
+        half = samples[: len(samples) // 2]
+        decode_offline_batch_sherpa_onnx(
+            recognizer, [(samples, sample_rate), (half, sample_rate)]
+        )
+
+
 def get_pretrained_model(
     repo_id: str,
     decoding_method: str,
     num_active_paths: int,
 ) -> Union[sherpa.OfflineRecognizer, sherpa.OnlineRecognizer]:
-    if repo_id in multi_lingual_models:
-        return multi_lingual_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in chinese_models:
-        return chinese_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in chinese_dialect_models:
-        return chinese_dialect_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in english_models:
-        return english_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in chinese_english_mixed_models:
-        return chinese_english_mixed_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in chinese_cantonese_english_models:
-        return chinese_cantonese_english_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in chinese_cantonese_english_japanese_korean_models:
-        return chinese_cantonese_english_japanese_korean_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in cantonese_models:
-        return cantonese_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in tibetan_models:
-        return tibetan_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in arabic_models:
-        return arabic_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in german_models:
-        return german_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in french_models:
-        return french_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in japanese_models:
-        return japanese_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in russian_models:
-        return russian_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in korean_models:
-        return korean_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in thai_models:
-        return thai_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in vietnamese_models:
-        return vietnamese_models[repo_id](
-            repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
-        )
-    elif repo_id in portuguese_brazlian_models:
-        return portuguese_brazlian_models[repo_id](
+    """
+    Return the recognizer for the given arguments from the model registry,
+    loading it on first use. Arguments that a model ignores, e.g.
+    num_active_paths with greedy_search, do not cause another load.
+    """
+    return registry.get(repo_id, decoding_method, num_active_paths)
+
+
+def model_key(
+    repo_id: str,
+    decoding_method: str,
+    num_active_paths: int,
+) -> Tuple[str, str, int]:
+    """
+    Normalize the arguments of get_pretrained_model() so that all arguments
+    that yield the same recognizer have the same key.
+    """
+    loader = _get_loader(repo_id)
+    if loader in _loaders_without_search_config:
+        return (repo_id, "", 0)
+
+    if decoding_method == "greedy_search" or loader in _loaders_without_num_active_paths:
+        num_active_paths = 0
+
+    return (repo_id, decoding_method, int(num_active_paths))
+
+
+def _get_loader(repo_id: str):
+    for models in (
+        multi_lingual_models,
+        chinese_models,
+        chinese_dialect_models,
+        english_models,
+        chinese_english_mixed_models,
+        chinese_cantonese_english_models,
+        chinese_cantonese_english_japanese_korean_models,
+        cantonese_models,
+        tibetan_models,
+        arabic_models,
+        german_models,
+        french_models,
+        japanese_models,
+        russian_models,
+        korean_models,
+        thai_models,
+        vietnamese_models,
+        portuguese_brazlian_models,
+    ):
+        if repo_id in models:
+            return models[repo_id]
+
+    raise ValueError(f"Unsupported repo_id: {repo_id}")
+
+
+def _load_pretrained_model(
+    repo_id: str,
+    decoding_method: str,
+    num_active_paths: int,
+) -> Union[sherpa.OfflineRecognizer, sherpa.OnlineRecognizer]:
+    with tracing.span(
+        "model.load",
+        **{
+            "asr.repo_id": repo_id,
+            "asr.decoding_method": decoding_method,
+            "asr.num_active_paths": int(num_active_paths),
+        },
+    ):
+        return _get_loader(repo_id)(
             repo_id, decoding_method=decoding_method, num_active_paths=num_active_paths
         )
-    else:
-        raise ValueError(f"Unsupported repo_id: {repo_id}")
 
 
 def _get_nn_model_filename(
@@ -281,7 +465,6 @@ def _get_token_filename(
     return token_filename
 
 
-@lru_cache(maxsize=10)
 def _get_aishell2_pretrained_model(
     repo_id: str,
     decoding_method: str,
@@ -319,7 +502,6 @@ def _get_aishell2_pretrained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_offline_pre_trained_model(
     repo_id: str, decoding_method: str, num_active_paths: int
 ) -> sherpa_onnx.OfflineRecognizer:
@@ -353,7 +535,7 @@ def _get_offline_pre_trained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -362,7 +544,6 @@ def _get_offline_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_vietnamese_pretrained_model(
     repo_id: str, decoding_method: str, num_active_paths: int
 ) -> sherpa_onnx.OfflineRecognizer:
@@ -421,7 +602,7 @@ def _get_vietnamese_pretrained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -430,7 +611,6 @@ def _get_vietnamese_pretrained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_yifan_thai_pretrained_model(
     repo_id: str, decoding_method: str, num_active_paths: int
 ) -> sherpa_onnx.OfflineRecognizer:
@@ -463,7 +643,7 @@ def _get_yifan_thai_pretrained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -472,7 +652,6 @@ def _get_yifan_thai_pretrained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_zrjin_cantonese_pre_trained_model(
     repo_id: str, decoding_method: str, num_active_paths: int
 ) -> sherpa_onnx.OfflineRecognizer:
@@ -503,7 +682,7 @@ def _get_zrjin_cantonese_pre_trained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -512,7 +691,6 @@ def _get_zrjin_cantonese_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_russian_pre_trained_model_ctc(
     repo_id: str, decoding_method: str, num_active_paths: int
 ) -> sherpa_onnx.OfflineRecognizer:
@@ -532,13 +710,12 @@ def _get_russian_pre_trained_model_ctc(
     recognizer = sherpa_onnx.OfflineRecognizer.from_nemo_ctc(
         model=model,
         tokens=tokens,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
     )
 
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_russian_pre_trained_model(
     repo_id: str, decoding_method: str, num_active_paths: int
 ) -> sherpa_onnx.OfflineRecognizer:
@@ -596,7 +773,7 @@ def _get_russian_pre_trained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -606,7 +783,6 @@ def _get_russian_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_moonshine_model(
     repo_id: str, decoding_method: str, num_active_paths: int
 ) -> sherpa_onnx.OfflineRecognizer:
@@ -655,13 +831,12 @@ def _get_moonshine_model(
         uncached_decoder=uncached_decoder,
         cached_decoder=cached_decoder,
         tokens=tokens,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
     )
 
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_whisper_model(
     repo_id: str, decoding_method: str, num_active_paths: int
 ) -> sherpa_onnx.OfflineRecognizer:
@@ -688,13 +863,12 @@ def _get_whisper_model(
         encoder=encoder,
         decoder=decoder,
         tokens=tokens,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
     )
 
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_gigaspeech_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -730,7 +904,6 @@ def _get_gigaspeech_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_english_model(
     repo_id: str,
     decoding_method: str,
@@ -816,7 +989,6 @@ def _get_english_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_wenetspeech_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -851,7 +1023,6 @@ def _get_wenetspeech_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=1)
 def _get_fire_red_asr_models(repo_id: str, decoding_method: str, num_active_paths: int):
     assert repo_id in (
         "csukuangfj/sherpa-onnx-fire-red-asr-large-zh_en-2025-02-16",
@@ -879,11 +1050,10 @@ def _get_fire_red_asr_models(repo_id: str, decoding_method: str, num_active_path
         encoder=encoder,
         decoder=decoder,
         tokens=tokens,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
     )
 
 
-@lru_cache(maxsize=10)
 def _get_chinese_english_mixed_model_onnx(
     repo_id: str,
     decoding_method: str,
@@ -918,7 +1088,7 @@ def _get_chinese_english_mixed_model_onnx(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -928,7 +1098,6 @@ def _get_chinese_english_mixed_model_onnx(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_chinese_english_mixed_model(
     repo_id: str,
     decoding_method: str,
@@ -971,7 +1140,6 @@ def _get_chinese_english_mixed_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_alimeeting_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1012,7 +1180,6 @@ def _get_alimeeting_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=4)
 def _get_dolphin_ctc_models(repo_id: str, decoding_method: str, num_active_paths: int):
     assert repo_id in [
         "csukuangfj/sherpa-onnx-dolphin-base-ctc-multi-lang-int8-2025-04-02",
@@ -1043,13 +1210,12 @@ def _get_dolphin_ctc_models(repo_id: str, decoding_method: str, num_active_paths
     recognizer = sherpa_onnx.OfflineRecognizer.from_dolphin_ctc(
         tokens=tokens,
         model=nn_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
     )
 
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_wenet_model(
     repo_id: str,
     decoding_method: str,
@@ -1090,7 +1256,6 @@ def _get_wenet_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_aidatatang_200zh_pretrained_mode(
     repo_id: str,
     decoding_method: str,
@@ -1125,7 +1290,6 @@ def _get_aidatatang_200zh_pretrained_mode(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_tibetan_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1169,7 +1333,6 @@ def _get_tibetan_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_arabic_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1205,7 +1368,6 @@ def _get_arabic_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_german_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1240,7 +1402,6 @@ def _get_german_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_french_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1275,17 +1436,17 @@ def _get_french_pre_trained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
         max_active_paths=num_active_paths,
+        enable_endpoint_detection=True,
     )
 
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_sherpa_onnx_nemo_transducer_models_int8(
     repo_id: str,
     decoding_method: str,
@@ -1322,7 +1483,7 @@ def _get_sherpa_onnx_nemo_transducer_models_int8(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,  # no used
         model_type="nemo_transducer",
@@ -1333,7 +1494,6 @@ def _get_sherpa_onnx_nemo_transducer_models_int8(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_sherpa_onnx_nemo_transducer_models(
     repo_id: str,
     decoding_method: str,
@@ -1370,7 +1530,7 @@ def _get_sherpa_onnx_nemo_transducer_models(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         model_type="nemo_transducer",
@@ -1381,7 +1541,6 @@ def _get_sherpa_onnx_nemo_transducer_models(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_sherpa_onnx_nemo_ctc_models(
     repo_id: str,
     decoding_method: str,
@@ -1413,7 +1572,7 @@ def _get_sherpa_onnx_nemo_ctc_models(
     recognizer = sherpa_onnx.OfflineRecognizer.from_nemo_ctc(
         tokens=tokens,
         model=model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
     )
@@ -1421,7 +1580,6 @@ def _get_sherpa_onnx_nemo_ctc_models(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_sherpa_onnx_offline_zipformer_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1489,7 +1647,7 @@ def _get_sherpa_onnx_offline_zipformer_pre_trained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -1499,7 +1657,6 @@ def _get_sherpa_onnx_offline_zipformer_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_streaming_zipformer_ctc_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1543,15 +1700,15 @@ def _get_streaming_zipformer_ctc_pre_trained_model(
     recognizer = sherpa_onnx.OnlineRecognizer.from_zipformer2_ctc(
         tokens=tokens,
         model=model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
+        enable_endpoint_detection=True,
     )
 
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_non_streaming_zipformer_ctc_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1580,7 +1737,7 @@ def _get_non_streaming_zipformer_ctc_pre_trained_model(
     recognizer = sherpa_onnx.OfflineRecognizer.from_zipformer_ctc(
         tokens=tokens,
         model=model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
     )
@@ -1588,7 +1745,6 @@ def _get_non_streaming_zipformer_ctc_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_streaming_zipformer_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1624,17 +1780,17 @@ def _get_streaming_zipformer_pre_trained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
         max_active_paths=num_active_paths,
+        enable_endpoint_detection=True,
     )
 
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_japanese_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1684,7 +1840,6 @@ def _get_japanese_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_gigaspeech_pre_trained_model_onnx(
     repo_id: str,
     decoding_method: str,
@@ -1719,7 +1874,7 @@ def _get_gigaspeech_pre_trained_model_onnx(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -1729,7 +1884,6 @@ def _get_gigaspeech_pre_trained_model_onnx(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_streaming_paraformer_zh_yue_en_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1757,16 +1911,16 @@ def _get_streaming_paraformer_zh_yue_en_pre_trained_model(
         tokens=tokens,
         encoder=encoder_model,
         decoder=decoder_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
+        enable_endpoint_detection=True,
     )
 
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_paraformer_en_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1789,7 +1943,7 @@ def _get_paraformer_en_pre_trained_model(
     recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(
         paraformer=nn_model,
         tokens=tokens,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=sample_rate,
         feature_dim=80,
         decoding_method="greedy_search",
@@ -1799,7 +1953,6 @@ def _get_paraformer_en_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=5)
 def _get_chinese_dialect_models(
     repo_id: str, decoding_method: str, num_active_paths: int
 ) -> sherpa_onnx.OfflineRecognizer:
@@ -1818,13 +1971,12 @@ def _get_chinese_dialect_models(
     recognizer = sherpa_onnx.OfflineRecognizer.from_telespeech_ctc(
         model=nn_model,
         tokens=tokens,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
     )
 
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_sense_voice_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1845,7 +1997,7 @@ def _get_sense_voice_pre_trained_model(
     recognizer = sherpa_onnx.OfflineRecognizer.from_sense_voice(
         model=nn_model,
         tokens=tokens,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=sample_rate,
         feature_dim=80,
         decoding_method="greedy_search",
@@ -1856,7 +2008,6 @@ def _get_sense_voice_pre_trained_model(
     return recognizer
 
 
-@lru_cache(maxsize=10)
 def _get_paraformer_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1881,7 +2032,7 @@ def _get_paraformer_pre_trained_model(
     recognizer = sherpa_onnx.OfflineRecognizer.from_paraformer(
         paraformer=nn_model,
         tokens=tokens,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=sample_rate,
         feature_dim=80,
         decoding_method="greedy_search",
@@ -1936,7 +2087,7 @@ def _get_aishell_pre_trained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -1961,6 +2112,45 @@ def get_punct_model() -> sherpa_onnx.OfflinePunctuation:
     return punct
 
 
+@lru_cache(maxsize=1)
+def _get_vad_model_filename() -> str:
+    return _get_nn_model_filename(
+        repo_id="csukuangfj/vad",
+        filename="silero_vad.onnx",
+        subfolder=".",
+    )
+
+
+def create_vad(
+    min_silence_duration: float = 0.5,
+    max_speech_duration: float = 20.0,
+    model: str = "",
+) -> sherpa_onnx.VoiceActivityDetector:
+    """
+    Create a Silero VAD that cuts 16 kHz audio into speech segments.
+
+    A detector keeps state, so every long recording needs its own; only the
+    model file is shared.
+
+    Args:
+      min_silence_duration:
+        A segment ends after this many seconds of silence.
+      max_speech_duration:
+        Segments longer than this are split even without a silence.
+      model:
+        Path to silero_vad.onnx. It is downloaded from the hub if empty.
+    """
+    config = sherpa_onnx.VadModelConfig()
+    config.silero_vad.model = model or _get_vad_model_filename()
+    config.silero_vad.min_silence_duration = min_silence_duration
+    config.silero_vad.max_speech_duration = max_speech_duration
+    config.sample_rate = sample_rate
+
+    return sherpa_onnx.VoiceActivityDetector(
+        config, buffer_size_in_seconds=max(60.0, 3 * max_speech_duration)
+    )
+
+
 def _get_multi_zh_hans_pre_trained_model(
     repo_id: str,
     decoding_method: str,
@@ -1993,7 +2183,7 @@ def _get_multi_zh_hans_pre_trained_model(
         encoder=encoder_model,
         decoder=decoder_model,
         joiner=joiner_model,
-        num_threads=2,
+        num_threads=get_num_threads(repo_id),
         sample_rate=16000,
         feature_dim=80,
         decoding_method=decoding_method,
@@ -2154,6 +2344,39 @@ portuguese_brazlian_models = {
 }
 
 
+
+# Loaders that do not pass num_active_paths on, or that ignore both
+# decoding_method and num_active_paths. See model_key().
+_loaders_without_num_active_paths = {
+    _get_offline_pre_trained_model,
+    _get_vietnamese_pretrained_model,
+    _get_yifan_thai_pretrained_model,
+    _get_zrjin_cantonese_pre_trained_model,
+    _get_russian_pre_trained_model,
+    _get_streaming_paraformer_zh_yue_en_pre_trained_model,
+}
+
+_loaders_without_search_config = {
+    _get_russian_pre_trained_model_ctc,
+    _get_moonshine_model,
+    _get_whisper_model,
+    _get_fire_red_asr_models,
+    _get_dolphin_ctc_models,
+    _get_sherpa_onnx_nemo_ctc_models,
+    _get_streaming_zipformer_ctc_pre_trained_model,
+    _get_non_streaming_zipformer_ctc_pre_trained_model,
+    _get_paraformer_en_pre_trained_model,
+    _get_chinese_dialect_models,
+    _get_sense_voice_pre_trained_model,
+    _get_paraformer_pre_trained_model,
+}
+
+# All search variants of a repo_id share its weights; see model_key()
+registry = ModelRegistry(
+    _load_pretrained_model, model_key, weights_fn=lambda key: key[0]
+)
+
+
 all_models = {
     **multi_lingual_models,
     **chinese_models,
@@ -0,0 +1,255 @@
+"""A bounded registry of loaded recognizers.
+
+Recognizers are keyed by a normalized key, e.g. ``(repo_id,
+decoding_method, num_active_paths)`` with the parts that a model ignores
+cleared, so requests that would get an identical recognizer share one
+instance. Each entry records how much the resident set size (RSS) of the
+process grew while it was loaded; least recently used entries are evicted
+when there are more than ``max_models`` of them or their total exceeds
+``memory_budget_mb``.
+
+Entries whose keys map to the same weights (``weights_fn``) are variants
+of one model. sherpa-onnx binds the search method to the ONNX sessions when
+a recognizer is built, so each variant holds its own copy of the networks.
+With ``share_variants`` only one variant per model is loaded and requests
+for the others are served by it; :meth:`get_with_key` tells callers which
+variant they got.
+
+An evicted recognizer is only dropped from the registry. Requests that
+still hold it finish normally and the memory is released with the last
+reference.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process, or 0 if it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class _Entry:
+    __slots__ = ("model", "rss_bytes", "load_sec", "last_used", "pinned")
+
+    def __init__(self, model: Any, rss_bytes: int, load_sec: float):
+        self.model = model
+        self.rss_bytes = rss_bytes
+        self.load_sec = load_sec
+        self.last_used = time.time()
+        self.pinned = False
+
+
+class ModelRegistry:
+    """
+    Args:
+      load:
+        A callable ``load(*args)`` that builds a recognizer.
+      key_fn:
+        A callable ``key_fn(*args)`` that returns the cache key for the same
+        arguments. It may raise to reject invalid arguments before loading.
+      max_models:
+        Maximum number of resident recognizers; 0 means no limit.
+      memory_budget_mb:
+        Maximum total RSS growth attributed to resident recognizers; 0 means
+        no limit. Loads that run at the same time see each other's growth,
+        so the accounting is conservative during parallel warm-up.
+      weights_fn:
+        A callable that maps a key to the key of its weights, e.g.
+        ``key[0]`` for ``(repo_id, decoding_method, num_active_paths)``.
+        Defaults to the key itself, i.e. every key is its own model.
+      share_variants:
+        Serve every key of a model from whichever variant is resident
+        instead of loading another copy of the weights.
+    """
+
+    def __init__(
+        self,
+        load: Callable[..., Any],
+        key_fn: Callable[..., Hashable],
+        max_models: int = 0,
+        memory_budget_mb: float = 0,
+        weights_fn: Optional[Callable[[Hashable], Hashable]] = None,
+        share_variants: bool = False,
+    ):
+        self._load = load
+        self._key_fn = key_fn
+        self._weights_fn = weights_fn or (lambda key: key)
+        self.max_models = max_models
+        self.memory_budget_mb = memory_budget_mb
+        self.share_variants = share_variants
+        # Called with each evicted model, e.g. to stop threads serving it
+        self.on_evict: List[Callable[[Any], None]] = []
+        # Called as on_lookup(key, hit) by get_with_key(); hit is false
+        # if the caller had to wait for a load
+        self.on_lookup: List[Callable[[Hashable, bool], None]] = []
+        # Called as on_load(key, load_sec) after each successful load
+        self.on_load: List[Callable[[Hashable, float], None]] = []
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._load_locks: Dict[Hashable, threading.Lock] = {}
+
+    def configure(
+        self,
+        max_models: int,
+        memory_budget_mb: float,
+        share_variants: Optional[bool] = None,
+    ) -> None:
+        with self._lock:
+            self.max_models = max_models
+            self.memory_budget_mb = memory_budget_mb
+            if share_variants is not None:
+                self.share_variants = share_variants
+            evicted = self._evict_locked()
+        self._notify(evicted)
+
+    def key(self, *args) -> Hashable:
+        return self._key_fn(*args)
+
+    def get(self, *args) -> Any:
+        return self.get_with_key(*args)[0]
+
+    def get_with_key(self, *args) -> Tuple[Any, Hashable]:
+        """
+        Returns:
+          Return a tuple (model, key). key differs from ``self.key(*args)``
+          when another variant of the same model served the request.
+        """
+        key = self._key_fn(*args)
+        weights = self._weights_fn(key)
+        # With shared variants, all keys of a model wait for one load
+        lock_key = ("weights", weights) if self.share_variants else key
+
+        with self._lock:
+            found = self._lookup_locked(key, weights)
+            if found is None:
+                load_lock = self._load_locks.setdefault(lock_key, threading.Lock())
+        self._call(self.on_lookup, key, found is not None)
+        if found is not None:
+            return found
+
+        # Only one thread loads a given key; others wait for it
+        with load_lock:
+            with self._lock:
+                found = self._lookup_locked(key, weights)
+                if found is not None:
+                    return found
+
+            rss_before = current_rss_bytes()
+            start = time.time()
+            model = self._load(*args)
+            load_sec = time.time() - start
+            rss_bytes = max(0, current_rss_bytes() - rss_before)
+
+            with self._lock:
+                self._entries[key] = _Entry(model, rss_bytes, load_sec)
+                self._load_locks.pop(lock_key, None)
+                evicted = self._evict_locked(keep=key)
+
+        self._call(self.on_load, key, load_sec)
+        self._notify(evicted)
+        return model, key
+
+    def pin(self, key: Hashable) -> None:
+        """Exclude a resident entry from eviction."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.pinned = True
+
+    def evict(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._notify([entry.model])
+        return True
+
+    def entries(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {
+                    "key": _jsonable(key),
+                    "weights": _jsonable(self._weights_fn(key)),
+                    "rss_mb": round(e.rss_bytes / (1 << 20), 1),
+                    "load_sec": round(e.load_sec, 3),
+                    "last_used": e.last_used,
+                    "pinned": e.pinned,
+                }
+                for key, e in self._entries.items()
+            ]
+
+    def total_rss_bytes(self) -> int:
+        with self._lock:
+            return sum(e.rss_bytes for e in self._entries.values())
+
+    def _lookup_locked(
+        self, key: Hashable, weights: Hashable
+    ) -> Optional[Tuple[Any, Hashable]]:
+        model = self._touch_locked(key)
+        if model is not None:
+            return model, key
+
+        if self.share_variants:
+            for k in reversed(self._entries):
+                if self._weights_fn(k) == weights:
+                    return self._touch_locked(k), k
+
+        return None
+
+    def _touch_locked(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry.last_used = time.time()
+        self._entries.move_to_end(key)
+        return entry.model
+
+    def _over_budget_locked(self) -> bool:
+        if self.max_models > 0 and len(self._entries) > self.max_models:
+            return True
+        if self.memory_budget_mb > 0:
+            total = sum(e.rss_bytes for e in self._entries.values())
+            return total > self.memory_budget_mb * (1 << 20)
+        return False
+
+    def _evict_locked(self, keep: Hashable = None) -> List[Any]:
+        evicted = []
+        while self._over_budget_locked():
+            # Oldest first; the model that was just loaded always stays
+            victim = next(
+                (
+                    k
+                    for k, e in self._entries.items()
+                    if k != keep and not e.pinned
+                ),
+                None,
+            )
+            if victim is None:
+                break
+            evicted.append(self._entries.pop(victim).model)
+        return evicted
+
+    def _notify(self, models: List[Any]) -> None:
+        for model in models:
+            self._call(self.on_evict, model)
+
+    @staticmethod
+    def _call(callbacks: List[Callable], *args) -> None:
+        for callback in callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"[registry] callback {callback!r} failed: {e}")
+
+
+def _jsonable(key: Hashable) -> Any:
+    return list(key) if isinstance(key, tuple) else key
@@ -0,0 +1,197 @@
+"""Pre-fork serving with copy-on-write model weights.
+
+The master process imports the app, loads and warms up the preloaded models
+and only then forks the worker processes, which inherit the loaded ONNX
+sessions. Pages that nobody writes to, i.e. the weights, stay shared
+between all workers, so N workers cost about one copy of each model plus
+their per-process working memory.
+
+ONNX Runtime thread pools do not survive fork(), so sessions created in
+the master must use a single intra-op thread; parallelism comes from the
+worker processes instead. :func:`plan_workers` picks the numbers.
+"""
+
+import gc
+import os
+import signal
+import socket
+import time
+from typing import Callable, NamedTuple, Optional
+
+
+class WorkerPlan(NamedTuple):
+    # Number of server processes
+    workers: int
+    # Intra-op threads of each ONNX Runtime session
+    threads_per_session: int
+    # Threads per process that run ffmpeg, model loading and decoding
+    inference_workers: int
+
+
+def available_cpus() -> int:
+    """CPUs this process may use, honoring affinity and a cgroup v2 quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover - not available on macOS
+        cpus = os.cpu_count() or 1
+
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return cpus
+
+
+# THREADING_POLICY values
+POLICY_THROUGHPUT = "throughput"
+POLICY_LATENCY = "latency"
+
+
+def plan_workers(
+    cpus: int,
+    threads_per_session: int,
+    workers: int = 0,
+    prefork: bool = False,
+    policy: str = "",
+) -> WorkerPlan:
+    """
+    Args:
+      cpus:
+        Number of usable cores, e.g. from :func:`available_cpus`.
+      threads_per_session:
+        The configured ``num_threads`` of the ONNX sessions. Ignored by
+        the policies.
+      workers:
+        Requested number of processes; 0 picks one so that
+        ``workers * threads_per_session`` covers all cores.
+      prefork:
+        Whether the workers are forked after the models are loaded. This
+        forces one thread per session, see the module docstring.
+      policy:
+        ``"throughput"``: few threads per decode and many concurrent
+        requests, i.e. single-threaded sessions and one inference thread
+        per core. ``"latency"``: each process decodes one request at a
+        time with all of its cores. Empty: use threads_per_session as is.
+    """
+    if policy not in ("", POLICY_THROUGHPUT, POLICY_LATENCY):
+        raise ValueError(f"Unknown threading policy: {policy}")
+
+    if prefork or policy == POLICY_THROUGHPUT:
+        threads = 1
+    elif policy == POLICY_LATENCY:
+        threads = max(1, cpus // max(1, workers))
+    else:
+        threads = max(1, threads_per_session)
+
+    if workers <= 0:
+        workers = max(1, cpus // threads)
+
+    if policy == POLICY_LATENCY:
+        # One decode plus one thread for ffmpeg and request parsing
+        inference_workers = 2
+    else:
+        # One decode per core plus one thread for ffmpeg and request parsing
+        inference_workers = max(2, cpus // (workers * threads) + 1)
+
+    return WorkerPlan(workers, threads, inference_workers)
+
+
+def serve(
+    app,
+    host: str,
+    port: int,
+    workers: int,
+    preload: Optional[Callable[[], None]] = None,
+    log_level: str = "info",
+    on_worker_exit: Optional[Callable[[int], None]] = None,
+) -> None:
+    """
+    Run ``workers`` uvicorn servers that share one listening socket.
+
+    Args:
+      app:
+        The ASGI app. It must not have started any threads yet.
+      preload:
+        Called in the master before forking, e.g. to load the models.
+      on_worker_exit:
+        Called in the master with the pid of each worker that exited.
+    """
+    import uvicorn
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    if preload is not None:
+        preload()
+
+    # Keep the garbage collector from touching (and thereby copying) the
+    # pages of everything allocated so far
+    gc.collect()
+    gc.freeze()
+
+    def _run_worker() -> None:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        config = uvicorn.Config(app, log_level=log_level)
+        uvicorn.Server(config).run(sockets=[sock])
+
+    def _spawn() -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker()
+            except BaseException as e:
+                print(f"[prefork] worker {os.getpid()} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        print(f"[prefork] started worker {pid}")
+        return pid
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    children = {}
+    for _ in range(max(1, workers)):
+        children[_spawn()] = time.monotonic()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        started = children.pop(pid, None)
+        if on_worker_exit is not None:
+            on_worker_exit(pid)
+        if started is None or stopping:
+            continue
+
+        print(f"[prefork] worker {pid} exited with status {status}, restarting")
+        if time.monotonic() - started < 1.0:
+            # Avoid a tight restart loop if workers die at startup
+            time.sleep(1.0)
+        children[_spawn()] = time.monotonic()
+
+    sock.close()
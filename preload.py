@@ -0,0 +1,156 @@
+"""Load and warm up a set of models at startup.
+
+The preload manifest lists ``(repo_id, decoding_method, num_active_paths)``
+entries. It comes from ``PRELOAD_MODELS``, a comma separated list of
+``repo_id[:decoding_method[:num_active_paths]]``, and/or from a JSON file
+(``PRELOAD_MANIFEST``) that holds a list of objects with the same keys.
+
+A :class:`Preloader` loads every entry on its own thread and runs one dummy
+decode on it; :attr:`Preloader.ready` turns true once all of them are warm.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple
+
+
+class PreloadEntry(NamedTuple):
+    repo_id: str
+    decoding_method: str
+    num_active_paths: int
+
+
+def parse_preload_models(
+    spec: str, decoding_method: str, num_active_paths: int
+) -> List[PreloadEntry]:
+    """
+    Args:
+      spec:
+        e.g. ``"hynt/a:greedy_search, hynt/a:modified_beam_search:8"``.
+        An empty spec, ``"none"`` or ``"off"`` gives no entries.
+      decoding_method:
+        Used for entries without one.
+      num_active_paths:
+        Used for entries without one.
+    """
+    entries = []
+    if spec.strip().lower() in ("none", "off"):
+        return entries
+    for item in spec.replace("\n", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split(":")
+        if len(parts) > 3:
+            raise ValueError(f"Invalid preload entry: {item}")
+        entries.append(
+            PreloadEntry(
+                parts[0],
+                parts[1] if len(parts) > 1 and parts[1] else decoding_method,
+                int(parts[2]) if len(parts) > 2 else num_active_paths,
+            )
+        )
+    return entries
+
+
+def load_manifest(
+    filename: str, decoding_method: str, num_active_paths: int
+) -> List[PreloadEntry]:
+    with open(filename, encoding="utf-8") as f:
+        items = json.load(f)
+    if not isinstance(items, list):
+        raise ValueError(f"{filename}: expected a list of models")
+
+    return [
+        PreloadEntry(
+            str(item["repo_id"]),
+            str(item.get("decoding_method", decoding_method)),
+            int(item.get("num_active_paths", num_active_paths)),
+        )
+        for item in items
+    ]
+
+
+class Preloader:
+    """
+    Args:
+      entries:
+        Models to load; duplicates are loaded once.
+      load:
+        A callable ``load(repo_id, decoding_method, num_active_paths)`` that
+        returns the recognizer, e.g. via the model registry.
+      warm_up:
+        A callable ``warm_up(recognizer)`` that runs a dummy decode.
+      num_workers:
+        Number of models loaded at the same time.
+    """
+
+    def __init__(
+        self,
+        entries: List[PreloadEntry],
+        load: Callable[[str, str, int], Any],
+        warm_up: Callable[[Any], None],
+        num_workers: int = 4,
+    ):
+        self.entries = list(dict.fromkeys(entries))
+        self._load = load
+        self._warm_up = warm_up
+        self.num_workers = max(1, num_workers)
+
+        self._lock = threading.Lock()
+        self._status: Dict[PreloadEntry, Dict] = {
+            e: {"state": "pending"} for e in self.entries
+        }
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return all(s["state"] == "warm" for s in self._status.values())
+
+    @property
+    def failed(self) -> bool:
+        with self._lock:
+            return any(s["state"] == "failed" for s in self._status.values())
+
+    def status(self) -> List[Dict]:
+        with self._lock:
+            return [{**e._asdict(), **self._status[e]} for e in self.entries]
+
+    def start(self) -> None:
+        """Load all entries in the background and return immediately."""
+        if self.ready:
+            # Already done, e.g. in the master of a pre-forked server
+            return
+        self._thread = threading.Thread(
+            target=self.run, name="preload", daemon=True
+        )
+        self._thread.start()
+
+    def run(self) -> None:
+        with ThreadPoolExecutor(
+            max_workers=min(self.num_workers, max(1, len(self.entries))),
+            thread_name_prefix="preload",
+        ) as executor:
+            list(executor.map(self._preload, self.entries))
+
+    def _preload(self, entry: PreloadEntry) -> None:
+        self._set(entry, state="loading")
+        start = time.time()
+        try:
+            recognizer = self._load(*entry)
+            load_sec = time.time() - start
+            self._set(entry, state="warming", load_sec=round(load_sec, 3))
+
+            start = time.time()
+            self._warm_up(recognizer)
+            self._set(entry, state="warm", warm_up_sec=round(time.time() - start, 3))
+        except Exception as e:
+            print(f"[preload] Failed to load {entry}: {e}")
+            self._set(entry, state="failed", error=str(e))
+
+    def _set(self, entry: PreloadEntry, **kwargs) -> None:
+        with self._lock:
+            self._status[entry].update(kwargs)
@@ -0,0 +1,185 @@
+"""Opt-in profiling of single requests.
+
+A :class:`RequestProfile` is bound to the context of a request, so the
+pipeline can record spans into it from the event loop as well as from the
+threads of the inference pool (which runs calls in a copy of the caller's
+context). Outside of a profiled request, :func:`span` and :func:`record`
+do nothing beyond one context variable lookup.
+
+With ``cprofile=True`` the blocking calls of the request that go through
+:func:`call` also run under :mod:`cProfile`. Only one call in the process
+is profiled at a time; concurrent ones run unprofiled. The ``.prof`` file
+written by :meth:`RequestProfile.dump` can be viewed with e.g. snakeviz or
+turned into a flame graph with flameprof.
+"""
+
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_current: "contextvars.ContextVar[Optional[RequestProfile]]" = contextvars.ContextVar(
+    "request_profile", default=None
+)
+
+# cProfile cannot profile two threads at the same time in Python >= 3.12
+_cprofile_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    Args:
+      cprofile:
+        Also collect cProfile statistics of the calls made via :func:`call`.
+    """
+
+    # Later spans are only added to the per-stage totals, e.g. for the
+    # hundreds of chunks of a long ffmpeg stream
+    MAX_SPANS = 200
+
+    def __init__(self, cprofile: bool = False):
+        self.id = uuid.uuid4().hex
+        self.created = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self._lock = threading.Lock()
+        # (name, start, duration, thread name)
+        self._spans: List[tuple] = []
+        # name -> [seconds, count]
+        self._totals: Dict[str, list] = {}
+        self._cprofile = cProfile.Profile() if cprofile else None
+        self._cprofiled_calls = 0
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        """Record a span that started at ``time.perf_counter()`` value start."""
+        with self._lock:
+            total = self._totals.setdefault(name, [0.0, 0])
+            total[0] += duration
+            total[1] += 1
+            if len(self._spans) < self.MAX_SPANS:
+                self._spans.append(
+                    (name, start, duration, threading.current_thread().name)
+                )
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        if self._cprofile is None or not _cprofile_lock.acquire(blocking=False):
+            return fn(*args, **kwargs)
+        try:
+            self._cprofiled_calls += 1
+            return self._cprofile.runcall(fn, *args, **kwargs)
+        finally:
+            _cprofile_lock.release()
+
+    def finish(self) -> None:
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    @property
+    def total_sec(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def top_functions(self, n: int = 15) -> List[Dict[str, Any]]:
+        """The n functions with the most own time, from cProfile."""
+        if self._cprofile is None or not self._cprofiled_calls:
+            return []
+        stats = pstats.Stats(self._cprofile).stats
+        rows = sorted(stats.items(), key=lambda kv: kv[1][2], reverse=True)[:n]
+        return [
+            {
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": calls,
+                "tottime_ms": round(1000 * tottime, 3),
+                "cumtime_ms": round(1000 * cumtime, 3),
+            }
+            for (filename, line, name), (_, calls, tottime, cumtime, _) in rows
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self._spans, key=lambda s: s[1])
+            totals = dict(self._totals)
+        result = {
+            "id": self.id,
+            "total_ms": round(1000 * self.total_sec, 3),
+            "stages": {
+                name: {"ms": round(1000 * sec, 3), "count": count}
+                for name, (sec, count) in totals.items()
+            },
+            "timeline": [
+                {
+                    "name": name,
+                    "start_ms": round(1000 * (start - self.start), 3),
+                    "ms": round(1000 * duration, 3),
+                    "thread": thread,
+                }
+                for name, start, duration, thread in spans
+            ],
+        }
+        if self._cprofile is not None:
+            result["top_functions"] = self.top_functions()
+        return result
+
+    def dump(self, directory: str) -> str:
+        """
+        Write ``<id>.json`` and, with cProfile, ``<id>.prof`` to directory.
+
+        Returns:
+          Return the name of the JSON file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.created))
+        base = os.path.join(directory, f"{stamp}-{self.id}")
+        if self._cprofile is not None and self._cprofiled_calls:
+            self._cprofile.dump_stats(base + ".prof")
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+        return base + ".json"
+
+
+def current() -> Optional[RequestProfile]:
+    return _current.get()
+
+
+@contextmanager
+def activate(profile: RequestProfile) -> Iterator[RequestProfile]:
+    """Bind profile to the current context, and thereby to its tasks."""
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+        profile.finish()
+
+
+def record(name: str, seconds: float) -> None:
+    """Record a span of the given length that ends now."""
+    profile = _current.get()
+    if profile is not None:
+        profile.add(name, time.perf_counter() - seconds, seconds)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, start, time.perf_counter() - start)
+
+
+def call(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Call fn, under cProfile if the current request asked for it."""
+    profile = _current.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    return profile.call(fn, *args, **kwargs)
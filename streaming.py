@@ -0,0 +1,363 @@
+"""Live recognition with sherpa-onnx online recognizers.
+
+A :class:`StreamingSession` wraps one ``OnlineStream``. Connections push
+audio into their session from any thread; an :class:`OnlineScheduler`
+owns every session of one recognizer and, on each tick, feeds the pending
+audio into the streams and decodes all ready streams together with
+``recognizer.decode_streams``. Sessions report partial hypotheses, plus a
+final one each time the recognizer detects an endpoint, through a
+callback.
+
+All calls into sherpa-onnx for a given recognizer happen on its scheduler
+thread, so streams are never touched concurrently.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# Appended after the last chunk so that the final frames are decoded
+TAIL_PADDING_SEC = 0.3
+
+# on_events(events, done). done is True for the last call of a session.
+EventCallback = Callable[[List[Dict], bool], None]
+
+
+class BacklogFull(Exception):
+    """More audio is waiting for the scheduler than a session may buffer."""
+
+
+class StreamingSession:
+    """
+    Args:
+      recognizer:
+        A ``sherpa_onnx.OnlineRecognizer`` built with
+        ``enable_endpoint_detection=True``.
+      on_events:
+        Called from the scheduler thread with the events produced by each
+        tick; see :meth:`poll`.
+      max_pending_sec:
+        Seconds of audio that may wait for the scheduler before
+        :meth:`push` raises :class:`BacklogFull`; 0 means no limit.
+    """
+
+    def __init__(
+        self, recognizer: Any, on_events: EventCallback, max_pending_sec: float = 0.0
+    ):
+        self.recognizer = recognizer
+        self.stream = recognizer.create_stream()
+        self.on_events = on_events
+        self.segment = 0
+        self.num_samples = 0
+
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._pending_sec = 0.0
+        self.max_pending_sec = max_pending_sec
+        self._finish_requested = False
+        self._input_finished = False
+        self._sample_rate = 16000
+        self._last_text = ""
+        self._scheduler: Optional["OnlineScheduler"] = None
+
+    # Producer side; safe to call from any thread
+
+    def push(self, samples: np.ndarray, sample_rate: int) -> None:
+        """
+        Raises:
+          BacklogFull if the client sends audio faster than it is decoded,
+          or after the session has failed and is no longer drained.
+        """
+        with self._lock:
+            pending_sec = self._pending_sec + len(samples) / sample_rate
+            if self.max_pending_sec > 0 and pending_sec > self.max_pending_sec:
+                raise BacklogFull(
+                    f"More than {self.max_pending_sec:g}s of audio waiting to be decoded"
+                )
+            self._pending.append((samples, sample_rate))
+            self._pending_sec = pending_sec
+        self._wakeup()
+
+    def finish(self) -> None:
+        """Called after the client has sent its last chunk."""
+        with self._lock:
+            self._finish_requested = True
+        self._wakeup()
+
+    def _wakeup(self) -> None:
+        scheduler = self._scheduler
+        if scheduler is not None:
+            scheduler.wakeup()
+
+    # Scheduler side
+
+    def has_input(self) -> bool:
+        return bool(self._pending) or (
+            self._finish_requested and not self._input_finished
+        )
+
+    def drain_input(self) -> None:
+        """Move pending audio into the stream."""
+        with self._lock:
+            chunks = list(self._pending)
+            self._pending.clear()
+            self._pending_sec = 0.0
+            finish = self._finish_requested and not self._input_finished
+
+        for samples, sample_rate in chunks:
+            self._sample_rate = sample_rate
+            self.num_samples += len(samples)
+            self.stream.accept_waveform(sample_rate, samples)
+
+        if finish:
+            tail_paddings = np.zeros(
+                int(TAIL_PADDING_SEC * self._sample_rate), dtype=np.float32
+            )
+            self.stream.accept_waveform(self._sample_rate, tail_paddings)
+            self.stream.input_finished()
+            self._input_finished = True
+
+    @property
+    def done(self) -> bool:
+        return self._input_finished and not self.recognizer.is_ready(self.stream)
+
+    def poll(self) -> List[Dict]:
+        """
+        Returns:
+          Return a list of events. A ``partial`` event is emitted when the
+          hypothesis of the current segment changes, and a ``final`` event
+          when an endpoint is detected (or the input is over), after which a
+          new segment starts.
+        """
+        events = []
+        text = self.recognizer.get_result(self.stream)
+
+        if self.done:
+            if text:
+                events.append(self._event("final", text))
+        elif self.recognizer.is_endpoint(self.stream):
+            if text:
+                events.append(self._event("final", text))
+            self.recognizer.reset(self.stream)
+            self.segment += 1
+            self._last_text = ""
+        elif text != self._last_text:
+            self._last_text = text
+            events.append(self._event("partial", text))
+
+        return events
+
+    def _event(self, kind: str, text: str) -> Dict:
+        return {
+            "type": kind,
+            "segment": self.segment,
+            "text": text,
+            "audio_sec": round(self.num_samples / self._sample_rate, 3),
+        }
+
+
+class OnlineScheduler:
+    """
+    Decodes all sessions of one recognizer on a single thread.
+
+    Args:
+      recognizer:
+        A ``sherpa_onnx.OnlineRecognizer``.
+      max_batch_size:
+        Maximum number of streams passed to one ``decode_streams`` call.
+      tick_budget_ms:
+        Time budget of one tick. Every ready stream is decoded at least once
+        per tick, starting from a rotating position so that no connection
+        is always last; streams with a backlog only get extra passes while
+        the budget lasts.
+    """
+
+    def __init__(
+        self,
+        recognizer: Any,
+        max_batch_size: int = 32,
+        tick_budget_ms: float = 50.0,
+    ):
+        self.recognizer = recognizer
+        self.max_batch_size = max(1, max_batch_size)
+        self.tick_budget = max(0.0, tick_budget_ms) / 1000.0
+
+        self._cond = threading.Condition()
+        self._sessions: List[StreamingSession] = []
+        self._has_work = False
+        self._stopped = False
+        self._retired = False
+        self._next = 0
+
+        self._thread = threading.Thread(
+            target=self._run, name="online-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def num_sessions(self) -> int:
+        return len(self._sessions)
+
+    def add(self, session: StreamingSession) -> None:
+        assert session.recognizer is self.recognizer
+        with self._cond:
+            self._sessions.append(session)
+            session._scheduler = self
+            self._has_work = True
+            self._cond.notify()
+
+    def remove(self, session: StreamingSession) -> None:
+        with self._cond:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            session._scheduler = None
+            if self._retired and not self._sessions:
+                self._stopped = True
+                self._cond.notify()
+
+    def wakeup(self) -> None:
+        with self._cond:
+            self._has_work = True
+            self._cond.notify()
+
+    def retire(self) -> None:
+        """Let the thread exit once the remaining sessions are closed."""
+        with self._cond:
+            self._retired = True
+            if not self._sessions:
+                self._stopped = True
+                self._cond.notify()
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._has_work and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                self._has_work = False
+                sessions = list(self._sessions)
+
+            if sessions and self._tick(sessions):
+                # Budget ran out with streams still ready
+                with self._cond:
+                    self._has_work = True
+
+    def _tick(self, sessions: List[StreamingSession]) -> bool:
+        recognizer = self.recognizer
+        deadline = time.monotonic() + self.tick_budget
+
+        start = self._next % len(sessions)
+        self._next += 1
+        order = sessions[start:] + sessions[:start]
+
+        touched = []
+        failed = set()
+        for s in order:
+            if s.has_input():
+                try:
+                    s.drain_input()
+                except Exception as e:
+                    self._fail(s, e, failed)
+                    continue
+                touched.append(s)
+
+        ready = [s for s in order if s not in failed and recognizer.is_ready(s.stream)]
+        while ready:
+            for i in range(0, len(ready), self.max_batch_size):
+                batch = ready[i : i + self.max_batch_size]
+                try:
+                    recognizer.decode_streams([s.stream for s in batch])
+                except Exception as e:
+                    for s in batch:
+                        self._fail(s, e, failed)
+                    continue
+                touched.extend(batch)
+
+            if time.monotonic() >= deadline:
+                break
+            ready = [
+                s
+                for s in order
+                if s not in failed and recognizer.is_ready(s.stream)
+            ]
+
+        seen = set()
+        for s in touched:
+            if s in seen or s in failed:
+                continue
+            seen.add(s)
+            try:
+                events = s.poll()
+                done = s.done
+            except Exception as e:
+                self._fail(s, e, failed)
+                continue
+            if done:
+                self._close(s, events)
+            elif events:
+                s.on_events(events, False)
+
+        return any(
+            s not in failed and recognizer.is_ready(s.stream) for s in order
+        )
+
+    def _close(self, session: StreamingSession, events: List[Dict]) -> None:
+        self.remove(session)
+        session.on_events(events, True)
+
+    def _fail(self, session: StreamingSession, error: Exception, failed: set) -> None:
+        """End a session whose audio could not be fed, decoded or polled."""
+        failed.add(session)
+        self._close(session, [{"type": "error", "detail": str(error)}])
+
+
+class OnlineSchedulerPool:
+    """One :class:`OnlineScheduler` per recognizer, created on demand."""
+
+    def __init__(self, max_batch_size: int = 32, tick_budget_ms: float = 50.0):
+        self.max_batch_size = max_batch_size
+        self.tick_budget_ms = tick_budget_ms
+        self._lock = threading.Lock()
+        self._schedulers: Dict[int, OnlineScheduler] = {}
+
+    def get(self, recognizer: Any) -> OnlineScheduler:
+        with self._lock:
+            scheduler = self._schedulers.get(id(recognizer))
+            if scheduler is None or scheduler.recognizer is not recognizer:
+                scheduler = OnlineScheduler(
+                    recognizer,
+                    max_batch_size=self.max_batch_size,
+                    tick_budget_ms=self.tick_budget_ms,
+                )
+                self._schedulers[id(recognizer)] = scheduler
+            return scheduler
+
+    def release(self, recognizer: Any) -> None:
+        """Called when recognizer is evicted from the model registry."""
+        with self._lock:
+            scheduler = self._schedulers.get(id(recognizer))
+            if scheduler is None or scheduler.recognizer is not recognizer:
+                return
+            del self._schedulers[id(recognizer)]
+        scheduler.retire()
+
+    def num_sessions(self) -> int:
+        with self._lock:
+            return sum(s.num_sessions for s in self._schedulers.values())
+
+    def stop(self) -> None:
+        with self._lock:
+            schedulers = list(self._schedulers.values())
+            self._schedulers = {}
+        for s in schedulers:
+            s.stop()
@@ -0,0 +1,221 @@
+import struct
+
+import numpy as np
+import pytest
+
+import audio
+
+
+def make_wav(
+    payload: bytes,
+    num_channels: int = 1,
+    sample_rate: int = 16000,
+    bits: int = 16,
+    format_tag: int = audio.WAVE_FORMAT_PCM,
+    data_size=None,
+) -> bytes:
+    block_align = num_channels * bits // 8
+    fmt = struct.pack(
+        "<HHIIHH",
+        format_tag,
+        num_channels,
+        sample_rate,
+        sample_rate * block_align,
+        block_align,
+        bits,
+    )
+    size = len(payload) if data_size is None else data_size
+    body = (
+        b"WAVE"
+        + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+        + b"data" + struct.pack("<I", size) + payload
+    )
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def test_pcm16_mono():
+    pcm = np.array([-32768, -16384, 0, 16384, 32767], dtype="<i2")
+    samples, rate = audio.read_wav_bytes(make_wav(pcm.tobytes()))
+    assert rate == 16000
+    assert samples.dtype == np.float32
+    np.testing.assert_allclose(samples, pcm / 32768.0)
+
+
+def test_pcm16_stereo_is_downmixed():
+    pcm = np.array([[1000, 3000], [-32768, -32768], [32767, -32767]], dtype="<i2")
+    samples, _ = audio.read_wav_bytes(make_wav(pcm.tobytes(), num_channels=2))
+    np.testing.assert_allclose(samples, pcm.mean(axis=1) / 32768.0, rtol=1e-6)
+
+
+def test_pcm8_is_unsigned():
+    pcm = np.array([0, 64, 128, 255], dtype="u1")
+    samples, _ = audio.read_wav_bytes(make_wav(pcm.tobytes(), bits=8))
+    np.testing.assert_allclose(samples, [-1.0, -0.5, 0.0, 127 / 128])
+
+
+def test_pcm8_stereo():
+    pcm = np.array([[0, 255], [128, 192]], dtype="u1")
+    samples, _ = audio.read_wav_bytes(
+        make_wav(pcm.tobytes(), num_channels=2, bits=8)
+    )
+    np.testing.assert_allclose(samples, [(-128 + 127) / 256, 64 / 256])
+
+
+def _pack_int24(values) -> bytes:
+    return b"".join(struct.pack("<i", v)[:3] for v in values)
+
+
+def test_pcm24_sign_extension():
+    values = [-(1 << 23), -1, 0, 1, (1 << 23) - 1]
+    samples, _ = audio.read_wav_bytes(make_wav(_pack_int24(values), bits=24))
+    np.testing.assert_allclose(samples, np.array(values) / float(1 << 23))
+
+
+def test_pcm24_stereo():
+    values = [-(1 << 23), (1 << 22), 1000, -3000]
+    samples, _ = audio.read_wav_bytes(
+        make_wav(_pack_int24(values), num_channels=2, bits=24)
+    )
+    expected = np.array(values).reshape(-1, 2).mean(axis=1) / float(1 << 23)
+    np.testing.assert_allclose(samples, expected, rtol=1e-6)
+
+
+def test_pcm32():
+    pcm = np.array([-(1 << 31), -(1 << 30), 0, (1 << 30)], dtype="<i4")
+    samples, _ = audio.read_wav_bytes(make_wav(pcm.tobytes(), bits=32))
+    np.testing.assert_allclose(samples, [-1.0, -0.5, 0.0, 0.5])
+
+
+@pytest.mark.parametrize("dtype,bits", [("<f4", 32), ("<f8", 64)])
+def test_float(dtype, bits):
+    values = np.array([[-1.0, 0.5], [0.25, 0.25], [0.0, -0.5]], dtype=dtype)
+    samples, _ = audio.read_wav_bytes(
+        make_wav(
+            values.tobytes(),
+            num_channels=2,
+            bits=bits,
+            format_tag=audio.WAVE_FORMAT_IEEE_FLOAT,
+        )
+    )
+    assert samples.dtype == np.float32
+    np.testing.assert_allclose(samples, values.mean(axis=1))
+
+
+def test_extensible_format_uses_sub_format():
+    pcm = np.array([0, 16384], dtype="<i2")
+    fmt = struct.pack(
+        "<HHIIHHHHIH14x",
+        audio.WAVE_FORMAT_EXTENSIBLE, 1, 16000, 32000, 2, 16,
+        22, 16, 0x4, audio.WAVE_FORMAT_PCM,
+    )
+    body = (
+        b"WAVE"
+        + b"fmt " + struct.pack("<I", len(fmt)) + fmt
+        + b"data" + struct.pack("<I", len(pcm.tobytes())) + pcm.tobytes()
+    )
+    data = b"RIFF" + struct.pack("<I", len(body)) + body
+    assert audio.parse_wav_header(data).format_tag == audio.WAVE_FORMAT_PCM
+    samples, _ = audio.read_wav_bytes(data)
+    np.testing.assert_allclose(samples, [0.0, 0.5])
+
+
+@pytest.mark.parametrize("data_size", [0, 0xFFFFFFFF])
+def test_streamed_data_size(data_size):
+    pcm = np.array([1, 2, 3], dtype="<i2")
+    samples, _ = audio.read_wav_bytes(make_wav(pcm.tobytes(), data_size=data_size))
+    assert len(samples) == 3
+
+
+def test_partial_frame_is_dropped():
+    pcm = np.array([100, 200, 300], dtype="<i2")
+    samples, _ = audio.read_wav_bytes(make_wav(pcm.tobytes(), num_channels=2))
+    np.testing.assert_allclose(samples, [150 / 32768])
+
+
+def test_unsupported_input_falls_back():
+    assert audio.read_wav_bytes(b"ID3\x03 not a wave file") is None
+    adpcm = make_wav(b"\x00" * 16, bits=4, format_tag=0x0002)
+    assert audio.parse_wav_header(adpcm) is not None
+    assert audio.read_wav_bytes(adpcm) is None
+    assert audio.iter_wav_chunks(adpcm, 16000) is None
+
+
+def test_conversion_blocks(monkeypatch):
+    monkeypatch.setattr(audio, "_BLOCK_FRAMES", 7)
+    rng = np.random.default_rng(0)
+    values = rng.integers(-(1 << 23), 1 << 23, size=(50, 3))
+    data = make_wav(_pack_int24(values.ravel()), num_channels=3, bits=24)
+    frames = audio.wav_frames(data, audio.parse_wav_header(data))
+    samples = audio.frames_to_float32(frames, 24)
+    np.testing.assert_allclose(
+        samples, values.mean(axis=1) / float(1 << 23), rtol=1e-5, atol=1e-7
+    )
+
+
+def test_pcm16_to_float32():
+    pcm = np.array([-32768, 0, 16384, 16384, 300], dtype="<i2")
+    np.testing.assert_allclose(audio.pcm16_to_float32(pcm), pcm / 32768.0)
+    np.testing.assert_allclose(
+        audio.pcm16_to_float32(pcm, num_channels=2), [-0.5, 0.5]
+    )
+
+
+def _write(tmp_path, data: bytes) -> str:
+    filename = str(tmp_path / "a.wav")
+    with open(filename, "wb") as f:
+        f.write(data)
+    return filename
+
+
+@pytest.mark.parametrize("num_frames", [1, 9999, 10000, 10001, 25037])
+def test_wav_file_chunks(tmp_path, num_frames):
+    rng = np.random.default_rng(num_frames)
+    pcm = rng.integers(-32768, 32768, size=(num_frames, 2)).astype("<i2")
+    data = make_wav(pcm.tobytes(), num_channels=2)
+    expected, _ = audio.read_wav_bytes(data)
+
+    with audio.WavFile(_write(tmp_path, data)) as f:
+        assert f.num_frames == num_frames
+        assert f.duration_sec == num_frames / 16000
+        chunks = list(f.iter_chunks(16000, chunk_sec=0.625))
+        np.testing.assert_array_equal(f.read(), expected)
+
+    # 0.625 s at 16 kHz
+    assert all(len(c) == 10000 for c in chunks[:-1])
+    assert 0 < len(chunks[-1]) <= 10000
+    np.testing.assert_array_equal(np.concatenate(chunks), expected)
+    np.testing.assert_array_equal(
+        np.concatenate(list(audio.iter_wav_chunks(data, 16000, chunk_sec=0.625))),
+        expected,
+    )
+
+
+@pytest.mark.parametrize("use_soxr", [True, False])
+def test_wav_file_resamples_chunks(tmp_path, monkeypatch, use_soxr):
+    if use_soxr and audio.soxr is None:
+        pytest.skip("soxr is not installed")
+    if not use_soxr:
+        monkeypatch.setattr(audio, "soxr", None)
+    pcm = np.zeros(8000 * 3 + 123, dtype="<i2")
+    data = make_wav(pcm.tobytes(), sample_rate=8000)
+    with audio.WavFile(_write(tmp_path, data)) as f:
+        num_samples = sum(len(c) for c in f.iter_chunks(16000, chunk_sec=1.0))
+    assert abs(num_samples - 2 * len(pcm)) <= 2
+
+
+def test_wav_file_rejects_other_files(tmp_path):
+    with pytest.raises(ValueError, match="not a wave file"):
+        audio.WavFile(_write(tmp_path, b"short"))
+    with pytest.raises(ValueError, match="not a wave file"):
+        audio.WavFile(_write(tmp_path, b"\x00" * 64))
+    with pytest.raises(ValueError, match="unsupported wave format"):
+        audio.WavFile(
+            _write(tmp_path, make_wav(b"\x00" * 16, bits=4, format_tag=0x0002))
+        )
+
+
+def test_read_wav_file(tmp_path):
+    pcm = np.array([-32768, 0, 16384], dtype="<i2")
+    samples, rate = audio.read_wav_file(_write(tmp_path, make_wav(pcm.tobytes())))
+    assert rate == 16000
+    np.testing.assert_allclose(samples, pcm / 32768.0)
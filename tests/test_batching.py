@@ -0,0 +1,144 @@
+import threading
+import time
+
+import pytest
+
+from batching import OfflineBatcher
+
+
+class BlockingDecoder:
+    """decode_batch that records its batches and can hold the first one."""
+
+    def __init__(self, block_first: bool = False):
+        self.batches = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not block_first:
+            self.release.set()
+
+    def __call__(self, recognizer, streams):
+        self.batches.append((recognizer, list(streams)))
+        self.started.set()
+        self.release.wait(5)
+        return [f"{recognizer}:{s}" for s in streams]
+
+
+@pytest.fixture
+def make_batcher():
+    batchers = []
+
+    def make(decode_batch, **kwargs):
+        batcher = OfflineBatcher(decode_batch, **kwargs)
+        batchers.append(batcher)
+        return batcher
+
+    yield make
+    for batcher in batchers:
+        batcher.shutdown()
+
+
+def test_queued_requests_are_decoded_together(make_batcher):
+    decoder = BlockingDecoder(block_first=True)
+    batcher = make_batcher(decoder, max_batch_size=8, max_wait_ms=50)
+
+    first = batcher.submit("k", "r", 0)
+    assert decoder.started.wait(5)
+    # Queued while the first batch is decoding
+    rest = [batcher.submit("k", "r", i) for i in range(1, 4)]
+    decoder.release.set()
+
+    assert first.result(5) == "r:0"
+    assert [f.result(5) for f in rest] == ["r:1", "r:2", "r:3"]
+    assert [streams for _, streams in decoder.batches] == [[0], [1, 2, 3]]
+
+
+def test_max_batch_size(make_batcher):
+    decoder = BlockingDecoder(block_first=True)
+    batcher = make_batcher(decoder, max_batch_size=2, max_wait_ms=50)
+
+    futures = [batcher.submit("k", "r", 0)]
+    assert decoder.started.wait(5)
+    futures += [batcher.submit("k", "r", i) for i in range(1, 6)]
+    decoder.release.set()
+
+    assert [f.result(5) for f in futures] == [f"r:{i}" for i in range(6)]
+    assert [streams for _, streams in decoder.batches] == [[0], [1, 2], [3, 4], [5]]
+
+
+def test_keys_and_recognizers_are_not_mixed(make_batcher):
+    decoder = BlockingDecoder(block_first=True)
+    batcher = make_batcher(decoder, max_batch_size=8, max_wait_ms=50)
+
+    blocker = batcher.submit("k", "r", 0)
+    assert decoder.started.wait(5)
+    # A reloaded model: same key, new recognizer
+    same_key = [batcher.submit("k", "r", 1), batcher.submit("k", "r2", 2)]
+    other_key = batcher.submit("other", "r3", 3)
+    decoder.release.set()
+
+    assert blocker.result(5) == "r:0"
+    assert [f.result(5) for f in same_key] == ["r:1", "r2:2"]
+    assert other_key.result(5) == "r3:3"
+    assert sorted(decoder.batches) == [
+        ("r", [0]), ("r", [1]), ("r2", [2]), ("r3", [3])
+    ]
+
+
+def test_errors_fail_the_whole_batch(make_batcher):
+    def decode_batch(recognizer, streams):
+        if "bad" in streams:
+            raise RuntimeError("boom")
+        return [f"{recognizer}:{s}" for s in streams]
+
+    batcher = make_batcher(decode_batch, max_wait_ms=20)
+    futures = [batcher.submit("k", "r", s) for s in ("bad", 1, 2)]
+    for f in futures:
+        with pytest.raises(RuntimeError, match="boom"):
+            f.result(5)
+
+    # The thread survives
+    assert batcher.submit("k", "r", 9).result(5) == "r:9"
+
+
+def test_cancelled_requests_are_skipped(make_batcher):
+    decoder = BlockingDecoder(block_first=True)
+    batcher = make_batcher(decoder, max_wait_ms=50)
+
+    batcher.submit("k", "r", 0)
+    assert decoder.started.wait(5)
+    cancelled = batcher.submit("k", "r", 1)
+    kept = batcher.submit("k", "r", 2)
+    assert cancelled.cancel()
+    decoder.release.set()
+
+    assert kept.result(5) == "r:2"
+    assert [streams for _, streams in decoder.batches] == [[0], [2]]
+
+
+def test_idle_threads_retire(make_batcher):
+    batcher = make_batcher(BlockingDecoder(), max_wait_ms=1, idle_sec=0.2)
+
+    assert batcher.submit("a", "r", 0).result(5) == "r:0"
+    assert batcher.submit("b", "r", 1).result(5) == "r:1"
+    assert batcher.num_threads == 2
+
+    deadline = time.monotonic() + 5
+    while batcher.num_threads and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert batcher.num_threads == 0
+
+    # A new thread serves the key again
+    assert batcher.submit("a", "r", 2).result(5) == "r:2"
+    assert batcher.num_threads == 1
+
+
+def test_busy_keys_keep_their_thread(make_batcher):
+    batcher = make_batcher(BlockingDecoder(), max_wait_ms=1, idle_sec=0.5)
+    thread = None
+    for i in range(10):
+        assert batcher.submit("k", "r", i).result(5) == f"r:{i}"
+        with batcher._lock:
+            if thread is None:
+                thread = batcher._threads["k"]
+            assert batcher._threads["k"] is thread
+        time.sleep(0.02)
@@ -0,0 +1,120 @@
+import os
+import time
+
+import pytest
+
+from jobs import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs"), max_attempts=2)
+
+
+def test_nothing_is_created_until_a_submit(store):
+    assert store.claim(60) is None
+    assert store.get("missing") is None
+    assert store.counts() == {}
+    assert store.purge(0) == 0
+    assert not os.path.exists(store.directory)
+
+
+def test_claims_by_priority_then_age(store):
+    low = store.submit({"n": 1}, priority="low")
+    normal_1 = store.submit({"n": 2})
+    high = store.submit({"n": 3}, priority="high")
+    normal_2 = store.submit({"n": 4})
+
+    assert store.get(normal_2)["queue_position"] == 2
+    assert store.get(low)["queue_position"] == 3
+
+    claimed = [store.claim(60) for _ in range(4)]
+    assert [job["job_id"] for job in claimed] == [high, normal_1, normal_2, low]
+    assert claimed[0]["request"] == {"n": 3}
+    assert claimed[0]["priority"] == "high"
+    assert claimed[0]["attempts"] == 1
+    assert store.claim(60) is None
+    assert store.counts() == {"running": 4}
+
+
+def test_unknown_priority(store):
+    with pytest.raises(ValueError, match="Unknown priority"):
+        store.submit({}, priority="urgent")
+
+
+def test_finish_removes_the_audio(store):
+    job_id = store.submit({"options": {}}, audio=b"RIFF....")
+    job = store.claim(60)
+    assert open(job["audio_path"], "rb").read() == b"RIFF...."
+
+    store.finish(job_id, {"text": "xin chào"})
+    assert not os.path.exists(job["audio_path"])
+    job = store.get(job_id)
+    assert job["state"] == "done"
+    assert job["result"] == {"text": "xin chào"}
+    assert job["finished_at"] is not None
+
+
+def test_fail_records_the_error(store):
+    job_id = store.submit({})
+    store.claim(60)
+    store.fail(job_id, "Unsupported repo_id: x", status_code=400)
+    job = store.get(job_id)
+    assert job["state"] == "failed"
+    assert job["error"] == "Unsupported repo_id: x"
+    assert job["status_code"] == 400
+
+
+def test_expired_lease_is_claimed_again(store):
+    job_id = store.submit({})
+    # The worker that claimed it stopped renewing the lease
+    assert store.claim(-1)["job_id"] == job_id
+
+    job = store.claim(60)
+    assert job["job_id"] == job_id
+    assert job["attempts"] == 2
+    # Still leased
+    assert store.claim(60) is None
+
+
+def test_renewed_lease_is_kept(store):
+    job_id = store.submit({})
+    store.claim(-1)
+    store.renew([job_id], 60)
+    assert store.claim(60) is None
+
+
+def test_job_is_given_up_after_max_attempts(store):
+    job_id = store.submit({}, audio=b"data")
+    store.claim(-1)
+    job = store.claim(-1)
+    assert job["attempts"] == 2
+
+    assert store.claim(60) is None
+    job = store.get(job_id)
+    assert job["state"] == "failed"
+    assert job["status_code"] == 500
+    assert job["error"] == "Worker stopped while running the job"
+
+
+def test_purge(store):
+    done = store.submit({}, audio=b"a")
+    store.claim(60)
+    store.finish(done, {"text": ""})
+
+    # Given up after its workers died; the audio is still there
+    given_up = store.submit({}, audio=b"b")
+    audio_path = store.claim(-1)["audio_path"]
+    store.claim(-1)
+    store.claim(60)
+    assert os.path.exists(audio_path)
+
+    queued = store.submit({})
+    assert store.purge(3600) == 0
+
+    time.sleep(0.01)
+    assert store.purge(0) == 2
+    assert store.get(done) is None
+    assert store.get(given_up) is None
+    assert not os.path.exists(audio_path)
+    assert store.get(queued)["state"] == "queued"
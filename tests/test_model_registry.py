@@ -0,0 +1,213 @@
+import threading
+import time
+
+import pytest
+
+import model_registry
+from model_registry import ModelRegistry
+
+
+class FakeLoader:
+    """Builds a string per key and grows the fake RSS by mb_per_load."""
+
+    def __init__(self, mb_per_load: int = 0):
+        self.mb_per_load = mb_per_load
+        self.rss = 0
+        self.loads = []
+
+    def __call__(self, repo_id, decoding_method="greedy_search"):
+        self.loads.append((repo_id, decoding_method))
+        self.rss += self.mb_per_load << 20
+        return f"{repo_id}/{decoding_method}"
+
+
+def key_fn(repo_id, decoding_method="greedy_search"):
+    if not repo_id:
+        raise ValueError("Unsupported repo_id")
+    return (repo_id, decoding_method)
+
+
+@pytest.fixture
+def loader(monkeypatch):
+    loader = FakeLoader()
+    monkeypatch.setattr(model_registry, "current_rss_bytes", lambda: loader.rss)
+    return loader
+
+
+def keys(registry):
+    return [tuple(e["key"]) for e in registry.entries()]
+
+
+def test_lru_eviction(loader):
+    registry = ModelRegistry(loader, key_fn, max_models=2)
+    evicted = []
+    registry.on_evict.append(evicted.append)
+
+    registry.get("a")
+    registry.get("b")
+    # a becomes the most recently used
+    assert registry.get("a") == "a/greedy_search"
+    registry.get("c")
+
+    assert evicted == ["b/greedy_search"]
+    assert keys(registry) == [("a", "greedy_search"), ("c", "greedy_search")]
+    assert len(loader.loads) == 3
+
+    registry.get("b")
+    assert evicted[-1] == "a/greedy_search"
+    assert len(loader.loads) == 4
+
+
+def test_memory_budget(loader):
+    loader.mb_per_load = 100
+    registry = ModelRegistry(loader, key_fn, memory_budget_mb=250)
+
+    registry.get("a")
+    registry.get("b")
+    assert registry.total_rss_bytes() == 200 << 20
+    registry.get("c")
+
+    assert keys(registry) == [("b", "greedy_search"), ("c", "greedy_search")]
+    assert [e["rss_mb"] for e in registry.entries()] == [100.0, 100.0]
+
+
+def test_model_over_budget_is_kept(loader):
+    loader.mb_per_load = 300
+    registry = ModelRegistry(loader, key_fn, memory_budget_mb=250)
+    registry.get("a")
+    registry.get("b")
+    # The model that was just loaded always stays
+    assert keys(registry) == [("b", "greedy_search")]
+
+
+def test_configure_evicts(loader):
+    registry = ModelRegistry(loader, key_fn)
+    for repo_id in "abcd":
+        registry.get(repo_id)
+    evicted = []
+    registry.on_evict.append(evicted.append)
+
+    registry.configure(max_models=1, memory_budget_mb=0)
+    assert evicted == ["a/greedy_search", "b/greedy_search", "c/greedy_search"]
+    assert keys(registry) == [("d", "greedy_search")]
+
+
+def test_pinned_models_are_not_evicted(loader):
+    registry = ModelRegistry(loader, key_fn, max_models=1)
+    registry.get("a")
+    registry.pin(registry.key("a"))
+
+    registry.get("b")
+    assert keys(registry) == [("a", "greedy_search"), ("b", "greedy_search")]
+    registry.get("c")
+    assert keys(registry) == [("a", "greedy_search"), ("c", "greedy_search")]
+    assert [e["pinned"] for e in registry.entries()] == [True, False]
+
+
+def test_concurrent_loads_of_one_key_are_single_flight(loader):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_load(*args):
+        started.set()
+        release.wait(5)
+        return loader(*args)
+
+    registry = ModelRegistry(slow_load, key_fn)
+    lookups = []
+    registry.on_lookup.append(lambda key, hit: lookups.append(hit))
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.get("a")))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    assert started.wait(5)
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert results == ["a/greedy_search"] * 5
+    assert loader.loads == [("a", "greedy_search")]
+    assert lookups == [False] * 5
+    assert registry.get("a") == "a/greedy_search"
+    assert lookups[-1] is True
+
+
+def test_other_keys_load_in_parallel(loader):
+    started = threading.Event()
+    release = threading.Event()
+
+    def load(repo_id, *args):
+        if repo_id == "slow":
+            started.set()
+            release.wait(5)
+        return loader(repo_id, *args)
+
+    registry = ModelRegistry(load, key_fn)
+    t = threading.Thread(target=registry.get, args=("slow",))
+    t.start()
+    assert started.wait(5)
+    # Not blocked by the load of "slow"
+    assert registry.get("fast") == "fast/greedy_search"
+    release.set()
+    t.join(5)
+    assert sorted(loader.loads) == [
+        ("fast", "greedy_search"), ("slow", "greedy_search")
+    ]
+
+
+def test_failed_load_is_retried(loader):
+    calls = []
+
+    def load(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("download failed")
+        return loader(*args)
+
+    registry = ModelRegistry(load, key_fn)
+    with pytest.raises(RuntimeError):
+        registry.get("a")
+    assert registry.entries() == []
+    assert registry.get("a") == "a/greedy_search"
+
+
+def test_invalid_arguments_are_rejected_before_loading(loader):
+    registry = ModelRegistry(loader, key_fn)
+    with pytest.raises(ValueError):
+        registry.get("")
+    assert loader.loads == []
+
+
+def test_shared_variants(loader):
+    registry = ModelRegistry(
+        loader, key_fn, weights_fn=lambda key: key[0], share_variants=True
+    )
+    registry.get("a", "greedy_search")
+
+    model, key = registry.get_with_key("a", "modified_beam_search")
+    assert model == "a/greedy_search"
+    assert key == ("a", "greedy_search")
+    assert loader.loads == [("a", "greedy_search")]
+
+    registry.configure(max_models=0, memory_budget_mb=0, share_variants=False)
+    model, key = registry.get_with_key("a", "modified_beam_search")
+    assert key == ("a", "modified_beam_search")
+    assert len(loader.loads) == 2
+
+
+def test_callback_errors_are_contained(loader):
+    registry = ModelRegistry(loader, key_fn, max_models=1)
+
+    def broken(*args):
+        raise RuntimeError("callback failed")
+
+    registry.on_evict.append(broken)
+    registry.on_load.append(broken)
+    registry.get("a")
+    registry.get("b")
+    assert keys(registry) == [("b", "greedy_search")]
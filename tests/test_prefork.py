@@ -0,0 +1,42 @@
+import pytest
+
+from prefork import WorkerPlan, plan_workers
+
+
+@pytest.mark.parametrize(
+    "cpus,threads_per_session,workers,expected",
+    [
+        # One process whose sessions use threads_per_session threads
+        (8, 2, 1, WorkerPlan(1, 2, 5)),
+        # Enough processes to cover all cores
+        (8, 2, 0, WorkerPlan(4, 2, 2)),
+        (8, 3, 0, WorkerPlan(2, 3, 2)),
+        (1, 4, 0, WorkerPlan(1, 4, 2)),
+        (8, 0, 1, WorkerPlan(1, 1, 9)),
+    ],
+)
+def test_default_policy(cpus, threads_per_session, workers, expected):
+    assert plan_workers(cpus, threads_per_session, workers) == expected
+
+
+def test_prefork_uses_single_threaded_sessions():
+    assert plan_workers(8, 4, prefork=True) == WorkerPlan(8, 1, 2)
+    assert plan_workers(8, 4, workers=2, prefork=True) == WorkerPlan(2, 1, 5)
+
+
+def test_throughput_policy():
+    assert plan_workers(8, 4, workers=1, policy="throughput") == WorkerPlan(1, 1, 9)
+    assert plan_workers(8, 4, policy="throughput") == WorkerPlan(8, 1, 2)
+
+
+def test_latency_policy():
+    assert plan_workers(8, 1, workers=1, policy="latency") == WorkerPlan(1, 8, 2)
+    assert plan_workers(8, 1, workers=2, policy="latency") == WorkerPlan(2, 4, 2)
+    # workers=0 gives the whole machine to one process
+    assert plan_workers(8, 1, policy="latency") == WorkerPlan(1, 8, 2)
+    assert plan_workers(2, 1, workers=4, policy="latency") == WorkerPlan(4, 1, 2)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError, match="Unknown threading policy"):
+        plan_workers(8, 1, policy="fast")
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from preload import PreloadEntry, Preloader, load_manifest, parse_preload_models
+
+
+def parse(spec):
+    return parse_preload_models(spec, "modified_beam_search", 4)
+
+
+def test_defaults_fill_missing_parts():
+    spec = "hynt/a, hynt/b:greedy_search, hynt/c::8, hynt/d:modified_beam_search:15"
+    assert parse(spec) == [
+        PreloadEntry("hynt/a", "modified_beam_search", 4),
+        PreloadEntry("hynt/b", "greedy_search", 4),
+        PreloadEntry("hynt/c", "modified_beam_search", 8),
+        PreloadEntry("hynt/d", "modified_beam_search", 15),
+    ]
+
+
+def test_newlines_and_empty_items():
+    assert parse("\n hynt/a ,,\nhynt/b\n") == [
+        PreloadEntry("hynt/a", "modified_beam_search", 4),
+        PreloadEntry("hynt/b", "modified_beam_search", 4),
+    ]
+
+
+@pytest.mark.parametrize("spec", ["", " ", "none", "off", "OFF", " None "])
+def test_nothing_to_preload(spec):
+    assert parse(spec) == []
+
+
+@pytest.mark.parametrize("spec", ["hynt/a:greedy_search:4:extra", "hynt/a::many"])
+def test_invalid_entries(spec):
+    with pytest.raises(ValueError):
+        parse(spec)
+
+
+def test_manifest(tmp_path):
+    filename = tmp_path / "preload.json"
+    filename.write_text(
+        json.dumps([
+            {"repo_id": "hynt/a"},
+            {"repo_id": "hynt/b", "decoding_method": "greedy_search", "num_active_paths": 1},
+        ])
+    )
+    assert load_manifest(str(filename), "modified_beam_search", 4) == [
+        PreloadEntry("hynt/a", "modified_beam_search", 4),
+        PreloadEntry("hynt/b", "greedy_search", 1),
+    ]
+
+    filename.write_text(json.dumps({"repo_id": "hynt/a"}))
+    with pytest.raises(ValueError, match="expected a list"):
+        load_manifest(str(filename), "modified_beam_search", 4)
+
+
+def test_preloader_loads_each_entry_once():
+    loaded, warmed = [], []
+
+    def load(repo_id, decoding_method, num_active_paths):
+        if repo_id == "broken":
+            raise RuntimeError("no such model")
+        loaded.append(repo_id)
+        return repo_id
+
+    entries = parse("hynt/a, hynt/b, hynt/a")
+    preloader = Preloader(entries, load=load, warm_up=warmed.append, num_workers=2)
+    assert not preloader.ready
+    preloader.run()
+    assert preloader.ready and not preloader.failed
+    assert sorted(loaded) == sorted(warmed) == ["hynt/a", "hynt/b"]
+    assert [s["state"] for s in preloader.status()] == ["warm", "warm"]
+
+    preloader = Preloader(parse("broken"), load=load, warm_up=warmed.append)
+    preloader.run()
+    assert preloader.failed and not preloader.ready
+    assert preloader.status()[0]["error"] == "no such model"
+
+    assert Preloader([], load=load, warm_up=warmed.append).ready
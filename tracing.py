@@ -0,0 +1,381 @@
+"""Distributed tracing with OpenTelemetry semantics and no dependencies.
+
+A server span is started for every HTTP request, continuing the trace of
+a W3C ``traceparent`` header if the caller sent one, and the pipeline opens
+child spans for its stages. The current span lives in a context variable,
+so spans opened on the threads of the inference pool nest correctly.
+
+Finished spans are encoded as OTLP/JSON and exported in batches from a
+background thread, either appended to a file (one
+``ExportTraceServiceRequest`` per line, the format of the OpenTelemetry
+collector's file exporter) or posted to an OTLP/HTTP endpoint such as
+``http://otel-collector:4318/v1/traces``.
+
+Unless :func:`configure` is called with an exporter, or when the trace is
+not sampled, no spans are created and :func:`span` costs one context
+variable lookup.
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# SpanKind of OTLP
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def _random_id(num_bytes: int) -> str:
+    return os.urandom(num_bytes).hex()
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: str = "",
+        kind: int = KIND_INTERNAL,
+        start_ns: Optional[int] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.error: Optional[str] = None
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def set_error(self, message: str) -> None:
+        self.error = message
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if _exporter is not None:
+            _exporter.export(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            # STATUS_CODE_UNSET or STATUS_CODE_ERROR
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"key": k, "value": _otlp_value(v)}
+        for k, v in attributes.items()
+        if v is not None
+    ]
+
+
+class Exporter:
+    """
+    Export spans in batches from a background thread; spans are dropped if
+    max_queue of them are waiting.
+
+    Args:
+      write:
+        A callable ``write(payload)`` that sends one OTLP/JSON
+        ``ExportTraceServiceRequest`` (a dict).
+      service_name:
+        The ``service.name`` resource attribute.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[Dict[str, Any]], None],
+        service_name: str,
+        max_batch: int = 256,
+        flush_sec: float = 1.0,
+        max_queue: int = 4096,
+    ):
+        self._write = write
+        self.service_name = service_name
+        self._resource = {
+            "attributes": _otlp_attributes({"service.name": service_name})
+        }
+        self.max_batch = max_batch
+        self.flush_sec = flush_sec
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = 0
+        self.dropped = 0
+
+    def export(self, span: Span) -> None:
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def shutdown(self) -> None:
+        """Export what is queued and stop the thread."""
+        with self._lock:
+            thread = self._thread if self._pid == os.getpid() else None
+            self._thread = None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=10)
+
+    def _ensure_thread(self) -> None:
+        # Threads do not survive fork(), so each worker starts its own
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(self._queue.maxsize)
+            self._thread = threading.Thread(
+                target=self._run, args=(self._queue,), name="trace-exporter", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, q: "queue.Queue[Optional[Span]]") -> None:
+        stop = False
+        while not stop:
+            batch: List[Span] = []
+            deadline = time.monotonic() + self.flush_sec
+            while len(batch) < self.max_batch:
+                try:
+                    span = q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if span is None:
+                    stop = True
+                    break
+                batch.append(span)
+            if batch:
+                self._send(batch)
+
+    def _send(self, batch: List[Span]) -> None:
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": self._resource,
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": self.service_name},
+                            "spans": [span.to_otlp() for span in batch],
+                        }
+                    ],
+                }
+            ]
+        }
+        try:
+            self._write(payload)
+        except Exception as e:
+            print(f"[tracing] Failed to export {len(batch)} spans: {e}")
+
+
+def file_writer(filename: str) -> Callable[[Dict[str, Any]], None]:
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    def _write(payload: Dict[str, Any]) -> None:
+        line = json.dumps(payload, ensure_ascii=False, separators=(",", ":")) + "\n"
+        # One write per batch, so lines of several workers do not interleave
+        with open(filename, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    return _write
+
+
+def otlp_http_writer(endpoint: str, timeout_sec: float = 10.0) -> Callable[[Dict[str, Any]], None]:
+    import httpx
+
+    client: Optional[httpx.Client] = None
+
+    def _write(payload: Dict[str, Any]) -> None:
+        nonlocal client
+        if client is None:
+            client = httpx.Client(timeout=timeout_sec)
+        r = client.post(endpoint, json=payload)
+        if r.status_code >= 300:
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+
+    return _write
+
+
+_exporter: Optional[Exporter] = None
+_sample_rate = 1.0
+
+
+def configure(exporter: Optional[Exporter], sample_rate: float = 1.0) -> None:
+    """
+    Args:
+      exporter:
+        Where finished spans go; None disables tracing.
+      sample_rate:
+        Fraction of new traces that are recorded. Traces continued from a
+        traceparent header follow the caller's sampling decision.
+    """
+    global _exporter, _sample_rate
+    _exporter = exporter
+    _sample_rate = sample_rate
+
+
+def shutdown() -> None:
+    if _exporter is not None:
+        _exporter.shutdown()
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+
+@contextmanager
+def server_span(name: str, traceparent: Optional[str] = None, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Start the root span of this service for an incoming request. Yields
+    None if tracing is off or the trace is not sampled.
+    """
+    if _exporter is None:
+        yield None
+        return
+
+    m = _TRACEPARENT.match((traceparent or "").strip().lower())
+    if m is not None and m.group(1) != "0" * 32 and m.group(2) != "0" * 16:
+        trace_id, parent_id, flags = m.groups()
+        sampled = int(flags, 16) & 1
+    else:
+        trace_id, parent_id = _random_id(16), ""
+        sampled = random.random() < _sample_rate
+    if not sampled:
+        yield None
+        return
+
+    span = Span(name, trace_id, parent_id, kind=KIND_SERVER, attributes=attributes)
+    with _activate(span):
+        yield span
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """A child of the current span; yields None outside of a sampled trace."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace_id, parent.span_id, attributes=attributes)
+    with _activate(child):
+        yield child
+
+
+@contextmanager
+def _activate(span: Span) -> Iterator[Span]:
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current.reset(token)
+        span.end()
+
+
+def traced(name: str):
+    """Run a function or coroutine function in a child span of the caller's span."""
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record(name: str, seconds: float, **attributes) -> None:
+    """Record a child span of the current span that took seconds and ends now."""
+    parent = _current.get()
+    if parent is None:
+        return
+    end_ns = time.time_ns()
+    child = Span(
+        name,
+        parent.trace_id,
+        parent.span_id,
+        start_ns=end_ns - int(seconds * 1e9),
+        attributes=attributes,
+    )
+    child.end(end_ns)
+
+
+def set_attributes(**attributes) -> None:
+    """Add attributes to the current span, if any."""
+    current_span = _current.get()
+    if current_span is not None:
+        current_span.set_attributes(**attributes)
+
+
+def inject(headers: Dict[str, str]) -> Dict[str, str]:
+    """Add the traceparent of the current span to outgoing headers."""
+    current_span = _current.get()
+    if current_span is not None:
+        headers["traceparent"] = current_span.traceparent
+    return headers
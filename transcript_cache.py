@@ -0,0 +1,236 @@
+"""Cache of finished transcripts keyed by the audio content.
+
+Clients re-submit identical files, e.g. IVR prompts or uploads retried over
+flaky networks. :class:`TranscriptCache` maps a hash of the uploaded bytes
+plus the model key to the response of the first request, so a repeat skips
+ffmpeg, model loading and decoding altogether.
+
+The memory tier is an LRU bounded by the number of entries and their total
+size; entries expire after ``ttl_sec``. The optional disk tier keeps one
+small JSON file per entry under ``disk_dir``, so it survives restarts and is
+shared by all processes of a pre-forked server. Its methods do file I/O,
+so async callers should run them on a worker thread when it is enabled.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+def audio_digest(data: bytes) -> str:
+    """Hash of the raw audio bytes. hashlib releases the GIL while hashing."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+class TranscriptCache:
+    """
+    Args:
+      max_entries:
+        Maximum number of results in memory; 0 disables the cache.
+      max_mb:
+        Maximum total size of the results in memory, measured as JSON;
+        0 means no limit.
+      ttl_sec:
+        Results older than this are not served; 0 means they never expire.
+      disk_dir:
+        Directory of the disk tier; empty disables it.
+      disk_max_mb:
+        The oldest files of the disk tier are removed when it grows beyond
+        this; 0 means no limit.
+    """
+
+    # Check the size of the disk tier every this many writes
+    _PRUNE_EVERY = 64
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_mb: float = 64,
+        ttl_sec: float = 3600,
+        disk_dir: str = "",
+        disk_max_mb: float = 1024,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * (1 << 20))
+        self.ttl_sec = ttl_sec
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = int(disk_max_mb * (1 << 20))
+
+        self._lock = threading.Lock()
+        # key -> (created, size, result)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.enabled and disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(digest: str, model_key: Hashable, *extra) -> str:
+        """
+        Args:
+          digest:
+            From :func:`audio_digest`.
+          model_key:
+            The normalized model key, e.g. from ``registry.key()``.
+          extra:
+            Other options that change the result, e.g. long-form mode.
+        """
+        parts = json.dumps([digest, model_key, *extra], default=str)
+        return hashlib.blake2b(parts.encode(), digest_size=20).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                created, size, result = item
+                if not self._expired(created, now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+                self._total_bytes -= size
+
+        item = self._read_disk(key, now)
+        with self._lock:
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        # Keep the original age, so the entry still expires ttl_sec after
+        # it was first cached
+        created, result = item
+        self._put_memory(key, result, created)
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        self._put_memory(key, result, now)
+        self._write_disk(key, result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self._total_bytes / (1 << 20), 2),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_sec > 0 and now - created > self.ttl_sec
+
+    def _put_memory(self, key: str, result: Dict[str, Any], created: float) -> None:
+        size = len(json.dumps(result, ensure_ascii=False).encode())
+        if self.max_bytes > 0 and size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[key] = (created, size, result)
+            self._total_bytes += size
+
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes > 0 and self._total_bytes > self.max_bytes
+            ):
+                _, (_, size, _) = self._entries.popitem(last=False)
+                self._total_bytes -= size
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key + ".json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """Return a tuple (created, result), where created is the file's mtime."""
+        if not self.disk_dir:
+            return None
+        filename = self._disk_path(key)
+        try:
+            created = os.path.getmtime(filename)
+            if self._expired(created, now):
+                os.remove(filename)
+                return None
+            with open(filename, encoding="utf-8") as f:
+                return created, json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, result: Dict[str, Any]) -> None:
+        if not self.disk_dir:
+            return
+        filename = self._disk_path(key)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # Write to a temp file and rename, so readers in other processes
+            # never see a partial file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp, filename)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"[cache] Failed to write {filename}: {e}")
+            if tmp is not None:
+                _remove(tmp)
+            return
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self._PRUNE_EVERY == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self) -> None:
+        """Remove expired files, then the oldest ones until under the limit."""
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                filename = os.path.join(root, name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                if self._expired(st.st_mtime, now):
+                    _remove(filename)
+                else:
+                    files.append((st.st_mtime, st.st_size, filename))
+
+        total = sum(size for _, size, _ in files)
+        if self.disk_max_bytes <= 0 or total <= self.disk_max_bytes:
+            return
+        for _, size, filename in sorted(files):
+            _remove(filename)
+            total -= size
+            if total <= self.disk_max_bytes:
+                break
+
+
+def _remove(filename: str) -> None:
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
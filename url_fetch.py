@@ -0,0 +1,207 @@
+"""Download audio from URLs without blocking the event loop.
+
+:class:`UrlFetcher` keeps one pooled ``httpx.AsyncClient``, so repeated
+downloads from the same host (e.g. an object store) reuse open TCP/TLS
+connections. Each download is bounded in size and in total time.
+
+The body is handed over chunk by chunk through a :class:`ByteFeed`, from
+which a worker thread can pipe it into ffmpeg while the rest is still
+arriving.
+"""
+
+import asyncio
+import threading
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+
+
+class FetchError(Exception):
+    pass
+
+
+class FetchTooLarge(FetchError):
+    pass
+
+
+class FetchCancelled(FetchError):
+    pass
+
+
+class ByteFeed:
+    """
+    Bytes that arrive on the event loop and are read by worker threads.
+    Everything received is kept, so the feed can be iterated while the
+    download is running and read as a whole once it is done.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._chunks: List[bytes] = []
+        self._num_bytes = 0
+        self._done = False
+        self._error: Optional[Exception] = None
+        self._data: Optional[bytes] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return isinstance(self._error, FetchCancelled)
+
+    def put(self, chunk: bytes) -> None:
+        with self._cond:
+            self._chunks.append(chunk)
+            self._num_bytes += len(chunk)
+            self._cond.notify_all()
+
+    def close(self, error: Optional[Exception] = None) -> None:
+        """Mark the end of the data; readers raise error if it is given."""
+        with self._cond:
+            if self._done:
+                return
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def cancel(self) -> None:
+        """Make readers stop with FetchCancelled, e.g. after a cache hit."""
+        with self._cond:
+            self._done = True
+            self._error = FetchCancelled("cancelled")
+            self._cond.notify_all()
+
+    def peek(self, n: int) -> bytes:
+        """Wait for the first n bytes, or fewer if the data is shorter."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._num_bytes >= n or self._done)
+            if self._error is not None and self._num_bytes < n:
+                raise self._error
+            return b"".join(self._chunks)[:n]
+
+    def read_all(self) -> bytes:
+        """Wait for the download to finish and return all of the data."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._done)
+            if self._error is not None:
+                raise self._error
+            if self._data is None:
+                self._data = b"".join(self._chunks)
+            return self._data
+
+    def __iter__(self) -> Iterator[bytes]:
+        i = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: i < len(self._chunks) or self._done)
+                if self._error is not None:
+                    raise self._error
+                if i == len(self._chunks):
+                    return
+                chunk = self._chunks[i]
+            i += 1
+            yield chunk
+
+
+class UrlFetcher:
+    """
+    Args:
+      max_bytes:
+        Downloads larger than this fail with FetchTooLarge.
+      timeout_sec:
+        Deadline for a whole download, including redirects.
+      connect_timeout_sec:
+        Deadline for opening a connection.
+      max_connections:
+        Maximum number of open connections, over all hosts.
+      max_keepalive:
+        Maximum number of idle connections kept open for reuse.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        timeout_sec: float = 60.0,
+        connect_timeout_sec: float = 5.0,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+    ):
+        self.max_bytes = max_bytes
+        self.timeout_sec = timeout_sec
+        self._timeout = httpx.Timeout(timeout_sec, connect=connect_timeout_sec)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=60.0,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created on first use, i.e. on the event loop of the process that
+        # serves requests, which matters for pre-forked workers
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self._timeout,
+                limits=self._limits,
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def fetch_into(
+        self, url: str, feed: ByteFeed, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        """
+        Download url into feed and close it. On failure, feed is closed
+        with the error and the error is raised.
+
+        Args:
+          headers:
+            Extra request headers, e.g. a traceparent.
+        """
+        try:
+            await asyncio.wait_for(self._fetch_into(url, feed, headers), self.timeout_sec)
+        except asyncio.TimeoutError:
+            error = FetchError(f"timed out after {self.timeout_sec:g}s")
+            feed.close(error)
+            raise error
+        except FetchError as e:
+            feed.close(e)
+            raise
+        except httpx.HTTPError as e:
+            error = FetchError(str(e) or type(e).__name__)
+            feed.close(error)
+            raise error
+        except BaseException as e:
+            # e.g. the request was cancelled
+            feed.close(FetchError(f"download aborted: {type(e).__name__}"))
+            raise
+        feed.close()
+
+    async def fetch(self, url: str) -> bytes:
+        feed = ByteFeed()
+        await self.fetch_into(url, feed)
+        return feed.read_all()
+
+    async def _fetch_into(
+        self, url: str, feed: ByteFeed, headers: Optional[Dict[str, str]]
+    ) -> None:
+        if not url.lower().startswith(("http://", "https://")):
+            raise FetchError("Only http(s) URLs are supported")
+
+        async with self._get_client().stream("GET", url, headers=headers) as response:
+            if response.status_code >= 400:
+                raise FetchError(f"HTTP {response.status_code}")
+
+            length = response.headers.get("content-length", "")
+            if length.isdigit() and int(length) > self.max_bytes:
+                raise FetchTooLarge(f"{int(length)} bytes")
+
+            num_bytes = 0
+            async for chunk in response.aiter_bytes():
+                num_bytes += len(chunk)
+                if num_bytes > self.max_bytes:
+                    raise FetchTooLarge(f"> {self.max_bytes} bytes")
+                feed.put(chunk)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None